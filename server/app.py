@@ -1,30 +1,78 @@
+import time
+
 from flask import Flask, jsonify
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
-from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from sqlalchemy.exc import SQLAlchemyError
 
+from database import SQLAlchemy, pool_status
+import compression
+import instrumentation
+import ratelimit
 
-app = Flask(__name__)
-app.config.from_object('config.Config')
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-manager = Manager(app)
-manager.add_command('db', MigrateCommand)
+db = SQLAlchemy()
+migrate = Migrate()
+ma = Marshmallow()
 
-ma = Marshmallow(app)
 
-@app.route('/ping', methods=['GET'])
 def ping_pong():
     return jsonify('~~*!pong!*~~')
 
-if __name__ == '__main__':
+
+def health():
+    """Состояние пула соединений и время запроса к базе."""
+    response = {'status': 'ok', 'db': {}}
+    started = time.monotonic()
+    try:
+        db.session.execute('SELECT 1')
+    except SQLAlchemyError as e:
+        response['status'] = 'error'
+        response['db']['error'] = str(e)
+    response['db']['latency_ms'] = round((time.monotonic() - started) * 1000, 3)
+    response['pool'] = pool_status(db.engine.pool)
+    return jsonify(response), 200 if response['status'] == 'ok' else 503
+
+
+def create_app(config_object='config.Config'):
+    """Создать и настроить приложение.
+
+    Все процессы сервера создают приложение одной и той же функцией, поэтому
+    расширения и блюпринты у них зарегистрированы одинаково.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    ma.init_app(app)
+    instrumentation.init_app(app)
+    ratelimit.init_app(app)
+    compression.init_app(app)
+
     from authors.blueprint import authors
     from books.blueprint import books as blueprint_books
-    from models import *
-    db.create_all()
+    from jobs.blueprint import jobs
 
+    app.add_url_rule('/ping', 'ping_pong', ping_pong, methods=['GET'])
+    app.add_url_rule('/health', 'health', health, methods=['GET'])
     app.register_blueprint(authors)
     app.register_blueprint(blueprint_books)
-    app.run(debug=True, port=8080, host='0.0.0.0')
+    app.register_blueprint(jobs)
+    return app
+
+
+def init_db(app):
+    """Создать недостающие таблицы."""
+    with app.app_context():
+        db.create_all()
+
+
+app = create_app()
+# Скрипты и тесты работают с базой без контекста приложения
+db.app = app
+
+manager = Manager(app)
+manager.add_command('db', MigrateCommand)
+
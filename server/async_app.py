@@ -0,0 +1,607 @@
+"""Асинхронный режим сервера для большого количества одновременных читающих клиентов.
+
+GET /books и GET /authors обрабатываются в event loop: запросы строятся теми
+же моделями и функциями пагинации, что и во Flask-приложении, и выполняются
+асинхронным драйвером (aiomysql для MySQL, aiosqlite для SQLite) через
+собственный пул соединений. Ответы сериализуются теми же схемами. Остальные
+запросы (изменения, поиск, /health, /metrics) передаются Flask-приложению
+в пул потоков, поэтому контракт API в обоих режимах один.
+
+Запуск из папки server:
+> python async_app.py
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from aiohttp import web
+from multidict import CIMultiDict
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Query
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import author_stats
+import compression
+from app import app as flask_app, db
+from batch import BatchError, ids_arg, order_by_ids
+from cache import author_key, book_key
+from conditional import check_not_modified, make_etag, page_validators
+from fieldsets import (
+    AUTHOR_EXTRAS, AUTHOR_KEYS, AUTHOR_RELATIONS, BOOK_KEYS, BOOK_RELATIONS, FieldsError, fieldset_args, query_options
+)
+from config import (
+    ASYNC_DB_POOL_SIZE, ASYNC_SERVER_PORT, ASYNC_WSGI_THREADS, AUTHOR_STATS_TOP, BATCH_MAX_IDS
+)
+from instrumentation import metrics
+from models import Author, AuthorStats, Book, books
+import ratelimit
+import serializers
+from pagination import (
+    CursorError, PageSizeError, keyset_query, keyset_result, limit_arg, page_args, page_pagination, top_books_arg
+)
+from schemas import AuthorSchemaExt, BookSchemaExt
+from streaming import ListEncoder, stream_mode
+
+
+error_resp = {'success': False, 'message': '', 'validation_error': {}}
+success_resp = {'success': True, 'message': ''}
+
+
+class MySQLBackend(object):
+    """Пул соединений aiomysql."""
+
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.pool_size = pool_size
+        self._pool = None
+
+    async def connect(self):
+        # Драйвер нужен только в асинхронном режиме, поэтому импортируется здесь
+        import aiomysql
+        self._pool = await aiomysql.create_pool(
+            host=self.url.host,
+            port=self.url.port or 3306,
+            user=self.url.username,
+            password=self.url.password or '',
+            db=self.url.database,
+            charset=self.url.query.get('charset', 'utf8'),
+            maxsize=self.pool_size,
+            autocommit=True
+        )
+
+    async def close(self):
+        self._pool.close()
+        await self._pool.wait_closed()
+
+    async def execute(self, sql, params):
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, params)
+                return [x[0] for x in cursor.description], await cursor.fetchall()
+
+
+class SQLiteBackend(object):
+    """Пул соединений aiosqlite."""
+
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.pool_size = pool_size
+        self._connections = []
+        self._free = None
+
+    async def connect(self):
+        import aiosqlite
+        self._free = asyncio.Queue()
+        for _ in range(self.pool_size):
+            conn = await aiosqlite.connect(self.url.database)
+            self._connections.append(conn)
+            self._free.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._connections:
+            await conn.close()
+        self._connections = []
+
+    async def execute(self, sql, params):
+        conn = await self._free.get()
+        try:
+            cursor = await conn.execute(sql, params)
+            try:
+                return [x[0] for x in cursor.description], await cursor.fetchall()
+            finally:
+                await cursor.close()
+        finally:
+            self._free.put_nowait(conn)
+
+
+BACKENDS = {'mysql': MySQLBackend, 'sqlite': SQLiteBackend}
+
+
+class Database(object):
+    """Выполнение запросов SQLAlchemy асинхронным драйвером.
+
+    Запрос компилируется диалектом базы из SQLALCHEMY_DATABASE_URI, строки
+    результата проходят обработку типов колонок (например, даты в SQLite)
+    и возвращаются объектами с атрибутами по именам колонок.
+    """
+
+    def __init__(self, uri, pool_size):
+        url = make_url(uri)
+        self.dialect = url.get_dialect()()
+        self.backend = BACKENDS[url.get_backend_name()](url, pool_size)
+
+    async def fetch(self, statement):
+        compiled = statement.compile(dialect=self.dialect)
+        params = [compiled.params[x] for x in compiled.positiontup]
+        processors = [
+            x.type.dialect_impl(self.dialect).result_processor(self.dialect, None)
+            for x in statement.inner_columns
+        ]
+        names, rows = await self.backend.execute(str(compiled), params)
+        return [
+            SimpleNamespace(**{
+                name: value if process is None else process(value)
+                for name, process, value in zip(names, processors, row)
+            })
+            for row in rows
+        ]
+
+
+def dump(schema, obj, many=False):
+    """Сериализовать obj, как serializers.dump, с SERIALIZER Flask-приложения."""
+    return serializers.dump(schema, obj, many, flask_app.config['SERIALIZER'])
+
+
+def json_response(data):
+    """Ответ с тем же телом, что у jsonify."""
+    body = json.dumps(data, sort_keys=True, separators=(',', ':')) + '\n'
+    return web.Response(body=body.encode(), content_type='application/json')
+
+
+def is_not_modified(request, etag, last_modified):
+    since = request.headers.get('If-Modified-Since')
+    return check_not_modified(
+        parse_etags(request.headers.get('If-None-Match')),
+        parse_date(since) if since else None,
+        etag,
+        last_modified
+    )
+
+
+def with_validators(response, etag, last_modified):
+    response.headers['ETag'] = quote_etag(etag, weak=True)
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def full_path(request):
+    """Путь со строкой запроса, как request.full_path во Flask."""
+    return f'{request.path}?{request.query_string}'
+
+
+async def paginate(database, query, page, per_page):
+    """Страница записей и блок пагинации, как у Query.paginate во Flask-SQLAlchemy."""
+    if page < 1:
+        raise web.HTTPNotFound()
+    items = await database.fetch(query.limit(per_page).offset((page - 1) * per_page).statement)
+    if not items and page != 1:
+        raise web.HTTPNotFound()
+
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = await count_rows(database, query)
+
+    return items, page_pagination(page, per_page, total)
+
+
+async def count_rows(database, query):
+    count = db.select([db.func.count().label('count')]) \
+        .select_from(query.order_by(None).statement.alias())
+    return (await database.fetch(count))[0].count
+
+
+async def offset_chunks(database, query, id_column, page, per_page):
+    """Записи страницы page порциями, как streaming.offset_chunks."""
+    start = (page - 1) * per_page
+    end = start + per_page
+    chunk_size = flask_app.config['STREAM_CHUNK_SIZE']
+    query = query.order_by(id_column)
+    for offset in range(start, end, chunk_size):
+        size = min(chunk_size, end - offset)
+        items = await database.fetch(query.limit(size).offset(offset).statement)
+        yield items
+        if len(items) < size:
+            return
+
+
+async def keyset_chunks(database, query, id_column, limit, after, rating_column, result):
+    """Страница курсорной пагинации порциями, как streaming.KeysetChunks.
+
+    Блок пагинации всей страницы записывается в result['pagination'].
+    """
+    remaining = limit
+    while True:
+        size = min(flask_app.config['STREAM_CHUNK_SIZE'], remaining)
+        rows = await database.fetch(keyset_query(query, id_column, size, after, rating_column).statement)
+        items, result['pagination'] = keyset_result(rows, id_column, size, rating_column)
+        yield items
+        remaining -= len(items)
+        if remaining <= 0 or not result['pagination']['has_next']:
+            return
+        after = result['pagination']['next_cursor']
+
+
+async def stream_list(request, mode, key, chunks, dump_chunk, pagination):
+    """Потоковый ответ, как streaming.stream_response во Flask-приложении."""
+    encoder = ListEncoder(mode, key)
+    response = web.StreamResponse(headers={'Content-Type': encoder.mimetype})
+    await response.prepare(request)
+    await response.write(encoder.head().encode())
+    async for items in chunks:
+        await response.write(encoder.items(await dump_chunk(items)).encode())
+    await response.write(encoder.tail(pagination()).encode())
+    await response.write_eof()
+    return response
+
+
+async def stream_page(request, mode, key, query, id_column, page, per_page, dump_chunk):
+    """Потоковый ответ со страницей page, как streaming.stream_page."""
+    database = request.app['database']
+    total = await count_rows(database, query)
+    if page < 1 or (page > 1 and (page - 1) * per_page >= total):
+        raise web.HTTPNotFound()
+    pagination = page_pagination(page, per_page, total)
+    chunks = offset_chunks(database, query, id_column, page, per_page)
+    return await stream_list(request, mode, key, chunks, dump_chunk, lambda: pagination)
+
+
+async def load_book_authors(database, items):
+    """Заполнить authors у книг одним запросом вместо ленивой загрузки на каждую книгу."""
+    for book in items:
+        book.authors = []
+    if not items:
+        return
+    by_id = {x.book_id: x for x in items}
+    statement = db.select([books.c.book_id.label('link_book_id'), Author.__table__]) \
+        .where(Author.author_id == books.c.author_id) \
+        .where(books.c.book_id.in_(list(by_id))) \
+        .order_by(books.c.book_id, books.c.author_id)
+    for author in await database.fetch(statement):
+        by_id[author.link_book_id].authors.append(author)
+
+
+async def load_author_books(database, items):
+    """Заполнить books у авторов одним запросом, как Author.get_many."""
+    for author in items:
+        author.books = []
+    if not items:
+        return
+    by_id = {x.author_id: x for x in items}
+    statement = db.select([books.c.author_id.label('link_author_id'), Book.__table__]) \
+        .where(Book.book_id == books.c.book_id) \
+        .where(books.c.author_id.in_(list(by_id))) \
+        .order_by(books.c.author_id, books.c.book_id)
+    for book in await database.fetch(statement):
+        by_id[book.link_author_id].books.append(book)
+
+
+async def load_stats(database, authors_id, top):
+    """Сводка авторов, как author_stats.get_stats."""
+    result = {}
+    if top <= AUTHOR_STATS_TOP:
+        rows = await database.fetch(Query(AuthorStats).filter(AuthorStats.author_id.in_(authors_id)).statement)
+        result = author_stats.stored_stats(rows, top)
+
+    missing = [x for x in authors_id if x not in result]
+    if missing:
+        count_rows = await database.fetch(author_stats.counts_query(missing).statement)
+        top_rows = []
+        if top > 0:
+            top_rows = await database.fetch(Author.top_books_query(missing, top).statement)
+        result.update(author_stats.build_stats(missing, count_rows, [(x.author_id, x) for x in top_rows]))
+    return result
+
+
+async def dump_books(database, items, schema, include):
+    if 'authors' in include:
+        await load_book_authors(database, items)
+    return dump(schema, items, many=True)
+
+
+async def dump_authors(database, items, top, only, include):
+    """Авторы списка с лучшими книгами и сводкой, как dump_with_top_books."""
+    data = dump(AuthorSchemaExt(only=only, exclude=('books',)), items, many=True)
+    if 'books' not in include and 'stats' not in include:
+        return data
+    stats = await load_stats(database, [x.author_id for x in items], top if 'books' in include else 0)
+    # author_id может не быть в fields
+    for item, author in zip(items, data):
+        author_stats.add_stats(author, stats[item.author_id], include)
+    return data
+
+
+async def books_get(request):
+    """Получение книг, как GET /books во Flask-приложении."""
+    database = request.app['database']
+    args = request.query
+    book_id = args.get('id')
+    book_schema = BookSchemaExt()
+
+    if book_id is not None and book_id.isdigit():
+        items = await database.fetch(Query(Book).filter(Book.book_id == int(book_id)).statement)
+        if not items:
+            return json_response(dict(success_resp, message=f'No book found with id={book_id}'))
+        etag, last_modified = make_etag(book_key(book_id), items[0].version), items[0].updated_at
+        if is_not_modified(request, etag, last_modified):
+            return with_validators(web.Response(status=304), etag, last_modified)
+        await load_book_authors(database, items)
+        return with_validators(json_response(dump(book_schema, items[0])), etag, last_modified)
+
+    try:
+        only, include = fieldset_args(args, BookSchemaExt, BOOK_RELATIONS)
+    except FieldsError as e:
+        return json_response(dict(error_resp, message=str(e)))
+    book_schema = BookSchemaExt(only=only)
+    # Авторы загружаются отдельно в load_book_authors, в запрос идет только выбор колонок
+    query = Query(Book).options(*query_options(Book, only, set(), BOOK_KEYS))
+    mode = stream_mode(args, request.headers.get('Accept'))
+
+    if 'ids' in args:
+        try:
+            ids = ids_arg(args['ids'], BATCH_MAX_IDS)
+        except BatchError as e:
+            return json_response(dict(error_resp, message=str(e)))
+        rows = await database.fetch(query.filter(Book.book_id.in_(ids)).statement)
+        items, missing = order_by_ids(ids, rows, 'book_id')
+        etag, last_modified = page_validators(full_path(request), items, 'book_id', {})
+        if is_not_modified(request, etag, last_modified):
+            return with_validators(web.Response(status=304), etag, last_modified)
+        response = {
+            'books': await dump_books(database, items, book_schema, include),
+            'missing': missing
+        }
+        return with_validators(json_response(response), etag, last_modified)
+    elif 'after' in args or 'limit' in args:
+        rating_column = Book.rating if args.get('order') == 'rating' else None
+        try:
+            limit = limit_arg(args, 'books')
+            page_query = keyset_query(query, Book.book_id, limit, args.get('after'), rating_column)
+        except (CursorError, PageSizeError) as e:
+            return json_response(dict(error_resp, message=str(e)))
+        if mode is not None:
+            result = {}
+            chunks = keyset_chunks(database, query, Book.book_id, limit, args.get('after'), rating_column, result)
+            return await stream_list(
+                request, mode, 'books', chunks,
+                lambda x: dump_books(database, x, book_schema, include), lambda: result['pagination']
+            )
+        items, pagination = keyset_result(
+            await database.fetch(page_query.statement), Book.book_id, limit, rating_column
+        )
+    else:
+        try:
+            page, pagin = page_args(args, 'books')
+        except PageSizeError as e:
+            return json_response(dict(error_resp, message=str(e)))
+        if mode is not None:
+            return await stream_page(
+                request, mode, 'books', query, Book.book_id, page, pagin,
+                lambda x: dump_books(database, x, book_schema, include)
+            )
+        items, pagination = await paginate(database, query, page, pagin)
+
+    etag, last_modified = page_validators(full_path(request), items, 'book_id', pagination)
+    if is_not_modified(request, etag, last_modified):
+        return with_validators(web.Response(status=304), etag, last_modified)
+    response = {
+        'books': await dump_books(database, items, book_schema, include),
+        'pagination': pagination
+    }
+    return with_validators(json_response(response), etag, last_modified)
+
+
+async def authors_get(request):
+    """Получение авторов, как GET /authors во Flask-приложении."""
+    database = request.app['database']
+    args = request.query
+    author_id = args.get('id')
+
+    if author_id is not None and author_id.isdigit():
+        items = await database.fetch(Query(Author).filter(Author.author_id == int(author_id)).statement)
+        if not items:
+            return json_response(dict(success_resp, message=f'No book found with id={author_id}'))
+        author = items[0]
+        etag, last_modified = make_etag(author_key(author_id), author.version), author.updated_at
+        if is_not_modified(request, etag, last_modified):
+            return with_validators(web.Response(status=304), etag, last_modified)
+        # Все книги автора, как при ленивой загрузке Author.books
+        author.books = await database.fetch(
+            db.select([Book.__table__])
+            .where(books.c.author_id == author.author_id)
+            .where(Book.book_id == books.c.book_id)
+        )
+        return with_validators(json_response(dump(AuthorSchemaExt(), author)), etag, last_modified)
+
+    try:
+        only, include = fieldset_args(args, AuthorSchemaExt, AUTHOR_RELATIONS, AUTHOR_EXTRAS)
+        top = top_books_arg(args)
+    except (FieldsError, PageSizeError) as e:
+        return json_response(dict(error_resp, message=str(e)))
+    query = Query(Author).options(*query_options(Author, only, set(), AUTHOR_KEYS))
+    mode = stream_mode(args, request.headers.get('Accept'))
+
+    if 'ids' in args:
+        try:
+            ids = ids_arg(args['ids'], BATCH_MAX_IDS)
+        except BatchError as e:
+            return json_response(dict(error_resp, message=str(e)))
+        rows = await database.fetch(query.filter(Author.author_id.in_(ids)).statement)
+        items, missing = order_by_ids(ids, rows, 'author_id')
+        etag, last_modified = page_validators(full_path(request), items, 'author_id', {})
+        if is_not_modified(request, etag, last_modified):
+            return with_validators(web.Response(status=304), etag, last_modified)
+        if 'books' in include:
+            await load_author_books(database, items)
+        data = dump(AuthorSchemaExt(only=only), items, many=True)
+        if 'stats' in include:
+            stats = await load_stats(database, [x.author_id for x in items], 0)
+            for item, author in zip(items, data):
+                author_stats.add_stats(author, stats[item.author_id], {'stats'})
+        response = {
+            'authors': data,
+            'missing': missing
+        }
+        return with_validators(json_response(response), etag, last_modified)
+    elif 'after' in args or 'limit' in args:
+        try:
+            limit = limit_arg(args, 'authors')
+            page_query = keyset_query(query, Author.author_id, limit, args.get('after'))
+        except (CursorError, PageSizeError) as e:
+            return json_response(dict(error_resp, message=str(e)))
+        if mode is not None:
+            result = {}
+            chunks = keyset_chunks(database, query, Author.author_id, limit, args.get('after'), None, result)
+            return await stream_list(
+                request, mode, 'authors', chunks,
+                lambda x: dump_authors(database, x, top, only, include), lambda: result['pagination']
+            )
+        items, pagination = keyset_result(await database.fetch(page_query.statement), Author.author_id, limit)
+    else:
+        try:
+            page, pagin = page_args(args, 'authors')
+        except PageSizeError as e:
+            return json_response(dict(error_resp, message=str(e)))
+        if mode is not None:
+            return await stream_page(
+                request, mode, 'authors', query, Author.author_id, page, pagin,
+                lambda x: dump_authors(database, x, top, only, include)
+            )
+        items, pagination = await paginate(database, query, page, pagin)
+
+    etag, last_modified = page_validators(full_path(request), items, 'author_id', pagination)
+    if is_not_modified(request, etag, last_modified):
+        return with_validators(web.Response(status=304), etag, last_modified)
+    response = {
+        'authors': await dump_authors(database, items, top, only, include),
+        'pagination': pagination
+    }
+    return with_validators(json_response(response), etag, last_modified)
+
+
+def call_wsgi(environ):
+    app_iter, status, headers = run_wsgi_app(flask_app, environ, buffered=True)
+    return b''.join(app_iter), int(status.split()[0]), headers
+
+
+async def flask_fallback(request):
+    """Передать запрос Flask-приложению в пул потоков."""
+    environ = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        headers=list(request.headers.items()),
+        data=await request.read(),
+        query_string=request.query_string,
+        # Адрес клиента нужен ограничению частоты запросов Flask-приложения
+        environ_base={'REMOTE_ADDR': request.remote}
+    ).get_environ()
+    loop = asyncio.get_event_loop()
+    body, status, headers = await loop.run_in_executor(request.app['executor'], call_wsgi, environ)
+    # Длину тела выставляет aiohttp
+    headers = CIMultiDict((k, v) for k, v in headers.items() if k.lower() != 'content-length')
+    return web.Response(body=body, status=status, headers=headers)
+
+
+@web.middleware
+async def rate_limit(request, handler):
+    """Ограничение частоты запросов для запросов, обрабатываемых в event loop.
+
+    Правила и хранилище корзин те же, что у Flask-приложения, запросы,
+    переданные Flask-приложению, ограничиваются им самим.
+    """
+    scope = NATIVE_SCOPES.get(request.match_info.handler)
+    if scope is None:
+        return await handler(request)
+
+    limits = flask_app.config['RATE_LIMITS']
+    concurrency = flask_app.config['RATE_LIMIT_CONCURRENCY']
+    args = (limits, concurrency, request.remote, scope, request.method)
+    if ratelimit.store.blocking:
+        loop = asyncio.get_event_loop()
+        retry_after = await loop.run_in_executor(request.app['executor'], ratelimit.admit, *args)
+    else:
+        retry_after = ratelimit.admit(*args)
+    if retry_after is not None:
+        response = json_response({'success': False, 'message': 'Too many requests.'})
+        response.set_status(429)
+        response.headers['Retry-After'] = ratelimit.retry_after_header(retry_after)
+        return response
+
+    if not concurrency:
+        return await handler(request)
+    try:
+        return await handler(request)
+    finally:
+        ratelimit.in_flight.release(request.remote)
+
+
+@web.middleware
+async def compress(request, handler):
+    """Сжатие JSON-ответов обработчиков event loop, как в Flask-приложении.
+
+    Ответы Flask-приложения приходят уже сжатыми, потоковые ответы к этому
+    моменту отправлены и не сжимаются. Сжатие выполняется в пуле потоков,
+    чтобы не занимать event loop.
+    """
+    response = await handler(request)
+    config = flask_app.config
+    if (request.match_info.handler not in NATIVE_SCOPES or not config['COMPRESSION']
+            or response.prepared or response.status != 200 or response.content_type not in compression.COMPRESS_MIMETYPES):
+        return response
+    response.headers.add('Vary', 'Accept-Encoding')
+    encoding = None
+    if len(response.body) >= config['COMPRESS_MIN_SIZE']:
+        encoding = compression.negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    loop = asyncio.get_event_loop()
+    response.body = await loop.run_in_executor(
+        request.app['executor'], compression.compress, response.body, encoding, config['COMPRESS_LEVEL']
+    )
+    response.headers['Content-Encoding'] = encoding
+    metrics.inc('app_compressed_responses_total', encoding=encoding)
+    return response
+
+
+# Блюпринты Flask-приложения, которым соответствуют обработчики event loop
+NATIVE_SCOPES = {books_get: 'books', authors_get: 'authors'}
+
+
+async def on_startup(app):
+    app['executor'] = ThreadPoolExecutor(ASYNC_WSGI_THREADS)
+    app['database'] = Database(flask_app.config['SQLALCHEMY_DATABASE_URI'], ASYNC_DB_POOL_SIZE)
+    await app['database'].backend.connect()
+
+
+async def on_cleanup(app):
+    await app['database'].backend.close()
+    app['executor'].shutdown()
+
+
+def make_app():
+    """Создать асинхронное приложение."""
+    app = web.Application(middlewares=[rate_limit, compress])
+    app.router.add_get('/books', books_get)
+    app.router.add_get('/authors', authors_get)
+    app.router.add_route('*', '/{path:.*}', flask_fallback)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(make_app(), port=ASYNC_SERVER_PORT)
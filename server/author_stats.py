@@ -0,0 +1,230 @@
+import json
+from datetime import datetime
+
+from app import db
+from config import AUTHOR_STATS_TOP
+from job_queue import task
+from models import Author, AuthorStats, Book, books
+from schemas import BookSchema
+
+
+def counts_query(authors_id):
+    """Количество книг и средний рейтинг оцененных книг авторов."""
+    rated = db.case([(Book.count_marks > 0, Book.rating)])
+    return db.session.query(
+        books.c.author_id.label('author_id'),
+        db.func.count(Book.book_id).label('books_count'),
+        db.func.avg(rated).label('avg_rating'),
+        db.func.count(rated).label('rated_count'),
+        db.func.sum(rated).label('rating_total')
+    ).join(Book, Book.book_id == books.c.book_id) \
+        .filter(books.c.author_id.in_(authors_id)) \
+        .group_by(books.c.author_id)
+
+
+def build_stats(authors_id, count_rows, top_rows):
+    """Сводка авторов из строк counts_query и пар (author_id, книга) лучших книг."""
+    schema = BookSchema()
+    result = {
+        x: {'books_count': 0, 'avg_rating': None, 'rated_count': 0, 'rating_total': .0, 'top_books': []}
+        for x in authors_id
+    }
+    for row in count_rows:
+        result[row.author_id]['books_count'] = row.books_count
+        result[row.author_id]['rated_count'] = row.rated_count
+        result[row.author_id]['rating_total'] = float(row.rating_total or 0)
+        if row.avg_rating is not None:
+            result[row.author_id]['avg_rating'] = round(float(row.avg_rating), 2)
+    for author_id, book in top_rows:
+        result[author_id]['top_books'].append(schema.dump(book))
+    return result
+
+
+def stored_stats(rows, top):
+    """Сводка авторов из строк author_stats."""
+    return {
+        x.author_id: {
+            'books_count': x.books_count,
+            'avg_rating': x.avg_rating,
+            'top_books': json.loads(x.top_books)[:top],
+        }
+        for x in rows
+    }
+
+
+def add_stats(author, stats, include):
+    """Вложить в ответ автора лучшие книги при books в include и сводку при stats."""
+    if 'books' in include:
+        author['books'] = stats['top_books']
+    if 'stats' in include:
+        author['books_count'] = stats['books_count']
+        author['avg_rating'] = stats['avg_rating']
+
+
+def compute(authors_id, top):
+    """Посчитать сводку авторов запросами к книгам."""
+    if not authors_id:
+        return {}
+    top_rows = []
+    if top > 0:
+        # Строки, а не объекты сессии: книги в сессии могут хранить рейтинг до UPDATE
+        rows = db.session.execute(Author.top_books_query(authors_id, top).statement)
+        top_rows = [(x.author_id, x) for x in rows]
+    return build_stats(authors_id, counts_query(authors_id), top_rows)
+
+
+def insert_stats(stats):
+    now = datetime.utcnow()
+    rows = [
+        {
+            'author_id': author_id,
+            'books_count': x['books_count'],
+            'avg_rating': x['avg_rating'],
+            'rated_count': x['rated_count'],
+            'rating_total': x['rating_total'],
+            'top_books': json.dumps(x['top_books']),
+            'updated_at': now,
+        }
+        for author_id, x in stats.items()
+    ]
+    if rows:
+        db.session.execute(AuthorStats.__table__.insert(), rows)
+
+
+def refresh(authors_id):
+    """Пересчитать сводку авторов после изменения рейтингов или связей их книг.
+
+    Пересчитываются только переданные авторы, commit делает вызывающий.
+    Строки удаляются до подсчета, чтобы параллельный пересчет тех же авторов
+    ждал завершения этой транзакции.
+    """
+    authors_id = sorted(set(authors_id))
+    if not authors_id:
+        return
+    AuthorStats.query.filter(AuthorStats.author_id.in_(authors_id)).delete(synchronize_session=False)
+    insert_stats(compute(authors_id, AUTHOR_STATS_TOP))
+
+
+def top_key(book):
+    """Порядок лучших книг, как в Author.top_books_query."""
+    return -book['rating'], book['book_id']
+
+
+def update_top(top_books, book, books_count):
+    """Обновить на месте список лучших книг автора после оценки книги.
+
+    Вернуть False, если без запроса к книгам список не обновить: книга из
+    списка опустилась на последнее место, а у автора есть книги вне списка,
+    которые теперь могут оказаться выше нее.
+    """
+    ids = [x['book_id'] for x in top_books]
+    if book['book_id'] in ids:
+        i = ids.index(book['book_id'])
+        old, top_books[i] = top_books[i], book
+        top_books.sort(key=top_key)
+        dropped = top_key(book) > top_key(old)
+        return not (dropped and top_books[-1] is book and books_count > len(top_books))
+    if len(top_books) < AUTHOR_STATS_TOP:
+        # В неполном списке должны быть все книги автора
+        return False
+    if top_key(book) < top_key(top_books[-1]):
+        top_books[-1] = book
+        top_books.sort(key=top_key)
+    return True
+
+
+def apply_marks(marks):
+    """Обновить сводку авторов после Book.add_marks в той же транзакции.
+
+    marks - словарь book_id -> (сумма, количество) добавленных оценок.
+    Средний рейтинг обновляется по разнице старого и нового рейтинга книги,
+    лучшие книги пересчитываются запросом только у авторов, для которых
+    update_top не может обновить список сам. commit делает вызывающий.
+    """
+    rows = db.session.execute(
+        db.select([books.c.author_id.label('link_author_id'), Book.__table__])
+        .where(Book.book_id == books.c.book_id)
+        .where(Book.book_id.in_(list(marks)))
+    )
+    changed = {}
+    for row in rows:
+        changed.setdefault(row.link_author_id, []).append(row)
+    if not changed:
+        return
+
+    # Строки блокируются, чтобы параллельные оценки книг одного автора не теряли изменения списка
+    stored = db.session.execute(
+        AuthorStats.__table__.select()
+        .where(AuthorStats.author_id.in_(sorted(changed)))
+        .order_by(AuthorStats.author_id)
+        .with_for_update()
+    ).fetchall()
+    schema = BookSchema()
+    now = datetime.utcnow()
+    stale = []
+    # Авторы без строки в author_stats считаются на лету и здесь не обновляются
+    for stats in stored:
+        rated_count, rating_total = stats.rated_count, stats.rating_total
+        top_books = json.loads(stats.top_books)
+        for book in changed[stats.author_id]:
+            marks_sum, marks_count = marks[book.book_id]
+            old_count = book.count_marks - marks_count
+            if old_count > 0:
+                rating_total += book.rating - (book.rating_sum - marks_sum) / old_count
+            else:
+                rated_count += 1
+                rating_total += book.rating
+            if not update_top(top_books, schema.dump(book), stats.books_count):
+                stale.append(stats.author_id)
+                break
+        else:
+            db.session.execute(
+                AuthorStats.__table__.update()
+                .where(AuthorStats.author_id == stats.author_id)
+                .values(
+                    avg_rating=round(rating_total / rated_count, 2),
+                    rated_count=rated_count,
+                    rating_total=rating_total,
+                    top_books=json.dumps(top_books),
+                    updated_at=now
+                )
+            )
+    refresh(stale)
+
+
+@task('author_stats.rebuild')
+def rebuild(chunk_size=1000):
+    """Пересчитать сводку всех авторов одной транзакцией, вернуть количество авторов.
+
+    commit делает вызывающий.
+    """
+    AuthorStats.query.delete(synchronize_session=False)
+    count = 0
+    last_id = 0
+    while True:
+        authors_id = [
+            x for x, in db.session.query(Author.author_id)
+            .filter(Author.author_id > last_id)
+            .order_by(Author.author_id)
+            .limit(chunk_size)
+        ]
+        if not authors_id:
+            break
+        insert_stats(compute(authors_id, AUTHOR_STATS_TOP))
+        count += len(authors_id)
+        last_id = authors_id[-1]
+    return count
+
+
+def get_stats(authors_id, top):
+    """Сводка авторов для списка авторов.
+
+    Читается из author_stats одним запросом по первичному ключу. Авторы без
+    строки в author_stats, а также все авторы при top больше AUTHOR_STATS_TOP
+    считаются на лету.
+    """
+    result = {}
+    if top <= AUTHOR_STATS_TOP:
+        result = stored_stats(AuthorStats.query.filter(AuthorStats.author_id.in_(authors_id)), top)
+    result.update(compute([x for x in authors_id if x not in result], top))
+    return result
@@ -3,9 +3,19 @@ from flask import request
 from flask import jsonify
 from marshmallow.exceptions import ValidationError
 
-from config import PAGINATE_VALUE
+from config import BATCH_MAX_IDS, BULK_MAX_ITEMS
+import author_stats
+from app import db
+from batch import BatchError, ids_arg, order_by_ids
+from conditional import is_not_modified, list_validators, not_modified_response, set_validators
+from cache import author_key, cached_response, invalidate
+from fieldsets import AUTHOR_EXTRAS, AUTHOR_KEYS, AUTHOR_RELATIONS, FieldsError, fieldset_args, query_options
+from job_queue import enqueue
 from models import Author, Book
+from pagination import CursorError, PageSizeError, keyset_page, limit_arg, page_args, top_books_arg
 from schemas import AuthorSchemaExt, AuthorAddBookSchema, BookDelAuthorSchema
+from serializers import dump
+from streaming import stream_keyset, stream_mode, stream_page
 
 
 authors = Blueprint('authors', __name__, url_prefix='/authors')
@@ -14,50 +24,135 @@ error_resp = {'success': False, 'message': '', 'validation_error': {}}
 success_resp = {'success': True, 'message': ''}
 
 
+def dump_with_top_books(items, top, only=None, include=AUTHOR_RELATIONS):
+    """Сериализовать авторов вместе с top лучшими книгами каждого.
+
+    Книги (books в include) и количество книг со средним рейтингом (stats
+    в include) берутся из author_stats, без них author_stats не читается.
+    """
+    author_schema = AuthorSchemaExt(only=only, exclude=('books',))
+    data = dump(author_schema, items, many=True)
+    if 'books' not in include and 'stats' not in include:
+        return data
+
+    stats = author_stats.get_stats([a.author_id for a in items], top if 'books' in include else 0)
+    # author_id может не быть в fields
+    for item, a in zip(items, data):
+        author_stats.add_stats(a, stats[item.author_id], include)
+    return data
+
+
 @authors.route('', methods=['GET'])
 def authors_get():
     author_id = request.args.get('id')
     author_schema = AuthorSchemaExt()
 
     if author_id is not None and author_id.isdigit():
-        author = Author.get_one_item(author_id)
-        if author is None:
+        response = cached_response(
+            author_key(author_id),
+            lambda: Author.get_one_item(author_id),
+            lambda a: dump(author_schema, a),
+            lambda: Author.get_version(author_id)
+        )
+        if response is None:
             response = success_resp
             response['message'] = f'No book found with id={author_id}'
             return jsonify(response)
-        response = author_schema.dump(author)
+        return response
+
+    # Поля авторов и вложенные книги в списках авторов, количество лучших книг автора
+    try:
+        only, include = fieldset_args(request.args, AuthorSchemaExt, AUTHOR_RELATIONS, AUTHOR_EXTRAS)
+        top = top_books_arg(request.args)
+    except (FieldsError, PageSizeError) as e:
+        return jsonify(dict(error_resp, message=str(e)))
+    # Книги списка авторов берутся из author_stats, а не из связи Author.books
+    options = query_options(Author, only, set(), AUTHOR_KEYS)
+    # Потоковая выдача больших страниц: json или ndjson
+    mode = stream_mode(request.args, request.headers.get('Accept'))
+
+    if 'ids' in request.args:
+        # Несколько авторов по списку ID, со всеми книгами, как при запросе по id
+        try:
+            ids = ids_arg(request.args['ids'], BATCH_MAX_IDS)
+        except BatchError as e:
+            return jsonify(dict(error_resp, message=str(e)))
+
+        items = Author.get_many(ids, query_options(Author, only, include & set(AUTHOR_RELATIONS), AUTHOR_KEYS))
+        items, missing = order_by_ids(ids, items, 'author_id')
+        etag, last_modified = list_validators(items, 'author_id', {})
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        data = dump(AuthorSchemaExt(only=only), items, many=True)
+        if 'stats' in include:
+            stats = author_stats.get_stats([a.author_id for a in items], 0)
+            for item, a in zip(items, data):
+                author_stats.add_stats(a, stats[item.author_id], {'stats'})
+        response = {
+            'authors': data,
+            'missing': missing
+        }
+    elif 'after' in request.args or 'limit' in request.args:
+        try:
+            limit = limit_arg(request.args, 'authors')
+            if mode is not None:
+                return stream_keyset(
+                    mode, 'authors', Author.query.options(*options), Author.author_id, limit,
+                    lambda x: dump_with_top_books(x, top, only, include),
+                    after=request.args.get('after')
+                )
+            items, pagination = keyset_page(
+                Author.query.options(*options),
+                Author.author_id,
+                limit,
+                after=request.args.get('after')
+            )
+        except (CursorError, PageSizeError) as e:
+            return jsonify(dict(error_resp, message=str(e)))
+
+        etag, last_modified = list_validators(items, 'author_id', pagination)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        data = dump_with_top_books(items, top, only, include)
+
+        response = {
+            'authors': data,
+            'pagination': pagination
+        }
     else:
-        page = request.args.get('page')
-        if page and page.isdigit():
-            page = int(page)
-        else:
-            page = 1
-
-        pagin = request.args.get('pagin')
-        if pagin and pagin.isdigit():
-            pagin = int(page)
-        else:
-            pagin = PAGINATE_VALUE
-
-        authors = Author.query.filter().paginate(
+        try:
+            page, pagin = page_args(request.args, 'authors')
+        except PageSizeError as e:
+            return jsonify(dict(error_resp, message=str(e)))
+        if mode is not None:
+            return stream_page(
+                mode, 'authors', Author.query.options(*options), Author.author_id, page, pagin,
+                lambda x: dump_with_top_books(x, top, only, include)
+            )
+
+        authors = Author.query.options(*options).filter().paginate(
             page=page,
             per_page=pagin
         )
-        data = author_schema.dump(authors.items, many=True)
-        for a in data:
-            a['books'] = [x for x in sorted(a['books'], key=lambda y: y['rating'], reverse=True)[:5]]
+        pagination = {
+            'has_next': authors.has_next,
+            'has_prev': authors.has_prev,
+            'next_num': authors.next_num,
+            'prev_num': authors.prev_num,
+            'pages': authors.pages
+        }
+        etag, last_modified = list_validators(authors.items, 'author_id', pagination)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        data = dump_with_top_books(authors.items, top, only, include)
 
         response = {
             'authors': data,
-            'pagination': {
-                'has_next': authors.has_next,
-                'has_prev': authors.has_prev,
-                'next_num': authors.next_num,
-                'prev_num': authors.prev_num,
-                'pages': authors.pages
-            }
+            'pagination': pagination
         }
-    return jsonify(response)
+    return set_validators(jsonify(response), etag, last_modified)
 
 
 @authors.route('', methods=['POST'])
@@ -80,6 +175,35 @@ def authors_post():
     return jsonify(s_response)
 
 
+@authors.route('/bulk', methods=['POST'])
+def authors_bulk_post():
+    """Пакетное создание авторов."""
+    req_data = request.get_json()
+    author_schema = AuthorSchemaExt(many=True, exclude=('books',))
+    # Копии, чтобы списки created/errors не попали в ответы других запросов
+    e_response = dict(error_resp)
+    s_response = dict(success_resp)
+
+    if not isinstance(req_data, list):
+        e_response['message'] = 'Expected list of authors.'
+        return jsonify(e_response)
+    if len(req_data) > BULK_MAX_ITEMS:
+        e_response['message'] = f'Too many authors, max {BULK_MAX_ITEMS} per request.'
+        return jsonify(e_response)
+
+    # Ошибки валидации отдельных авторов не прерывают создание остальных
+    errors = author_schema.validate(req_data)
+    valid = [i for i in range(len(req_data)) if i not in errors]
+    items = author_schema.load([req_data[i] for i in valid])
+    Author.bulk_create(items)
+    db.session.commit()
+
+    s_response['message'] = f'Created {len(items)} of {len(req_data)} authors.'
+    s_response['created'] = [{'index': i, 'author_id': a.author_id} for i, a in zip(valid, items)]
+    s_response['errors'] = errors
+    return jsonify(s_response)
+
+
 @authors.route('', methods=['PUT'])
 def authors_put():
     """Добавить книгу к автору."""
@@ -98,17 +222,22 @@ def authors_put():
         e_response['message'] = f'Not found author with id={data["author_id"]}.'
         return jsonify(e_response)
 
-    list_b = Book.query.filter(Book.book_id.in_(books_id))
-    if list_b.count() <= 0:
+    linked, already_linked, missing = Author.link_books(a.author_id, books_id)
+    if not linked and not already_linked:
         e_response['messages'] = f'Noone books found with id: {", ".join([str(x) for x in books_id])}.'
         return jsonify(e_response)
+    if linked:
+        author_stats.refresh([a.author_id])
+    db.session.commit()
+    invalidate(books_id=linked, authors_id=[a.author_id] if linked else [])
 
-    found_books = []
-    for b in list_b:
-        found_books.append(b.book_id)
-        a.books.append(b)
-    a.save()
+    # Копия, чтобы списки ID не попали в ответы других запросов
+    s_response = dict(s_response)
+    found_books = linked + already_linked
     s_response['message'] = f'Books was found with id: {", ".join([str(x) for x in found_books])}.'
+    s_response['linked'] = linked
+    s_response['already_linked'] = already_linked
+    s_response['missing'] = missing
     return jsonify(s_response)
 
 
@@ -144,5 +273,22 @@ def authors_patch():
         return jsonify(e_response)
 
     s_response['message'] = f'Author with id={data["author_id"]} was removed from book.'
+    Book.touch([b.book_id])
+    Author.touch([a.author_id])
+    # Удаление из коллекции записывается в базу до пересчета сводки
+    db.session.flush()
+    author_stats.refresh([a.author_id])
     a.save()
+    invalidate(books_id=[b.book_id], authors_id=[a.author_id])
+    return jsonify(s_response)
+
+
+@authors.route('/stats/rebuild', methods=['POST'])
+def authors_stats_rebuild():
+    """Поставить в очередь пересчет сводки по книгам всех авторов."""
+    job = enqueue('author_stats.rebuild')
+    db.session.commit()
+    s_response = dict(success_resp)
+    s_response['message'] = f'Stats rebuild queued as job {job.job_id}.'
+    s_response['job_id'] = job.job_id
     return jsonify(s_response)
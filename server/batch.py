@@ -0,0 +1,19 @@
+class BatchError(ValueError):
+    """Некорректный список ID в запросе нескольких записей."""
+
+
+def ids_arg(value, max_items):
+    """ID записей из параметра ids: числа через запятую, без повторов, в порядке запроса."""
+    ids = [x.strip() for x in value.split(',') if x.strip()]
+    if not ids or not all(x.isdigit() for x in ids):
+        raise BatchError(f'Invalid ids: {value}')
+    ids = list(dict.fromkeys(int(x) for x in ids))
+    if len(ids) > max_items:
+        raise BatchError(f'Too many ids: {len(ids)}, max {max_items}.')
+    return ids
+
+
+def order_by_ids(ids, items, id_attr):
+    """Записи в порядке ids и список ID, для которых записи не нашлись."""
+    found = {getattr(x, id_attr): x for x in items}
+    return [found[x] for x in ids if x in found], [x for x in ids if x not in found]
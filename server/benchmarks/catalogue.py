@@ -0,0 +1,94 @@
+"""Генератор синтетического каталога авторов и книг для бенчмарков."""
+import random
+
+import author_stats
+from app import app, db
+from models import Author, Book, books
+
+
+CHUNK_SIZE = 10000
+
+# Слова для названий и описаний книг, по ним работает поиск
+WORDS = (
+    'bread', 'story', 'house', 'river', 'forest', 'winter', 'summer', 'night',
+    'morning', 'garden', 'city', 'journey', 'letter', 'mountain', 'island',
+    'secret', 'silver', 'shadow', 'light', 'stone', 'wind', 'fire', 'water',
+)
+
+
+def setup_database(uri):
+    """Подключить приложение к базе бенчмарка и пересоздать таблицы."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def insert_chunked(table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            db.session.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+    db.session.commit()
+
+
+def author_weights(authors_count, popularity):
+    """Веса выбора авторов книг.
+
+    uniform - все авторы равновероятны, zipf - вес автора обратно
+    пропорционален его номеру, то есть есть немного очень плодовитых авторов.
+    """
+    if popularity == 'uniform':
+        return None
+    if popularity == 'zipf':
+        return [1 / i for i in range(1, authors_count + 1)]
+    raise ValueError(f'Unknown popularity distribution: {popularity}')
+
+
+def fill_catalogue(authors_count, books_count, max_authors_per_book=3, popularity='uniform', seed=0):
+    """Заполнить базу авторами и книгами.
+
+    У каждой книги от 1 до max_authors_per_book авторов, выбранных по
+    распределению popularity, и случайные оценки, согласованные с rating_sum.
+    """
+    rnd = random.Random(seed)
+    authors_id = range(1, authors_count + 1)
+    weights = author_weights(authors_count, popularity)
+
+    insert_chunked(Author.__table__, (
+        {'author_id': i, 'name': f'Name{i}', 'sername': f'Sername{i % 1000}'}
+        for i in authors_id
+    ))
+
+    def book_rows():
+        for i in range(1, books_count + 1):
+            count_marks = rnd.randint(0, 50)
+            rating_sum = sum(rnd.randint(1, 5) for _ in range(count_marks))
+            yield {
+                'book_id': i,
+                'name': f'Book {i} {rnd.choice(WORDS)}',
+                'description': ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40))),
+                'count_marks': count_marks,
+                'rating_sum': rating_sum,
+                'rating': rating_sum / count_marks if count_marks else .0,
+            }
+    insert_chunked(Book.__table__, book_rows())
+
+    def link_rows():
+        for i in range(1, books_count + 1):
+            count = min(rnd.randint(1, max_authors_per_book), authors_count)
+            if weights is None:
+                book_authors = rnd.sample(authors_id, count)
+            else:
+                book_authors = set()
+                while len(book_authors) < count:
+                    book_authors.update(rnd.choices(authors_id, weights=weights, k=count - len(book_authors)))
+            for author_id in book_authors:
+                yield {'book_id': i, 'author_id': author_id}
+    insert_chunked(books, link_rows())
+    author_stats.rebuild()
+    db.session.commit()
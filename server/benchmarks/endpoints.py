@@ -0,0 +1,233 @@
+"""Задержки, пропускная способность и число SQL-запросов для каждого эндпоинта.
+
+Каждый эндпоинт прогоняется через тестовый клиент Flask (в одном потоке,
+без сети) и по HTTP через локальный сервер с несколькими параллельными
+клиентами. Отчет выводится в stdout в формате JSON.
+
+Запуск из папки server:
+> python -m benchmarks.endpoints --db sqlite:////tmp/endpoints.db --authors 2000 --books 20000 --popularity zipf
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import cache as cache_module
+from app import app, db
+from benchmarks.catalogue import WORDS, fill_catalogue, setup_database
+
+
+class QueryCounter(object):
+    """Счетчик SQL-запросов ко всем соединениям движка."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Обработчик запросов сервера без лога каждого запроса."""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def endpoints(authors_count, books_count):
+    """Эндпоинты бенчмарка: имя и функция, возвращающая (метод, путь, тело)."""
+    def book_id(rnd):
+        return rnd.randint(1, books_count)
+
+    def author_id(rnd):
+        return rnd.randint(1, authors_count)
+
+    return {
+        'GET /books?id': lambda rnd: ('GET', f'/books?id={book_id(rnd)}', None),
+        'GET /books?page': lambda rnd: ('GET', f'/books?page={rnd.randint(1, 50)}', None),
+        'GET /books?limit': lambda rnd: ('GET', '/books?limit=20&order=rating', None),
+        'GET /books/search': lambda rnd: ('GET', f'/books/search?q={rnd.choice(WORDS)}', None),
+        'GET /books/top': lambda rnd: ('GET', '/books/top?limit=20&min_votes=1', None),
+        'GET /authors?id': lambda rnd: ('GET', f'/authors?id={author_id(rnd)}', None),
+        'GET /authors?page': lambda rnd: ('GET', f'/authors?page={rnd.randint(1, 50)}', None),
+        'GET /authors?limit': lambda rnd: ('GET', '/authors?limit=20', None),
+        'GET /authors?top_books': lambda rnd: ('GET', '/authors?page=1&top_books=5', None),
+        'POST /books': lambda rnd: ('POST', '/books', {
+            'book': {'name': 'Benchmark book', 'description': 'Benchmark book'},
+            'author_id': [author_id(rnd)],
+        }),
+        'PUT /books': lambda rnd: ('PUT', '/books', {'book_id': book_id(rnd), 'author_id': [author_id(rnd)]}),
+        'PATCH /books': lambda rnd: ('PATCH', '/books', {'book_id': book_id(rnd), 'rating': rnd.randint(1, 5)}),
+        'POST /authors': lambda rnd: ('POST', '/authors', {'name': 'Benchmark', 'sername': 'Author'}),
+        'PUT /authors': lambda rnd: ('PUT', '/authors', {'author_id': author_id(rnd), 'book_id': [book_id(rnd)]}),
+    }
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу для отсортированного списка."""
+    if not values:
+        return None
+    rank = max(int(round(p / 100 * len(values))), 1)
+    return values[rank - 1]
+
+
+def summary(name, mode, concurrency, latencies, errors, elapsed, queries):
+    latencies = sorted(latencies)
+    requests_count = len(latencies)
+    return {
+        'endpoint': name,
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': requests_count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / requests_count * 1000, 3),
+        'throughput_rps': round(requests_count / elapsed, 1),
+        'queries_per_request': round(queries / requests_count, 2),
+    }
+
+
+def is_error(status, body):
+    if status >= 400:
+        return True
+    # Ошибки API возвращаются с кодом 200 и success: false
+    try:
+        return json.loads(body).get('success') is False
+    except (ValueError, AttributeError):
+        return False
+
+
+def run_client(name, make_request, count, counter, seed):
+    """Прогнать эндпоинт через тестовый клиент Flask."""
+    rnd = random.Random(seed)
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    queries = counter.count
+    started = time.perf_counter()
+    for _ in range(count):
+        method, path, body = make_request(rnd)
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - request_started)
+        errors += is_error(response.status_code, response.get_data())
+    elapsed = time.perf_counter() - started
+    return summary(name, 'client', 1, latencies, errors, elapsed, counter.count - queries)
+
+
+def run_http(name, make_request, count, concurrency, base_url, counter, seed):
+    """Прогнать эндпоинт по HTTP в concurrency параллельных потоков."""
+    def worker(worker_num):
+        rnd = random.Random(seed * 1000 + worker_num)
+        latencies = []
+        errors = 0
+        for _ in range(count // concurrency + (worker_num < count % concurrency)):
+            method, path, body = make_request(rnd)
+            data = None if body is None else json.dumps(body).encode()
+            http_request = urllib.request.Request(
+                base_url + path, data=data, method=method, headers={'Content-Type': 'application/json'}
+            )
+            request_started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(http_request) as response:
+                    status, response_body = response.status, response.read()
+            except urllib.error.HTTPError as e:
+                status, response_body = e.code, e.read()
+            latencies.append(time.perf_counter() - request_started)
+            errors += is_error(status, response_body)
+        return latencies, errors
+
+    queries = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = [x for worker_latencies, _ in results for x in worker_latencies]
+    errors = sum(worker_errors for _, worker_errors in results)
+    return summary(name, 'http', concurrency, latencies, errors, elapsed, counter.count - queries)
+
+
+def run(selected, modes, count, concurrency, authors_count, books_count, seed):
+    counter = QueryCounter()
+    counter.install(db.engine)
+    routes = endpoints(authors_count, books_count)
+    results = []
+
+    server = None
+    if 'http' in modes:
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        for name, make_request in routes.items():
+            if selected and name not in selected:
+                continue
+            if 'client' in modes:
+                results.append(run_client(name, make_request, count, counter, seed))
+            if 'http' in modes:
+                results.append(run_http(name, make_request, count, concurrency, base_url, counter, seed))
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:////tmp/endpoints.db', help='Database URI')
+    parser.add_argument('--authors', type=int, default=2000)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--max-authors-per-book', type=int, default=3)
+    parser.add_argument('--popularity', choices=('uniform', 'zipf'), default='uniform',
+                        help='Distribution of books between authors')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and mode')
+    parser.add_argument('--concurrency', type=int, default=8, help='Parallel HTTP clients')
+    parser.add_argument('--mode', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--endpoint', action='append', help='Run only this endpoint, e.g. "GET /books?id"')
+    parser.add_argument('--no-cache', action='store_true', help='Disable response cache')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write report to file instead of stdout')
+    args = parser.parse_args()
+
+    if args.no_cache:
+        cache_module.cache = cache_module.NullCache()
+
+    setup_database(args.db)
+    fill_catalogue(args.authors, args.books, args.max_authors_per_book, args.popularity, args.seed)
+    modes = ('client', 'http') if args.mode == 'both' else (args.mode,)
+    report = {
+        'database': db.engine.dialect.name,
+        'catalogue': {
+            'authors': args.authors,
+            'books': args.books,
+            'max_authors_per_book': args.max_authors_per_book,
+            'popularity': args.popularity,
+        },
+        'cache': not args.no_cache,
+        'results': run(args.endpoint, modes, args.requests, args.concurrency, args.authors, args.books, args.seed),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Планы и время горячих запросов без вторичных индексов и с ними.
+
+Запуск из папки server:
+> python -m benchmarks.query_plans --db sqlite:////tmp/plans.db --authors 2000 --books 20000
+"""
+import argparse
+import json
+import time
+
+from app import db
+from benchmarks.catalogue import fill_catalogue, setup_database
+from models import Author, Book, books
+
+
+# Индексы, добавленные для горячих запросов
+INDEXES = ('ix_books_author_id_book_id', 'ix_book_rating', 'ix_author_name_sername')
+
+# Временный индекс внешнего ключа books.author_id в MySQL, см. drop_indexes
+FK_INDEX = 'ix_books_author_id_fk'
+
+
+def hot_queries(authors_id):
+    """Запросы, для которых нужны индексы."""
+    return {
+        # Лучшие книги авторов страницы в GET /authors
+        'authors_top_books': Author.top_books_query(authors_id, 5).statement,
+        # Ленивая загрузка Author.books в GET /authors?id=
+        'author_books': db.session.query(Book)
+            .join(books, books.c.book_id == Book.book_id)
+            .filter(books.c.author_id == authors_id[0]).statement,
+        # Курсорная пагинация книг по рейтингу
+        'books_by_rating': Book.query
+            .order_by(Book.rating.desc(), Book.book_id)
+            .limit(20).statement,
+        # Поиск автора по имени и фамилии
+        'author_by_name': Author.query
+            .filter(Author.name == 'Name42', Author.sername == 'Sername42').statement,
+    }
+
+
+def find_index(name):
+    for table in db.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+
+
+def explain(statement):
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    if db.engine.dialect.name == 'sqlite':
+        # Последняя колонка EXPLAIN QUERY PLAN - описание шага плана
+        return [row[-1] for row in db.session.execute('EXPLAIN QUERY PLAN ' + sql)]
+    return [dict(row.items()) for row in db.session.execute('EXPLAIN ' + sql)]
+
+
+def timing(statement, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        db.session.execute(statement).fetchall()
+    return round((time.perf_counter() - started) * 1000 / repeat, 3)
+
+
+def drop_indexes():
+    """Удалить индексы горячих запросов.
+
+    В MySQL составной индекс обслуживает внешний ключ на author_id, и без
+    другого индекса по author_id его удаление падает с ошибкой 1553, поэтому
+    на это время создается FK_INDEX, как в откате миграции 5f3a8e21c7d4.
+    """
+    if db.engine.dialect.name == 'mysql':
+        db.engine.execute(f'CREATE INDEX {FK_INDEX} ON books (author_id)')
+    for name in INDEXES:
+        find_index(name).drop(bind=db.engine)
+
+
+def create_indexes():
+    for name in INDEXES:
+        find_index(name).create(bind=db.engine)
+    if db.engine.dialect.name == 'mysql':
+        db.engine.execute(f'DROP INDEX {FK_INDEX} ON books')
+
+
+def run(repeat):
+    authors_id = list(range(1, 21))
+    result = {}
+    for phase in ('before', 'after'):
+        # Соединение сессии не должно держать старую схему
+        db.session.remove()
+        if phase == 'before':
+            drop_indexes()
+        else:
+            create_indexes()
+
+        for name, statement in hot_queries(authors_id).items():
+            result.setdefault(name, {})[phase] = {
+                'plan': explain(statement),
+                'ms': timing(statement, repeat),
+            }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--db', default='sqlite:////tmp/query_plans.db', help='Database URI')
+    parser.add_argument('--authors', type=int, default=2000)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20, help='Runs of every query')
+    args = parser.parse_args()
+
+    setup_database(args.db)
+    fill_catalogue(args.authors, args.books)
+    report = {
+        'database': db.engine.dialect.name,
+        'catalogue': {'authors': args.authors, 'books': args.books},
+        'queries': run(args.repeat),
+    }
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Сериализация списков книг и авторов через marshmallow и скомпилированные схемы.
+
+Записи загружаются из базы заранее, поэтому измеряется только сериализация
+и кодирование в JSON. Отчет выводится в stdout в формате JSON.
+
+Запуск из папки server:
+> python -m benchmarks.serialization --db sqlite:////tmp/serialization.db --items 1000
+"""
+import argparse
+import json
+import time
+
+from flask import jsonify
+from sqlalchemy.orm import selectinload
+
+from app import app
+from benchmarks.catalogue import fill_catalogue, setup_database
+from models import Author, Book
+from schemas import AuthorSchemaExt, BookSchemaExt
+from serializers import dump
+
+
+def render(schema, items):
+    return jsonify({'items': dump(schema, items, many=True)}).get_data()
+
+
+def timing(schema, items, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = render(schema, items)
+    return (time.perf_counter() - started) / repeat, body
+
+
+def run(items_count, repeat):
+    cases = {
+        'books': (BookSchemaExt(), Book.query.options(selectinload(Book.authors)).limit(items_count).all()),
+        'authors': (AuthorSchemaExt(), Author.query.options(selectinload(Author.books)).limit(items_count).all()),
+    }
+    result = {}
+    for name, (schema, items) in cases.items():
+        with app.test_request_context():
+            app.config['SERIALIZER'] = 'marshmallow'
+            marshmallow_time, marshmallow_body = timing(schema, items, repeat)
+            app.config['SERIALIZER'] = 'compiled'
+            compiled_time, compiled_body = timing(schema, items, repeat)
+        result[name] = {
+            'items': len(items),
+            'marshmallow_ms': round(marshmallow_time * 1000, 3),
+            'compiled_ms': round(compiled_time * 1000, 3),
+            'speedup': round(marshmallow_time / compiled_time, 2),
+            'identical': marshmallow_body == compiled_body,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='sqlite:////tmp/serialization.db', help='Database URI')
+    parser.add_argument('--items', type=int, default=1000, help='Items in one response')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs of every serializer')
+    args = parser.parse_args()
+
+    setup_database(args.db)
+    # Каталог с заметным количеством книг у авторов
+    fill_catalogue(max(args.items // 10, 1), args.items * 10, popularity='zipf')
+    report = {
+        'catalogue': {'authors': max(args.items // 10, 1), 'books': args.items * 10},
+        'results': run(args.items, args.repeat),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
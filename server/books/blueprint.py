@@ -3,9 +3,21 @@ from flask import request
 from flask import jsonify
 from marshmallow.exceptions import ValidationError
 
-from config import PAGINATE_VALUE
+from config import BATCH_MAX_IDS, BULK_MAX_ITEMS
+import author_stats
+from app import db
+from batch import BatchError, ids_arg, order_by_ids
+from conditional import is_not_modified, list_validators, not_modified_response, set_validators
+from cache import book_key, cached_response, invalidate
+from fieldsets import BOOK_KEYS, BOOK_RELATIONS, FieldsError, fieldset_args, query_options
+from job_queue import enqueue, on_commit, task
 from models import Author, Book
+from pagination import CursorError, PageSizeError, keyset_page, limit_arg, page_args
+from ratings import add_mark
+from search import search_books, search_index
 from schemas import BookSchemaExt, AuthorIdList, BookRatingSchema, BookAddAuthorSchema
+from serializers import dump
+from streaming import stream_keyset, stream_mode, stream_page
 
 
 books = Blueprint('books', __name__, url_prefix='/books')
@@ -22,42 +34,148 @@ def books_get():
 
     if book_id is not None and book_id.isdigit():
         # Получить книгу по ID
-        book = Book.get_one_item(book_id)
-        if book is None:
+        response = cached_response(
+            book_key(book_id),
+            lambda: Book.get_one_item(book_id),
+            lambda b: dump(book_schema, b),
+            lambda: Book.get_version(book_id)
+        )
+        if response is None:
             response = success_resp
             response['message'] = f'No book found with id={book_id}'
             return jsonify(response)
-        response = book_schema.dump(book)
+        return response
+
+    # Поля книг и вложенные авторы в списках книг
+    try:
+        only, include = fieldset_args(request.args, BookSchemaExt, BOOK_RELATIONS)
+    except FieldsError as e:
+        return jsonify(dict(error_resp, message=str(e)))
+    book_schema = BookSchemaExt(only=only)
+    options = query_options(Book, only, include, BOOK_KEYS)
+    # Потоковая выдача больших страниц: json или ndjson
+    mode = stream_mode(request.args, request.headers.get('Accept'))
+
+    if 'ids' in request.args:
+        # Получить несколько книг по списку ID
+        try:
+            ids = ids_arg(request.args['ids'], BATCH_MAX_IDS)
+        except BatchError as e:
+            return jsonify(dict(error_resp, message=str(e)))
+
+        items, missing = order_by_ids(ids, Book.get_many(ids, options), 'book_id')
+        etag, last_modified = list_validators(items, 'book_id', {})
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        response = {
+            'books': dump(book_schema, items, many=True),
+            'missing': missing
+        }
+    elif 'after' in request.args or 'limit' in request.args:
+        # Получить книги курсорной пагинацией
+        rating_column = Book.rating if request.args.get('order') == 'rating' else None
+        try:
+            limit = limit_arg(request.args, 'books')
+            if mode is not None:
+                return stream_keyset(
+                    mode, 'books', Book.query.options(*options), Book.book_id, limit,
+                    lambda x: dump(book_schema, x, many=True),
+                    after=request.args.get('after'),
+                    rating_column=rating_column
+                )
+            items, pagination = keyset_page(
+                Book.query.options(*options),
+                Book.book_id,
+                limit,
+                after=request.args.get('after'),
+                rating_column=rating_column
+            )
+        except (CursorError, PageSizeError) as e:
+            return jsonify(dict(error_resp, message=str(e)))
+
+        etag, last_modified = list_validators(items, 'book_id', pagination)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        response = {
+            'books': dump(book_schema, items, many=True),
+            'pagination': pagination
+        }
     else:
         # Получить все книги
-        page = request.args.get('page')
-        if page and page.isdigit():
-            page = int(page)
-        else:
-            page = 1
-
-        pagin = request.args.get('pagin')
-        if pagin and pagin.isdigit():
-            pagin = int(page)
-        else:
-            pagin = PAGINATE_VALUE
-
-        books = Book.query.filter().paginate(
+        try:
+            page, pagin = page_args(request.args, 'books')
+        except PageSizeError as e:
+            return jsonify(dict(error_resp, message=str(e)))
+        if mode is not None:
+            return stream_page(
+                mode, 'books', Book.query.options(*options), Book.book_id, page, pagin,
+                lambda x: dump(book_schema, x, many=True)
+            )
+
+        books = Book.query.options(*options).filter().paginate(
             page=page,
             per_page=pagin
         )
-        data = book_schema.dump(books.items, many=True)
+        pagination = {
+            'has_next': books.has_next,
+            'has_prev': books.has_prev,
+            'next_num': books.next_num,
+            'prev_num': books.prev_num,
+            'pages': books.pages
+        }
+        etag, last_modified = list_validators(books.items, 'book_id', pagination)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        data = dump(book_schema, books.items, many=True)
         response = {
             'books': data,
-            'pagination': {
-                'has_next': books.has_next,
-                'has_prev': books.has_prev,
-                'next_num': books.next_num,
-                'prev_num': books.prev_num,
-                'pages': books.pages
-            }
+            'pagination': pagination
         }
-    return jsonify(response)
+    return set_validators(jsonify(response), etag, last_modified)
+
+
+@books.route('/search', methods=['GET'])
+def books_search():
+    """Полнотекстовый поиск книг по названию и описанию."""
+    q = request.args.get('q', '').strip()
+    book_schema = BookSchemaExt()
+
+    if not q:
+        return jsonify(dict(error_resp, message='Empty search query.'))
+
+    try:
+        limit = limit_arg(request.args, 'books_search')
+        items, pagination = search_books(q, limit, after=request.args.get('after'))
+    except (CursorError, PageSizeError) as e:
+        return jsonify(dict(error_resp, message=str(e)))
+
+    data = dump(book_schema, [b for b, _ in items], many=True)
+    for book, (_, score) in zip(data, items):
+        book['score'] = score
+    return jsonify({'books': data, 'pagination': pagination})
+
+
+@books.route('/top', methods=['GET'])
+def books_top():
+    """Лучшие книги каталога по байесовской оценке рейтинга."""
+    try:
+        limit = limit_arg(request.args, 'books_top')
+    except PageSizeError as e:
+        return jsonify(dict(error_resp, message=str(e)))
+    min_votes = request.args.get('min_votes', '')
+    min_votes = int(min_votes) if min_votes.isdigit() else 0
+
+    items = Book.top_rated(limit, min_votes)
+    etag, last_modified = list_validators(items, 'book_id', {})
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    data = dump(BookSchemaExt(), items, many=True)
+    for book, b in zip(data, items):
+        book['weighted_rating'] = round(b.weighted_rating, 4)
+    return set_validators(jsonify({'books': data}), etag, last_modified)
 
 
 @books.route('', methods=['POST', 'PUT'])
@@ -104,19 +222,130 @@ def books_post():
             return jsonify(e_response)
 
 
-    list_a = Author.query.filter(Author.author_id.in_(author_id))
-    if list_a.count() <= 0:
+    if request.method == 'POST':
+        # Новая книга получает ID до вставки связей и откатывается, если авторы не найдены
+        db.session.add(b)
+        db.session.flush()
+    linked, already_linked, missing = Book.link_authors(b.book_id, author_id)
+    if not linked and not already_linked:
+        db.session.rollback()
         e_response['messages'] = f'Noone authors found with id: {", ".join([str(x) for x in author_id])}.'
         return jsonify(e_response)
-    found_authors = []
-    for a in list_a:
-        found_authors.append(a.author_id)
-        a.books.append(b)
-    b.save()
+    author_stats.refresh(linked)
+    db.session.commit()
+    if request.method == 'POST':
+        search_index.add([(b.book_id, b.name, b.description)])
+    invalidate(books_id=[b.book_id] if linked else [], authors_id=linked)
+
+    # Копия, чтобы списки ID не попали в ответы других запросов
+    s_response = dict(s_response)
+    found_authors = linked + already_linked
     s_response['message'] = f'Found authors: {", ".join([str(x) for x in found_authors])}.'
+    s_response['linked'] = linked
+    s_response['already_linked'] = already_linked
+    s_response['missing'] = missing
     return jsonify(s_response)
 
 
+def create_books(data):
+    """Пакетное создание книг вместе с авторами без commit.
+
+    Вернуть ответ со списками created и errors и созданные пары
+    (Book, [author_id, ]) для books_created.
+    """
+    book_schema = BookSchemaExt(many=True, exclude=('authors',))
+    schema = AuthorIdList(many=True)
+    # Копия, чтобы списки created/errors не попали в ответы других запросов
+    s_response = dict(success_resp)
+
+    errors = {}
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            errors[i] = {'_schema': ['Invalid input type.']}
+    book_errors = book_schema.validate([x.get('book') if i not in errors else {} for i, x in enumerate(data)])
+    author_errors = schema.validate([{'author_id': x.get('author_id')} if i not in errors else {} for i, x in enumerate(data)])
+    for i in range(len(data)):
+        if i in errors:
+            continue
+        if i in book_errors:
+            errors.setdefault(i, {})['book'] = book_errors[i]
+        if i in author_errors:
+            errors.setdefault(i, {}).update(author_errors[i])
+
+    # Все ID авторов проверяются одним запросом
+    valid = [i for i in range(len(data)) if i not in errors]
+    authors_id = {a_id for i in valid for a_id in data[i]['author_id']}
+    found = {x for x, in db.session.query(Author.author_id).filter(Author.author_id.in_(authors_id))}
+
+    created = []
+    found_authors = []
+    for i in valid:
+        authors_id = [x for x in dict.fromkeys(data[i]['author_id']) if x in found]
+        if not authors_id:
+            errors[i] = {'author_id': [f'Noone authors found with id: {", ".join([str(x) for x in data[i]["author_id"]])}.']}
+            continue
+        created.append(i)
+        found_authors.append(authors_id)
+
+    items = list(zip(book_schema.load([data[i]['book'] for i in created]), found_authors))
+    Book.bulk_create(items)
+    author_stats.refresh({a_id for _, authors_id in items for a_id in authors_id})
+
+    s_response['message'] = f'Created {len(items)} of {len(data)} books.'
+    s_response['created'] = [
+        {'index': i, 'book_id': b.book_id, 'author_id': authors_id}
+        for i, (b, authors_id) in zip(created, items)
+    ]
+    s_response['errors'] = errors
+    return s_response, items
+
+
+def books_created(items):
+    """Обновить индекс поиска и кеш после фиксации созданных книг."""
+    search_index.add([(b.book_id, b.name, b.description) for b, _ in items])
+    invalidate(authors_id={a_id for _, authors_id in items for a_id in authors_id})
+
+
+@task('books.bulk_create')
+def bulk_create(data):
+    """Фоновое пакетное создание книг, результат - ответ POST /books/bulk."""
+    response, items = create_books(data)
+    on_commit(lambda: books_created(items))
+    return response
+
+
+@books.route('/bulk', methods=['POST'])
+def books_bulk_post():
+    """Пакетное создание книг вместе с авторами.
+
+    С параметром background=1 книги создаются фоновой задачей, в ответе
+    ID задачи, результат задачи совпадает с ответом без background.
+    Повторный запрос с тем же заголовком Idempotency-Key, пока задача не
+    завершена, возвращает ту же задачу.
+    """
+    data = request.get_json()
+    e_response = dict(error_resp)
+
+    if not isinstance(data, list):
+        e_response['message'] = 'Expected list of books.'
+        return jsonify(e_response)
+    if len(data) > BULK_MAX_ITEMS:
+        e_response['message'] = f'Too many books, max {BULK_MAX_ITEMS} per request.'
+        return jsonify(e_response)
+
+    if request.args.get('background') in ('1', 'true'):
+        job = enqueue('books.bulk_create', {'data': data}, key=request.headers.get('Idempotency-Key'))
+        db.session.commit()
+        s_response = dict(success_resp)
+        s_response['message'] = f'Creating {len(data)} books queued as job {job.job_id}.'
+        s_response['job_id'] = job.job_id
+        return jsonify(s_response)
+    response, items = create_books(data)
+    db.session.commit()
+    books_created(items)
+    return jsonify(response)
+
+
 @books.route('', methods=['PATCH'])
 def books_patch():
     """Добавление оценки к книге"""
@@ -136,10 +365,16 @@ def books_patch():
         e_response['message'] = f'No book found with id={data["book_id"]}'
         return jsonify(e_response)
 
-    b.count_marks += 1
-    b.rating = (b.rating * (b.count_marks - 1) + rating) / b.count_marks
-    b.save()
-    s_response['message'] = f'New rating {b.rating} for {b.count_marks} votes.'
-    s_response['rating'] = b.rating
-    s_response['votes'] = b.count_marks
+    result = add_mark(b, rating)
+    if result is None:
+        # Оценка в буфере, рейтинг изменится после записи буфера в базу
+        response = jsonify(dict(success_resp, message=f'Mark for book {b.book_id} accepted.'))
+        response.status_code = 202
+        return response
+    rating, votes = result
+    # Копия, чтобы рейтинг не попал в ответы других запросов
+    s_response = dict(s_response)
+    s_response['message'] = f'New rating {rating} for {votes} votes.'
+    s_response['rating'] = rating
+    s_response['votes'] = votes
     return jsonify(s_response)
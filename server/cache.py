@@ -0,0 +1,184 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify
+
+from compression import ENCODINGS, compress, request_encoding, set_encoded
+from conditional import is_not_modified, make_etag, not_modified_response, set_validators
+from config import CACHE_BACKEND, CACHE_MAX_ITEMS, CACHE_REDIS_URL, CACHE_TTL
+
+
+class NullCache(object):
+    """Кеш, который ничего не хранит."""
+
+    shared = True
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(object):
+    """LRU-кеш в памяти процесса с временем жизни записей.
+
+    invalidate() очищает кеш только того процесса, который изменил запись,
+    поэтому перед выдачей записи из этого кеша проверяется версия записи.
+    """
+
+    shared = False
+
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class RedisCache(object):
+    """Кеш в Redis-совместимом хранилище, общий для всех процессов."""
+
+    shared = True
+
+    # Версия формата записей: записи старого формата после обновления не читаются
+    prefix = 'cache:4:'
+
+    def __init__(self, url, ttl):
+        # redis нужен только для этого бэкенда, поэтому импортируется здесь
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, pickle.dumps(value))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + k for k in keys])
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def make_cache(backend):
+    if backend == 'memory':
+        return MemoryCache(CACHE_MAX_ITEMS, CACHE_TTL)
+    if backend == 'redis':
+        return RedisCache(CACHE_REDIS_URL, CACHE_TTL)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f'Unknown cache backend: {backend}')
+
+
+cache = make_cache(CACHE_BACKEND)
+
+
+def book_key(book_id):
+    return f'book:{int(book_id)}'
+
+
+def author_key(author_id):
+    return f'author:{int(author_id)}'
+
+
+def encoded_key(key, encoding):
+    """Ключ сжатого варианта тела записи key."""
+    return f'{key}:{encoding}'
+
+
+def cached_response(key, load, dump, version):
+    """Ответ с сериализованным JSON из кеша.
+
+    В кеше хранятся тело ответа, ETag, время изменения записи и версия
+    записи. При промахе запись получается через
+    load() и сериализуется через dump(), но только если клиент не прислал
+    актуальные If-None-Match/If-Modified-Since - тогда сразу возвращается
+    304. Если load() вернул None, возвращается None. Тело сжимается при
+    первом запросе с нужным Accept-Encoding и дальше берется из кеша сжатым.
+    Сжатое тело хранится под отдельным ключом вместе с ETag и выдается,
+    только если ETag совпадает с ETag записи: запись сжатого варианта не
+    возвращает в кеш запись, удаленную invalidate() между чтением и записью.
+
+    Кеш в памяти процесса не очищается изменениями в других процессах,
+    поэтому запись из него выдается, только если version() - версия записи
+    в базе, одним запросом по первичному ключу - совпадает с сохраненной.
+    """
+    entry = cache.get(key)
+    if entry is not None and not cache.shared and version() != entry[3]:
+        cache.delete(key)
+        entry = None
+    if entry is None:
+        item = load()
+        if item is None:
+            return None
+        etag, last_modified = make_etag(key, item.version), item.updated_at
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+        entry = (jsonify(dump(item)).get_data(), etag, last_modified, item.version)
+        cache.set(key, entry)
+
+    body, etag, last_modified, item_version = entry
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    response = current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    encoding = request_encoding(len(body))
+    if encoding is not None:
+        encoded = cache.get(encoded_key(key, encoding))
+        if encoded is None or encoded[0] != etag:
+            encoded = (etag, compress(body, encoding, current_app.config['COMPRESS_LEVEL']))
+            cache.set(encoded_key(key, encoding), encoded)
+        set_encoded(response, encoded[1], encoding)
+    return set_validators(response, etag, last_modified)
+
+
+def invalidate(books_id=(), authors_id=()):
+    """Удалить из кеша книги и авторов вместе со сжатыми вариантами ответов.
+
+    Вызывается после commit, чтобы параллельный запрос не положил в кеш
+    старые данные между удалением и фиксацией транзакции.
+    """
+    keys = [book_key(x) for x in books_id] + [author_key(x) for x in authors_id]
+    cache.delete(*keys, *[encoded_key(k, e) for k in keys for e in ENCODINGS])
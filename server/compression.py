@@ -0,0 +1,88 @@
+import zlib
+
+from flask import current_app, request
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from instrumentation import metrics
+
+
+# Кодирования в порядке предпочтения сервера
+ENCODINGS = ('gzip', 'deflate')
+
+COMPRESS_MIMETYPES = ('application/json',)
+
+# Параметр wbits zlib: gzip - заголовок gzip, deflate - формат zlib, как требует HTTP
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def negotiate_encoding(accept_encoding):
+    """Кодирование из заголовка Accept-Encoding: gzip, deflate или None."""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(ENCODINGS)
+
+
+def compress(body, encoding, level):
+    """Сжать тело ответа.
+
+    У gzip в заголовке нулевое время, поэтому одно и то же тело всегда
+    сжимается в одни и те же байты.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    data = compressor.compress(body) + compressor.flush()
+    metrics.inc('app_compression_bytes_total', len(body), direction='in')
+    metrics.inc('app_compression_bytes_total', len(data), direction='out')
+    return data
+
+
+def request_encoding(size):
+    """Кодирование для тела размера size в ответе на текущий запрос или None.
+
+    Тела меньше COMPRESS_MIN_SIZE не сжимаются: выигрыш меньше затрат.
+    """
+    config = current_app.config
+    if not config['COMPRESSION'] or size < config['COMPRESS_MIN_SIZE']:
+        return None
+    return negotiate_encoding(request.headers.get('Accept-Encoding'))
+
+
+def set_encoded(response, data, encoding):
+    """Заменить тело ответа сжатым."""
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    metrics.inc('app_compressed_responses_total', encoding=encoding)
+    return response
+
+
+def compressible(response):
+    # Потоковые ответы выдаются по частям и не сжимаются
+    return (
+        response.status_code == 200
+        and response.mimetype in COMPRESS_MIMETYPES
+        and not response.is_streamed
+        and not response.direct_passthrough
+    )
+
+
+def after_request(response):
+    if not current_app.config['COMPRESSION'] or not compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    # Тело уже сжато, например взято из кеша ответов
+    if 'Content-Encoding' in response.headers:
+        return response
+    body = response.get_data()
+    encoding = request_encoding(len(body))
+    if encoding is None:
+        return response
+    return set_encoded(response, compress(body, encoding, current_app.config['COMPRESS_LEVEL']), encoding)
+
+
+def init_app(app):
+    """Подключить сжатие JSON-ответов к приложению.
+
+    Подключается после инструментирования, чтобы в метрики попадал размер
+    сжатого ответа.
+    """
+    app.after_request(after_request)
@@ -0,0 +1,60 @@
+import hashlib
+from datetime import timezone
+
+from flask import current_app, request
+
+
+def make_etag(*parts):
+    """Слабый ETag из ключевых значений ответа."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def list_validators(items, id_attr, pagination):
+    """ETag и Last-Modified страницы списка текущего запроса."""
+    return page_validators(request.full_path, items, id_attr, pagination)
+
+
+def page_validators(full_path, items, id_attr, pagination):
+    """ETag и Last-Modified страницы списка.
+
+    Считаются по строке запроса, блоку пагинации, ID и версиям записей
+    страницы - без сериализации. Версии связанных записей учтены, так как
+    изменения связей и рейтинга увеличивают версию записей с обеих сторон.
+    """
+    etag = make_etag(
+        full_path,
+        sorted(pagination.items()),
+        [(getattr(x, id_attr), x.version) for x in items]
+    )
+    last_modified = max((x.updated_at for x in items if x.updated_at is not None), default=None)
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    """Проверить условные заголовки текущего запроса."""
+    return check_not_modified(request.if_none_match, request.if_modified_since, etag, last_modified)
+
+
+def check_not_modified(if_none_match, since, etag, last_modified):
+    """Проверить If-None-Match, а если его нет - If-Modified-Since."""
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+
+    if since is None or last_modified is None:
+        return False
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    # В Last-Modified передаются целые секунды
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified_response(etag, last_modified):
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
@@ -1,3 +1,4 @@
+from multiprocessing import cpu_count
 from os.path import isfile
 from envparse import env
 
@@ -7,6 +8,81 @@ if isfile('.env'):
 
 # Number of items per page
 PAGINATE_VALUE = env.int('PAGINATE_VALUE')
+# Max number of items per page (pagin, limit), larger pages are rejected
+PAGE_SIZE_MAX = env.int('PAGE_SIZE_MAX', default=100)
+# Per-list overrides of the default and max page size, e.g. "books_search=10,authors=20".
+# Lists: books, authors, books_search, books_top, jobs and top_books (top books
+# per author in the list of authors)
+PAGE_SIZE_DEFAULTS = env.dict('PAGE_SIZE_DEFAULTS', subcast=int, default={})
+PAGE_SIZE_LIMITS = env.dict('PAGE_SIZE_LIMITS', subcast=int, default={})
+
+# Number of top books shown for every author in the list of authors
+TOP_BOOKS_VALUE = env.int('TOP_BOOKS_VALUE', default=5)
+
+# Number of top books stored for every author in author stats
+AUTHOR_STATS_TOP = env.int('AUTHOR_STATS_TOP', default=10)
+
+# top_books follows the page size policy: TOP_BOOKS_VALUE by default and by
+# default no more than the stored AUTHOR_STATS_TOP, larger values rank all books
+PAGE_SIZE_DEFAULTS.setdefault('top_books', TOP_BOOKS_VALUE)
+PAGE_SIZE_LIMITS.setdefault('top_books', AUTHOR_STATS_TOP)
+
+# Bayesian prior of the top books ranking: every book gets RATING_PRIOR_VOTES
+# extra marks equal to RATING_PRIOR_MEAN, must be greater than 0
+RATING_PRIOR_MEAN = env.float('RATING_PRIOR_MEAN', default=3.0)
+RATING_PRIOR_VOTES = env.int('RATING_PRIOR_VOTES', default=10)
+
+# Interval in ms for flushing buffered book marks, 0 - write every mark at once
+RATING_BUFFER_MS = env.int('RATING_BUFFER_MS', default=0)
+
+# Max number of items in one bulk create request
+BULK_MAX_ITEMS = env.int('BULK_MAX_ITEMS', default=1000)
+
+# Max number of ids in one GET /books?ids= or GET /authors?ids= request
+BATCH_MAX_IDS = env.int('BATCH_MAX_IDS', default=100)
+
+# Cache of single books and authors: memory, redis or none
+CACHE_BACKEND = env.str('CACHE_BACKEND', default='memory')
+# Lifetime of cached items in seconds
+CACHE_TTL = env.int('CACHE_TTL', default=300)
+# Max number of items in memory cache
+CACHE_MAX_ITEMS = env.int('CACHE_MAX_ITEMS', default=10000)
+# Address of redis cache
+CACHE_REDIS_URL = env.str('CACHE_REDIS_URL', default='redis://localhost:6379/0')
+
+# Background jobs (manage.py worker): threads of one worker process, seconds
+# between polls of an empty queue, attempts of a failing job and the delay
+# before the first retry, doubled on every next one
+JOB_WORKER_CONCURRENCY = env.int('JOB_WORKER_CONCURRENCY', default=2)
+JOB_POLL_INTERVAL = env.float('JOB_POLL_INTERVAL', default=1.0)
+JOB_MAX_ATTEMPTS = env.int('JOB_MAX_ATTEMPTS', default=3)
+JOB_RETRY_DELAY = env.int('JOB_RETRY_DELAY', default=5)
+# Running jobs older than this, seconds, are considered lost by a crashed worker
+JOB_TIMEOUT = env.int('JOB_TIMEOUT', default=600)
+# Unfinished jobs are deduplicated by Idempotency-Key for this long, seconds
+JOB_DEDUP_TTL = env.int('JOB_DEDUP_TTL', default=3600)
+# Max running jobs of one kind across all workers, e.g. "author_stats.rebuild=1"
+JOB_KIND_CONCURRENCY = env.dict('JOB_KIND_CONCURRENCY', subcast=int, default={})
+
+# Rate limiter bucket store: memory (per process) or sqlite (file shared by
+# all server processes on the host), and max clients kept in memory
+RATE_LIMIT_STORE = env.str('RATE_LIMIT_STORE', default='memory')
+RATE_LIMIT_STORE_PATH = env.str('RATE_LIMIT_STORE_PATH', default='/tmp/rate_limit.sqlite')
+RATE_LIMIT_MAX_CLIENTS = env.int('RATE_LIMIT_MAX_CLIENTS', default=100000)
+
+# Async server (async_app.py): port, connections of async DB driver and
+# threads for requests passed to the Flask app
+ASYNC_SERVER_PORT = env.int('ASYNC_SERVER_PORT', default=8081)
+ASYNC_DB_POOL_SIZE = env.int('ASYNC_DB_POOL_SIZE', default=20)
+ASYNC_WSGI_THREADS = env.int('ASYNC_WSGI_THREADS', default=4)
+
+# Production server (gunicorn) settings
+SERVER_BIND = env.str('SERVER_BIND', default='0.0.0.0:8080')
+SERVER_WORKERS = env.int('SERVER_WORKERS', default=cpu_count() * 2 + 1)
+SERVER_THREADS = env.int('SERVER_THREADS', default=4)
+SERVER_KEEPALIVE = env.int('SERVER_KEEPALIVE', default=5)
+SERVER_TIMEOUT = env.int('SERVER_TIMEOUT', default=30)
+SERVER_GRACEFUL_TIMEOUT = env.int('SERVER_GRACEFUL_TIMEOUT', default=30)
 
 
 class Config(object):
@@ -16,3 +92,28 @@ class Config(object):
     SECRET_KEY = env.str('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = env.str('SQLALCHEMY_DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = env.bool('SQLALCHEMY_TRACK_MODIFICATIONS')
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': env.int('DB_POOL_SIZE', default=10),
+        'max_overflow': env.int('DB_MAX_OVERFLOW', default=20),
+        'pool_timeout': env.int('DB_POOL_TIMEOUT', default=10),
+        'pool_recycle': env.int('DB_POOL_RECYCLE', default=1800),
+        'pool_pre_ping': env.bool('DB_POOL_PRE_PING', default=True),
+    }
+    # Per-request SQL and serialization stats, Server-Timing headers and /metrics
+    INSTRUMENTATION = env.bool('INSTRUMENTATION', default=False)
+    # Statements slower than this are logged, ms, 0 - do not log
+    SLOW_QUERY_MS = env.int('SLOW_QUERY_MS', default=100)
+    # Serializer of books and authors: compiled or marshmallow
+    SERIALIZER = env.str('SERIALIZER', default='compiled')
+    # Rows selected and serialized at once in streamed list responses
+    STREAM_CHUNK_SIZE = env.int('STREAM_CHUNK_SIZE', default=500)
+    # gzip/deflate compression of JSON responses not smaller than
+    # COMPRESS_MIN_SIZE bytes, zlib level 1 (fast) - 9 (small)
+    COMPRESSION = env.bool('COMPRESSION', default=True)
+    COMPRESS_MIN_SIZE = env.int('COMPRESS_MIN_SIZE', default=1024)
+    COMPRESS_LEVEL = env.int('COMPRESS_LEVEL', default=6)
+    # Token bucket limits per client, "N/S" - N requests per S seconds, keyed by
+    # "blueprint.METHOD", "blueprint" or "default", e.g. "books.PATCH=10/1"
+    RATE_LIMITS = env.dict('RATE_LIMITS', default={})
+    # Max requests of one client running at once in a process, 0 - unlimited
+    RATE_LIMIT_CONCURRENCY = env.int('RATE_LIMIT_CONCURRENCY', default=0)
@@ -84,7 +84,7 @@ DATA_TEST_AUTHORS_PAGINATION = {
   'has_next':True,
   'has_prev':True,
   'next_num':4,
-  'pages':4,
+  'pages':5,
   'prev_num':2
 }
 
@@ -93,7 +93,7 @@ DATA_TEST_BOOKS_PAGINATION = {
   'has_next':True,
   'has_prev':True,
   'next_num':3,
-  'pages':5,
+  'pages':4,
   'prev_num':1
 }
 
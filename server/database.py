@@ -0,0 +1,80 @@
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy.pool import QueuePool
+
+
+# Настройки пула, которые не применимы к SQLite
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'poolclass')
+
+
+class PoolWaitStats(object):
+    """Статистика ожидания соединения из пула."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = .0
+        self.max = .0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, timeout=False):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if timeout:
+                self.timeouts += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'total_ms': round(self.total * 1000, 3),
+                'max_ms': round(self.max * 1000, 3),
+                'timeouts': self.timeouts,
+            }
+
+
+pool_wait = PoolWaitStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool, который учитывает время ожидания свободного соединения."""
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            conn = super(TimedQueuePool, self)._do_get()
+        except Exception:
+            pool_wait.add(time.monotonic() - started, timeout=True)
+            raise
+        pool_wait.add(time.monotonic() - started)
+        return conn
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy с учетом времени ожидания соединений из пула."""
+
+    def create_engine(self, sa_url, engine_opts):
+        if sa_url.drivername.startswith('sqlite'):
+            for key in QUEUE_POOL_OPTIONS:
+                engine_opts.pop(key, None)
+        else:
+            engine_opts.setdefault('poolclass', TimedQueuePool)
+        return super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+
+
+def pool_status(pool):
+    """Состояние пула соединений: размер, занятые и сверх лимита."""
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    status['wait'] = pool_wait.as_dict()
+    return status
@@ -0,0 +1,54 @@
+from sqlalchemy.orm import load_only, selectinload
+
+
+# Связи, которые можно вложить в ответ, и колонки, которые загружаются всегда:
+# ключ и рейтинг для курсора, версия и время изменения для ETag
+BOOK_RELATIONS = ('authors',)
+BOOK_KEYS = ('book_id', 'rating', 'version', 'updated_at')
+AUTHOR_RELATIONS = ('books',)
+# Части ответа, которые не являются связями и вкладываются только по include
+AUTHOR_EXTRAS = ('stats',)
+AUTHOR_KEYS = ('author_id', 'version', 'updated_at')
+
+
+class FieldsError(ValueError):
+    """Некорректный параметр fields или include."""
+
+
+def split_arg(value):
+    return [x.strip() for x in (value or '').split(',') if x.strip()]
+
+
+def fieldset_args(args, schema_class, relations, extras=()):
+    """Поля ответа и вложенные связи из параметров fields и include.
+
+    Возвращает (only, include): only - кортеж полей для schema_class(only=...)
+    или None для всех полей, include - множество связей из relations, которые
+    нужно загрузить и вложить в ответ. Без обоих параметров ответ полный, со
+    всеми связями. Если передан fields, связи вкладываются только из include.
+    extras - части ответа не из схемы, они попадают в include только явно.
+    """
+    if 'fields' not in args and 'include' not in args:
+        return None, set(relations)
+
+    declared = [x for x in schema_class._declared_fields if x not in relations]
+    fields = split_arg(args.get('fields')) or declared
+    include = set(split_arg(args.get('include')))
+    unknown = [x for x in fields if x not in declared] + sorted(include - set(relations) - set(extras))
+    if unknown:
+        raise FieldsError(f'Unknown fields: {", ".join(unknown)}')
+    return tuple(dict.fromkeys(fields)) + tuple(sorted(include - set(extras))), include
+
+
+def query_options(model, only, include, keys):
+    """Опции запроса: только нужные колонки и загрузка вложенных связей.
+
+    keys - колонки, которые нужны независимо от fields: первичный ключ,
+    поля курсора и версии записи для ETag. Связи из include загружаются
+    одним дополнительным запросом, остальные не загружаются вовсе.
+    """
+    options = [selectinload(getattr(model, x)) for x in sorted(include)]
+    if only is not None:
+        columns = [x for x in only if x in model.__table__.c] + list(keys)
+        options.append(load_only(*dict.fromkeys(columns)))
+    return options
@@ -0,0 +1,25 @@
+from config import (
+    SERVER_BIND, SERVER_GRACEFUL_TIMEOUT, SERVER_KEEPALIVE, SERVER_THREADS,
+    SERVER_TIMEOUT, SERVER_WORKERS
+)
+
+
+bind = SERVER_BIND
+workers = SERVER_WORKERS
+threads = SERVER_THREADS
+worker_class = 'gthread'
+keepalive = SERVER_KEEPALIVE
+timeout = SERVER_TIMEOUT
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+
+# Приложение и таблицы создаются один раз в мастер-процессе до fork,
+# поэтому все воркеры получают одинаково инициализированное приложение
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Соединения из пула мастер-процесса нельзя использовать в воркерах
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.json import JSONEncoder
+from marshmallow import Schema
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import pool_wait
+
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы длительности запросов, сек
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class Metrics(object):
+    """Счетчики и гистограммы процесса в текстовом формате Prometheus.
+
+    Метрики хранятся в памяти процесса, поэтому при нескольких процессах
+    сервера каждый отдает свои значения.
+    """
+
+    def __init__(self):
+        self._kinds = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._kinds[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """Добавить значение в гистограмму."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._values.get(key, ([0] * len(DURATION_BUCKETS), 0, 0))
+            i = bisect_left(DURATION_BUCKETS, value)
+            if i < len(buckets):
+                buckets[i] += 1
+            self._values[key] = (buckets, total + value, count + 1)
+
+    def get(self, name, **labels):
+        return self._values.get((name, tuple(sorted(labels.items()))))
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        for name, (kind, help_text) in sorted(self._kinds.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (value_name, labels), value in values:
+                if value_name != name:
+                    continue
+                if kind == 'histogram':
+                    buckets, total, count = value
+                    cumulative = 0
+                    for le, bucket in zip(DURATION_BUCKETS, buckets):
+                        cumulative += bucket
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{format_labels(labels)} {count}')
+                else:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+metrics = Metrics()
+metrics.describe('app_requests_total', 'counter', 'Requests by endpoint, method and status.')
+metrics.describe('app_request_duration_seconds', 'histogram', 'Request duration.')
+metrics.describe('app_db_queries_total', 'counter', 'SQL statements executed by requests.')
+metrics.describe('app_db_seconds_total', 'counter', 'Time spent in SQL statements by requests.')
+metrics.describe('app_serialization_seconds_total', 'counter', 'Time spent in schema dump and JSON encoding.')
+metrics.describe('app_response_bytes_total', 'counter', 'Size of response bodies.')
+metrics.describe('app_slow_queries_total', 'counter', 'SQL statements slower than SLOW_QUERY_MS.')
+metrics.describe('app_db_pool_wait_total', 'counter', 'Connection checkouts from the pool.')
+metrics.describe('app_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pool connection.')
+metrics.describe('app_db_pool_wait_max_seconds', 'gauge', 'Longest wait for a pool connection.')
+metrics.describe('app_db_pool_timeouts_total', 'counter', 'Pool checkouts failed by timeout.')
+metrics.describe('app_page_size_rejected_total', 'counter', 'List requests rejected by the page size policy.')
+metrics.describe('app_rate_limited_total', 'counter', 'Requests rejected by the rate limiter.')
+metrics.describe('app_compressed_responses_total', 'counter', 'Responses sent compressed, by encoding.')
+metrics.describe('app_compression_bytes_total', 'counter', 'Bytes passed to and produced by the compressor.')
+
+
+class RequestStats(object):
+    """Показатели одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = .0
+        self.serialization_time = .0
+        self.serialization_depth = 0
+
+
+def enabled():
+    return current_app.config.get('INSTRUMENTATION', False)
+
+
+def request_stats():
+    """Показатели текущего запроса или None, если инструментирование выключено."""
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+@contextmanager
+def timed_serialization():
+    """Учесть время сериализации без времени запросов к базе внутри нее.
+
+    Вложенные вызовы (вложенные схемы) учитываются один раз, а ленивые
+    загрузки связей во время сериализации попадают во время базы.
+    """
+    stats = request_stats()
+    if stats is None:
+        yield
+        return
+    stats.serialization_depth += 1
+    started, db_time = time.perf_counter(), stats.db_time
+    try:
+        yield
+    finally:
+        stats.serialization_depth -= 1
+        if stats.serialization_depth == 0:
+            stats.serialization_time += time.perf_counter() - started - (stats.db_time - db_time)
+
+
+class TimedSchema(Schema):
+    """Схема, время сериализации которой учитывается в показателях запроса."""
+
+    def dump(self, obj, *, many=None):
+        with timed_serialization():
+            return super(TimedSchema, self).dump(obj, many=many)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """JSON-энкодер Flask, время работы которого учитывается в показателях запроса."""
+
+    def encode(self, o):
+        with timed_serialization():
+            return super(TimedJSONEncoder, self).encode(o)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if not has_app_context() or not enabled():
+        return
+
+    stats = request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+    slow_ms = current_app.config.get('SLOW_QUERY_MS', 0)
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        metrics.inc('app_slow_queries_total')
+        logger.warning('Slow query %.1f ms: %s %.1000r', elapsed * 1000, statement, parameters)
+
+
+def before_request():
+    if enabled():
+        g._request_stats = RequestStats()
+
+
+def after_request(response):
+    stats = request_stats()
+    if stats is None:
+        return response
+
+    duration = time.perf_counter() - stats.started
+    size = response.calculate_content_length() or 0
+    response.headers['Server-Timing'] = ', '.join((
+        f'db;dur={stats.db_time * 1000:.3f};desc="{stats.queries} queries"',
+        f'ser;dur={stats.serialization_time * 1000:.3f}',
+        f'size;desc="{size} bytes"',
+        f'total;dur={duration * 1000:.3f}',
+    ))
+
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('app_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe('app_request_duration_seconds', duration, endpoint=endpoint)
+    metrics.inc('app_db_queries_total', stats.queries, endpoint=endpoint)
+    metrics.inc('app_db_seconds_total', stats.db_time, endpoint=endpoint)
+    metrics.inc('app_serialization_seconds_total', stats.serialization_time, endpoint=endpoint)
+    metrics.inc('app_response_bytes_total', size, endpoint=endpoint)
+    return response
+
+
+def metrics_view():
+    """Метрики процесса в текстовом формате Prometheus."""
+    if not enabled():
+        return current_app.response_class('Instrumentation is disabled.\n', status=404, mimetype='text/plain')
+
+    wait = pool_wait.as_dict()
+    metrics.set('app_db_pool_wait_total', wait['count'])
+    metrics.set('app_db_pool_wait_seconds_total', wait['total_ms'] / 1000)
+    metrics.set('app_db_pool_wait_max_seconds', wait['max_ms'] / 1000)
+    metrics.set('app_db_pool_timeouts_total', wait['timeouts'])
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+_engine_events_installed = False
+
+
+def init_app(app):
+    """Подключить инструментирование к приложению.
+
+    Обработчики подключаются всегда, но ничего не делают, пока в настройках
+    приложения выключен INSTRUMENTATION.
+    """
+    global _engine_events_installed
+    if not _engine_events_installed:
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        _engine_events_installed = True
+
+    app.json_encoder = TimedJSONEncoder
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
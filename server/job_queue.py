@@ -0,0 +1,309 @@
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_script import Command, Option
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from config import (
+    JOB_DEDUP_TTL, JOB_KIND_CONCURRENCY, JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL, JOB_RETRY_DELAY,
+    JOB_TIMEOUT, JOB_WORKER_CONCURRENCY
+)
+from models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Функции задач по типу задачи, заполняется декоратором task
+tasks = {}
+
+# Количество задач из начала очереди, среди которых воркер ищет задачу для себя
+CLAIM_CANDIDATES = 20
+
+
+def task(kind):
+    """Зарегистрировать функцию как задачу типа kind.
+
+    Функция вызывается с аргументами из payload задачи, ее результат
+    сохраняется в JSON. Функция не делает commit: ее изменения фиксируются
+    одной транзакцией со статусом done, поэтому повтор после ошибки или
+    падения воркера не применяет их дважды. Действия, которые нужно сделать
+    только после commit, передаются в on_commit. Модуль с задачей должен
+    импортироваться при создании приложения, чтобы задача была известна
+    воркеру.
+    """
+    def decorator(func):
+        tasks[kind] = func
+        return func
+    return decorator
+
+
+_callbacks = threading.local()
+
+
+def on_commit(callback):
+    """Вызвать callback после фиксации выполняемой задачи."""
+    _callbacks.items.append(callback)
+
+
+def dedup_key(kind, value):
+    return hashlib.sha1(f'{kind}:{value}'.encode()).hexdigest()
+
+
+def enqueue(kind, payload=None, max_attempts=None, key=None):
+    """Поставить задачу в очередь, commit делает вызывающий.
+
+    Если задан key и незавершенная задача того же типа с тем же ключом
+    поставлена не раньше JOB_DEDUP_TTL секунд назад, возвращается она, новая
+    задача не создается. У завершенных задач ключ очищается, у задач старше
+    JOB_DEDUP_TTL - очищается здесь.
+    """
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+        run_at=datetime.utcnow()
+    )
+    if key is None:
+        db.session.add(job)
+        db.session.flush()
+        return job
+
+    job.dedup_key = dedup_key(kind, key)
+    existing = Job.query.filter(Job.dedup_key == job.dedup_key).first()
+    if existing is not None:
+        if existing.created_at >= job.run_at - timedelta(seconds=JOB_DEDUP_TTL):
+            return existing
+        Job.query.filter(Job.job_id == existing.job_id, Job.dedup_key == job.dedup_key) \
+            .update({'dedup_key': None}, synchronize_session=False)
+    # Одновременная постановка с тем же ключом откатывает только точку сохранения
+    try:
+        with db.session.begin_nested():
+            db.session.add(job)
+    except IntegrityError:
+        return Job.query.filter(Job.dedup_key == job.dedup_key).one()
+    return job
+
+
+def claim(worker_id):
+    """Взять следующую задачу из очереди, None если подходящих задач нет.
+
+    Задача переводится в running условным UPDATE: если ее одновременно
+    взял другой воркер, обновится 0 строк и берется следующая. Типы задач,
+    у которых выполняется JOB_KIND_CONCURRENCY задач, пропускаются.
+    """
+    now = datetime.utcnow()
+    running = dict(
+        db.session.query(Job.kind, db.func.count(Job.job_id))
+        .filter(Job.status == 'running')
+        .group_by(Job.kind)
+    )
+    candidates = db.session.query(Job.job_id, Job.kind) \
+        .filter(Job.status == 'queued', Job.run_at <= now) \
+        .order_by(Job.run_at, Job.job_id) \
+        .limit(CLAIM_CANDIDATES) \
+        .all()
+    for job_id, kind in candidates:
+        limit = JOB_KIND_CONCURRENCY.get(kind)
+        if limit is not None and running.get(kind, 0) >= limit:
+            continue
+        updated = Job.query.filter(Job.job_id == job_id, Job.status == 'queued').update({
+            'status': 'running',
+            'locked_by': worker_id,
+            'started_at': now,
+            'attempts': Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if updated:
+            return Job.query.get(job_id)
+    db.session.commit()
+    return None
+
+
+def finish(job_id, **values):
+    """Завершить задачу и освободить ее ключ для новых задач."""
+    Job.query.filter(Job.job_id == job_id).update(
+        dict(values, locked_by=None, dedup_key=None, finished_at=datetime.utcnow()),
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+def retry(job_id, attempts, max_attempts, error):
+    """Вернуть задачу в очередь с задержкой JOB_RETRY_DELAY * 2 ** (attempts - 1) или пометить failed."""
+    if attempts >= max_attempts:
+        finish(job_id, status='failed', error=error)
+        return
+    delay = JOB_RETRY_DELAY * 2 ** (attempts - 1)
+    Job.query.filter(Job.job_id == job_id).update({
+        'status': 'queued',
+        'locked_by': None,
+        'error': error,
+        'run_at': datetime.utcnow() + timedelta(seconds=delay)
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def run(job):
+    """Выполнить взятую задачу, вернуть True при успехе.
+
+    Изменения задачи и статус done фиксируются одной транзакцией и только
+    если задача все еще выполняется этим воркером: задачу, вернувшуюся в
+    очередь по JOB_TIMEOUT и взятую другим воркером, откатывает тот, кто
+    завершит ее вторым.
+    """
+    job_id, kind, attempts, max_attempts = job.job_id, job.kind, job.attempts, job.max_attempts
+    locked_by, payload = job.locked_by, job.payload
+    func = tasks.get(kind)
+    if func is None:
+        finish(job_id, status='failed', error=f'Unknown job kind: {kind}.')
+        return False
+
+    _callbacks.items = []
+    try:
+        result = json.dumps(func(**json.loads(payload)))
+        done = Job.query.filter(
+            Job.job_id == job_id, Job.status == 'running', Job.locked_by == locked_by
+        ).update({
+            'status': 'done',
+            'result': result,
+            'error': None,
+            'locked_by': None,
+            'dedup_key': None,
+            'finished_at': datetime.utcnow()
+        }, synchronize_session=False)
+        if not done:
+            db.session.rollback()
+            logger.warning('Job %d (%s) was taken over by another worker, changes rolled back', job_id, kind)
+            return False
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %d (%s) failed, attempt %d of %d', job_id, kind, attempts, max_attempts)
+        retry(job_id, attempts, max_attempts, f'{type(e).__name__}: {e}')
+        return False
+    finally:
+        callbacks, _callbacks.items = _callbacks.items, []
+
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception('Job %d (%s): after commit callback failed', job_id, kind)
+    return True
+
+
+def requeue_stale():
+    """Вернуть в очередь задачи, выполняемые дольше JOB_TIMEOUT, вернуть их количество.
+
+    Такие задачи остались от упавшего воркера. Задачи без оставшихся
+    попыток помечаются failed.
+    """
+    now = datetime.utcnow()
+    stale = Job.query.filter(Job.status == 'running', Job.started_at < now - timedelta(seconds=JOB_TIMEOUT))
+    stale.filter(Job.attempts >= Job.max_attempts).update({
+        'status': 'failed',
+        'locked_by': None,
+        'error': 'Timed out.',
+        'dedup_key': None,
+        'finished_at': now
+    }, synchronize_session=False)
+    count = stale.update({
+        'status': 'queued',
+        'locked_by': None,
+        'error': 'Timed out.',
+        'run_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def run_pending(worker_id='inline'):
+    """Выполнить все готовые задачи в текущем потоке, вернуть их количество."""
+    count = 0
+    job = claim(worker_id)
+    while job is not None:
+        run(job)
+        count += 1
+        job = claim(worker_id)
+    return count
+
+
+class Worker(object):
+    """Обработчик очереди задач в concurrency потоках.
+
+    Каждый поток работает в своем контексте приложения и со своей сессией
+    базы. По SIGTERM или Ctrl+C потоки дорабатывают текущие задачи и
+    завершаются.
+    """
+
+    def __init__(self, app, concurrency, poll_interval=JOB_POLL_INTERVAL):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def loop(self, number):
+        worker_id = f'{self.worker_id}:{number}'
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    job = claim(worker_id)
+                    if job is None:
+                        requeue_stale()
+                    else:
+                        run(job)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    logger.exception('Job worker %s: database error', worker_id)
+                    job = None
+                if job is None:
+                    self.stopping.wait(self.poll_interval)
+            db.session.remove()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        threads = [threading.Thread(target=self.loop, args=(i,)) for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(x.is_alive() for x in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+        for thread in threads:
+            thread.join()
+
+
+class WorkerCommand(Command):
+    """Обработчик фоновых задач."""
+
+    option_list = (
+        Option('-c', '--concurrency', dest='concurrency', type=int, default=JOB_WORKER_CONCURRENCY,
+               help='Worker threads'),
+        Option('--once', dest='once', action='store_true', default=False,
+               help='Run ready jobs and exit'),
+    )
+
+    def run(self, concurrency, once):
+        if once:
+            count = run_pending()
+            print(f'jobs: done {count} jobs', file=sys.stderr)
+            return
+        print(f'jobs: worker started, {concurrency} threads', file=sys.stderr)
+        Worker(current_app._get_current_object(), concurrency).run()
@@ -0,0 +1,44 @@
+from flask import Blueprint
+from flask import request
+from flask import jsonify
+
+from models import Job
+from pagination import PageSizeError, limit_arg
+from schemas import JobSchema
+
+
+jobs = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+error_resp = {'success': False, 'message': '', 'validation_error': {}}
+success_resp = {'success': True, 'message': ''}
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+@jobs.route('', methods=['GET'])
+def jobs_get():
+    """Состояние фоновых задач."""
+    job_id = request.args.get('id')
+    job_schema = JobSchema()
+
+    if job_id is not None and job_id.isdigit():
+        # Получить задачу по ID
+        job = Job.query.get(int(job_id))
+        if job is None:
+            return jsonify(dict(success_resp, message=f'No job found with id={job_id}'))
+        return jsonify(job_schema.dump(job))
+
+    # Последние задачи, новые первыми
+    status = request.args.get('status')
+    if status is not None and status not in JOB_STATUSES:
+        return jsonify(dict(error_resp, message=f'Invalid status: {status}, expected one of {", ".join(JOB_STATUSES)}.'))
+    try:
+        limit = limit_arg(request.args, 'jobs')
+    except PageSizeError as e:
+        return jsonify(dict(error_resp, message=str(e)))
+
+    query = Job.query
+    if status is not None:
+        query = query.filter(Job.status == status)
+    items = query.order_by(Job.job_id.desc()).limit(limit).all()
+    return jsonify({'jobs': job_schema.dump(items, many=True)})
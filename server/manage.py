@@ -1,4 +1,11 @@
 from app import *
+from job_queue import WorkerCommand
+from transfer import ExportCommand, ImportCommand
+
+
+manager.add_command('export', ExportCommand())
+manager.add_command('import', ImportCommand())
+manager.add_command('worker', WorkerCommand())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,26 @@
+"""add rating_sum to book
+
+Revision ID: 2b7e41c0d9a3
+Revises: 6d8f23f4db18
+Create Date: 2026-10-18 10:12:40.118254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e41c0d9a3'
+down_revision = '6d8f23f4db18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('book', sa.Column('rating_sum', sa.Integer(), nullable=True))
+    # Оценки целые, поэтому сумма восстанавливается из среднего без потерь
+    op.execute('UPDATE book SET rating_sum = ROUND(COALESCE(rating, 0) * COALESCE(count_marks, 0))')
+
+
+def downgrade():
+    op.drop_column('book', 'rating_sum')
@@ -0,0 +1,28 @@
+"""author stats rated count and rating total
+
+Revision ID: 3e8b1d7c5a92
+Revises: f5a9c3e7b2d6
+Create Date: 2026-10-18 21:12:47.203618
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e8b1d7c5a92'
+down_revision = 'f5a9c3e7b2d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('author_stats', sa.Column('rated_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('author_stats', sa.Column('rating_total', sa.Float(precision=53), server_default='0', nullable=False))
+    # Старые строки без суммы рейтингов удаляются: до POST /authors/stats/rebuild сводка считается на лету
+    op.execute('DELETE FROM author_stats')
+
+
+def downgrade():
+    op.drop_column('author_stats', 'rating_total')
+    op.drop_column('author_stats', 'rated_count')
@@ -0,0 +1,32 @@
+"""add indexes for author books, book rating and author name
+
+Revision ID: 5f3a8e21c7d4
+Revises: d40a9b3c6e15
+Create Date: 2026-10-18 12:20:45.671392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3a8e21c7d4'
+down_revision = 'd40a9b3c6e15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_books_author_id_book_id', 'books', ['author_id', 'book_id'], unique=False)
+    op.create_index('ix_book_rating', 'book', ['rating'], unique=False)
+    op.create_index('ix_author_name_sername', 'author', ['name', 'sername'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_author_name_sername', table_name='author')
+    op.drop_index('ix_book_rating', table_name='book')
+    if op.get_bind().dialect.name == 'mysql':
+        # MySQL удаляет свой индекс для внешнего ключа на author_id, когда
+        # появляется составной индекс, поэтому его нужно вернуть
+        op.create_index('author_id', 'books', ['author_id'], unique=False)
+    op.drop_index('ix_books_author_id_book_id', table_name='books')
@@ -0,0 +1,25 @@
+"""release dedup keys of finished jobs
+
+Revision ID: 7a4c2e9f1b58
+Revises: 3e8b1d7c5a92
+Create Date: 2026-10-18 22:05:18.417902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4c2e9f1b58'
+down_revision = '3e8b1d7c5a92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Ключ нужен только незавершенным задачам, см. job_queue.enqueue
+    op.execute("UPDATE job SET dedup_key = NULL WHERE status IN ('done', 'failed')")
+
+
+def downgrade():
+    pass
@@ -0,0 +1,28 @@
+"""add version and updated_at to book and author
+
+Revision ID: 8c1d5e07f6b2
+Revises: 2b7e41c0d9a3
+Create Date: 2026-10-18 11:04:17.532810
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1d5e07f6b2'
+down_revision = '2b7e41c0d9a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('book', 'author'):
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')))
+
+
+def downgrade():
+    for table in ('book', 'author'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
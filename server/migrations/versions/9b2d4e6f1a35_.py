@@ -0,0 +1,26 @@
+"""add job dedup key
+
+Revision ID: 9b2d4e6f1a35
+Revises: c4f1a8d2e6b3
+Create Date: 2026-10-18 19:12:44.207318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4e6f1a35'
+down_revision = 'c4f1a8d2e6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job', sa.Column('dedup_key', sa.String(length=40), nullable=True))
+    op.create_index('ix_job_dedup_key', 'job', ['dedup_key'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_job_dedup_key', table_name='job')
+    op.drop_column('job', 'dedup_key')
@@ -0,0 +1,33 @@
+"""add author stats
+
+Revision ID: a7c2e9d41f08
+Revises: 5f3a8e21c7d4
+Create Date: 2026-10-18 14:05:12.384519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e9d41f08'
+down_revision = '5f3a8e21c7d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('author_stats',
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('books_count', sa.Integer(), nullable=False),
+    sa.Column('avg_rating', sa.Float(precision=53), nullable=True),
+    sa.Column('top_books', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['author.author_id'], ),
+    sa.PrimaryKeyConstraint('author_id')
+    )
+    # Сводка заполняется через POST /authors/stats/rebuild, до этого считается на лету
+
+
+def downgrade():
+    op.drop_table('author_stats')
@@ -0,0 +1,27 @@
+"""add fulltext index on book name and description
+
+Revision ID: d40a9b3c6e15
+Revises: 8c1d5e07f6b2
+Create Date: 2026-10-18 11:52:03.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd40a9b3c6e15'
+down_revision = '8c1d5e07f6b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FULLTEXT есть только в MySQL, в остальных базах поиск идет по индексу в памяти
+    if op.get_bind().dialect.name == 'mysql':
+        op.create_index('ix_book_fulltext', 'book', ['name', 'description'], mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'mysql':
+        op.drop_index('ix_book_fulltext', table_name='book')
@@ -0,0 +1,32 @@
+"""add weighted_rating to book
+
+Revision ID: e3b6f0a2d917
+Revises: a7c2e9d41f08
+Create Date: 2026-10-18 15:02:47.219630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from config import RATING_PRIOR_MEAN, RATING_PRIOR_VOTES
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b6f0a2d917'
+down_revision = 'a7c2e9d41f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('book', sa.Column('weighted_rating', sa.Float(precision=53), nullable=False, server_default='0'))
+    op.execute(sa.text(
+        'UPDATE book SET weighted_rating = '
+        '(COALESCE(rating_sum, 0) + :votes * :mean) * 1.0 / (COALESCE(count_marks, 0) + :votes)'
+    ).bindparams(votes=RATING_PRIOR_VOTES, mean=RATING_PRIOR_MEAN))
+    op.create_index('ix_book_weighted_rating_book_id', 'book', ['weighted_rating', 'book_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_book_weighted_rating_book_id', table_name='book')
+    op.drop_column('book', 'weighted_rating')
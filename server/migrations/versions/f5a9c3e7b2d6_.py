@@ -0,0 +1,26 @@
+"""book rating double precision
+
+Revision ID: f5a9c3e7b2d6
+Revises: 9b2d4e6f1a35
+Create Date: 2026-10-18 19:40:31.552907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a9c3e7b2d6'
+down_revision = '9b2d4e6f1a35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column('book', 'rating', type_=sa.Float(precision=53), existing_type=sa.Float(), existing_nullable=True)
+    # Значения FLOAT округлены до одинарной точности, пересчитываются из суммы оценок
+    op.execute('UPDATE book SET rating = rating_sum * 1.0 / count_marks WHERE count_marks > 0')
+
+
+def downgrade():
+    op.alter_column('book', 'rating', type_=sa.Float(), existing_type=sa.Float(precision=53), existing_nullable=True)
@@ -1,20 +1,82 @@
+from datetime import datetime
+
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import selectinload
+
 from app import db
+from config import RATING_PRIOR_MEAN, RATING_PRIOR_VOTES
 
 
 # Таблица для связи МногиеКоМногим авторов и книг
 books = db.Table('books',
     db.Column('book_id', db.Integer, db.ForeignKey('book.book_id'), primary_key=True),
-    db.Column('author_id', db.Integer, db.ForeignKey('author.author_id'), primary_key=True)
+    db.Column('author_id', db.Integer, db.ForeignKey('author.author_id'), primary_key=True),
+    # Первичный ключ (book_id, author_id) не помогает искать книги автора
+    db.Index('ix_books_author_id_book_id', 'author_id', 'book_id')
 )
 
 
+def insert_rows(id_column, rows):
+    """Вставить строки одним executemany и вернуть их ID в порядке rows.
+
+    ID читаются одним запросом: строки с ID больше максимального до вставки.
+    Строки параллельных транзакций в него не попадают - незафиксированные
+    не видны, а зафиксированные после первого чтения транзакции не видны
+    при REPEATABLE READ (уровень MySQL по умолчанию; SQLite выполняет
+    пишущие транзакции по одной).
+    """
+    if not rows:
+        return []
+    last_id = db.session.query(db.func.max(id_column)).scalar() or 0
+    db.session.execute(id_column.table.insert(), rows)
+    ids = [x for x, in db.session.query(id_column).filter(id_column > last_id).order_by(id_column)]
+    if len(ids) != len(rows):
+        raise RuntimeError(f'Inserted {len(rows)} rows into {id_column.table.name}, found {len(ids)} new ids.')
+    return ids
+
+
+def insert_links(links):
+    """Вставить связи книг и авторов одним запросом, пропуская уже существующие."""
+    if links:
+        statement = books.insert() \
+            .prefix_with('IGNORE', dialect='mysql') \
+            .prefix_with('OR IGNORE', dialect='sqlite')
+        db.session.execute(statement, links)
+
+
+def weighted_rating(rating_sum, count_marks):
+    """Байесовская оценка книги.
+
+    К оценкам книги добавляются RATING_PRIOR_VOTES оценок RATING_PRIOR_MEAN,
+    поэтому книга с парой высоких оценок не обгоняет книгу с сотней.
+    Принимает числа или колонки, для колонок возвращает SQL-выражение.
+    """
+    return (rating_sum + RATING_PRIOR_VOTES * RATING_PRIOR_MEAN) * 1.0 / (count_marks + RATING_PRIOR_VOTES)
+
+
+def default_weighted_rating(context):
+    """Значение weighted_rating для вставляемой строки книги."""
+    params = context.get_current_parameters()
+    return weighted_rating(params.get('rating_sum') or 0, params.get('count_marks') or 0)
+
+
 class Book(db.Model):
     """Описание модели книг"""
+    # Индекс для выбора лучших книг без сортировки всего каталога
+    __table_args__ = (db.Index('ix_book_weighted_rating_book_id', 'weighted_rating', 'book_id'),)
+
     book_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     description = db.Column(db.Text(), nullable=False)
-    rating = db.Column(db.Float(), default=.0)
+    # Двойная точность: курсор сортировки по рейтингу сравнивает значение с double из JSON
+    rating = db.Column(db.Float(precision=53), default=.0, index=True)
     count_marks = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
+    # Байесовская оценка для рейтинга лучших книг, двойная точность для одинакового порядка в MySQL
+    weighted_rating = db.Column(db.Float(precision=53), default=default_weighted_rating, nullable=False)
+    # Версия и время изменения книги, вместе с рейтингом и списком авторов
+    version = db.Column(db.Integer, default=1, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
     def __init__(self, **kwargs):
         super(Book, self).__init__(**kwargs)
@@ -37,14 +99,140 @@ class Book(db.Model):
     def get_one_item(id):
         return Book.query.get(id)
 
+    @staticmethod
+    def get_version(id):
+        """Текущая версия записи или None, если ее нет."""
+        return db.session.query(Book.version).filter(Book.book_id == id).scalar()
+
+    @staticmethod
+    def get_many(ids, options=None):
+        """Книги из списка ID одним запросом, по умолчанию авторы книг - вторым."""
+        options = [selectinload(Book.authors)] if options is None else options
+        return Book.query.options(*options).filter(Book.book_id.in_(ids)).all()
+
+    @staticmethod
+    def touch(ids):
+        """Увеличить версию и обновить время изменения записей."""
+        ids = list(ids)
+        if ids:
+            Book.query.filter(Book.book_id.in_(ids)).update({
+                Book.version: Book.version + 1,
+                Book.updated_at: datetime.utcnow()
+            }, synchronize_session=False)
+
+    @staticmethod
+    def get_authors_id(books_id):
+        """ID авторов, связанных с книгами из списка."""
+        return {x for x, in db.session.query(books.c.author_id).filter(books.c.book_id.in_(books_id))}
+
+    @staticmethod
+    def link_authors(book_id, authors_id):
+        """Связать книгу с авторами без загрузки коллекций.
+
+        Существование авторов и уже имеющиеся связи проверяются одним
+        запросом, новые связи вставляются одним INSERT IGNORE. Возвращает
+        списки ID авторов: связанных, уже связанных ранее и не найденных.
+        Версии изменившихся записей увеличиваются, commit делает вызывающий.
+        """
+        authors_id = list(dict.fromkeys(authors_id))
+        rows = db.session.query(Author.author_id, books.c.book_id) \
+            .outerjoin(books, db.and_(books.c.author_id == Author.author_id, books.c.book_id == book_id)) \
+            .filter(Author.author_id.in_(authors_id))
+        found = {author_id: link is not None for author_id, link in rows}
+
+        linked = [x for x in authors_id if x in found and not found[x]]
+        insert_links([{'book_id': book_id, 'author_id': x} for x in linked])
+        if linked:
+            Book.touch([book_id])
+            Author.touch(linked)
+        return (
+            linked,
+            [x for x in authors_id if found.get(x)],
+            [x for x in authors_id if x not in found]
+        )
+
+    @staticmethod
+    def bulk_create(items):
+        """Создать книги пачкой.
+
+        items - список пар (Book, [author_id, ]). Книги и связи с авторами
+        вставляются двумя executemany, книгам проставляется book_id. commit
+        делает вызывающий.
+        """
+        rows = [
+            {
+                'name': b.name,
+                'description': b.description,
+                'rating': b.rating or .0,
+                'count_marks': b.count_marks or 0,
+                'rating_sum': b.rating_sum or 0,
+            }
+            for b, _ in items
+        ]
+        for (b, _), book_id in zip(items, insert_rows(Book.book_id, rows)):
+            b.book_id = book_id
+        links = [
+            {'book_id': b.book_id, 'author_id': a_id}
+            for b, authors_id in items for a_id in authors_id
+        ]
+        if links:
+            db.session.execute(books.insert(), links)
+            Author.touch({x['author_id'] for x in links})
+
+    @staticmethod
+    def add_marks(book_id, marks_sum, marks_count):
+        """Добавить оценки к книге одним атомарным UPDATE.
+
+        Среднее и байесовская оценка считаются на стороне базы из накопленной
+        суммы оценок. MySQL вычисляет присваивания слева направо, уже с новыми
+        значениями колонок, поэтому rating и weighted_rating присваиваются
+        первыми - тогда во всех базах они считаются от старых значений суммы
+        и количества оценок.
+        """
+        stmt = db.update(Book.__table__, preserve_parameter_order=True) \
+            .where(Book.book_id == book_id) \
+            .values([
+                (Book.rating, (Book.rating_sum + marks_sum) * 1.0 / (Book.count_marks + marks_count)),
+                (Book.weighted_rating, weighted_rating(Book.rating_sum + marks_sum, Book.count_marks + marks_count)),
+                (Book.count_marks, Book.count_marks + marks_count),
+                (Book.rating_sum, Book.rating_sum + marks_sum),
+                (Book.version, Book.version + 1),
+                (Book.updated_at, datetime.utcnow()),
+            ])
+        return db.session.execute(stmt).rowcount
+
+    @staticmethod
+    def top_rated(limit, min_votes=0):
+        """Лучшие книги каталога по байесовской оценке.
+
+        Книги читаются по индексу (weighted_rating, book_id) от большей оценки,
+        поэтому запрос выбирает limit записей независимо от размера каталога.
+        Авторы всех книг загружаются одним дополнительным запросом.
+        """
+        query = Book.query.options(selectinload(Book.authors))
+        if min_votes > 0:
+            query = query.filter(Book.count_marks >= min_votes)
+        return query.order_by(Book.weighted_rating.desc(), Book.book_id.desc()).limit(limit).all()
+
+
+# Полнотекстовый индекс для поиска книг, есть только в MySQL
+event.listen(Book.__table__, 'after_create', DDL(
+    'CREATE FULLTEXT INDEX ix_book_fulltext ON book (name, description)'
+).execute_if(dialect='mysql'))
+
 
 class Author(db.Model):
     """Описание модели автор"""
+    __table_args__ = (db.Index('ix_author_name_sername', 'name', 'sername'),)
+
     author_id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=False, nullable=False)
     sername = db.Column(db.String(80), unique=False, nullable=True)
+    # Версия и время изменения автора, вместе с его книгами
+    version = db.Column(db.Integer, default=1, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
-    books = db.relationship('Book', secondary=books, lazy='subquery',
+    books = db.relationship('Book', secondary=books, lazy=True,
         backref=db.backref('authors', lazy=True))
 
     def __init__(self, **kwargs):
@@ -64,3 +252,120 @@ class Author(db.Model):
     @staticmethod
     def get_one_item(id):
         return Author.query.get(id)
+
+    @staticmethod
+    def get_version(id):
+        """Текущая версия записи или None, если ее нет."""
+        return db.session.query(Author.version).filter(Author.author_id == id).scalar()
+
+    @staticmethod
+    def get_many(ids, options=None):
+        """Авторы из списка ID одним запросом, по умолчанию книги авторов - вторым."""
+        options = [selectinload(Author.books)] if options is None else options
+        return Author.query.options(*options).filter(Author.author_id.in_(ids)).all()
+
+    @staticmethod
+    def touch(ids):
+        """Увеличить версию и обновить время изменения записей."""
+        ids = list(ids)
+        if ids:
+            Author.query.filter(Author.author_id.in_(ids)).update({
+                Author.version: Author.version + 1,
+                Author.updated_at: datetime.utcnow()
+            }, synchronize_session=False)
+
+    @staticmethod
+    def link_books(author_id, books_id):
+        """Связать автора с книгами без загрузки коллекций.
+
+        Работает как Book.link_authors. Возвращает списки ID книг:
+        связанных, уже связанных ранее и не найденных.
+        """
+        books_id = list(dict.fromkeys(books_id))
+        rows = db.session.query(Book.book_id, books.c.author_id) \
+            .outerjoin(books, db.and_(books.c.book_id == Book.book_id, books.c.author_id == author_id)) \
+            .filter(Book.book_id.in_(books_id))
+        found = {book_id: link is not None for book_id, link in rows}
+
+        linked = [x for x in books_id if x in found and not found[x]]
+        insert_links([{'book_id': x, 'author_id': author_id} for x in linked])
+        if linked:
+            Book.touch(linked)
+            Author.touch([author_id])
+        return (
+            linked,
+            [x for x in books_id if found.get(x)],
+            [x for x in books_id if x not in found]
+        )
+
+    @staticmethod
+    def bulk_create(items):
+        """Создать авторов одним executemany и проставить им author_id, commit делает вызывающий."""
+        rows = [{'name': a.name, 'sername': a.sername} for a in items]
+        for a, author_id in zip(items, insert_rows(Author.author_id, rows)):
+            a.author_id = author_id
+
+    @staticmethod
+    def top_books_query(authors_id, limit):
+        """Запрос пар (author_id, Book): не больше limit лучших по рейтингу книг каждого автора."""
+        rank = db.func.row_number().over(
+            partition_by=books.c.author_id,
+            order_by=(Book.rating.desc(), Book.book_id)
+        )
+        ranked = db.session.query(
+            books.c.author_id.label('author_id'),
+            books.c.book_id.label('book_id'),
+            rank.label('rank')
+        ).join(Book, Book.book_id == books.c.book_id) \
+            .filter(books.c.author_id.in_(authors_id)) \
+            .subquery()
+
+        return db.session.query(ranked.c.author_id, Book) \
+            .join(Book, Book.book_id == ranked.c.book_id) \
+            .filter(ranked.c.rank <= limit) \
+            .order_by(ranked.c.author_id, ranked.c.rank)
+
+
+class AuthorStats(db.Model):
+    """Сводка по книгам автора для списка авторов.
+
+    Хранит количество книг, средний рейтинг оцененных книг и сериализованные
+    лучшие книги автора. Пересчитывается модулем author_stats при изменении
+    рейтингов и связей книг автора.
+    """
+    __tablename__ = 'author_stats'
+
+    author_id = db.Column(db.Integer, db.ForeignKey('author.author_id'), primary_key=True)
+    books_count = db.Column(db.Integer, default=0, nullable=False)
+    # Двойная точность, чтобы значение не менялось при чтении из MySQL
+    avg_rating = db.Column(db.Float(precision=53))
+    # Количество и сумма рейтингов оцененных книг для обновления avg_rating после оценок
+    rated_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_total = db.Column(db.Float(precision=53), default=.0, nullable=False)
+    top_books = db.Column(db.Text(), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Job(db.Model):
+    """Фоновая задача в очереди модуля job_queue."""
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(80), nullable=False)
+    # Ключ для повторной постановки той же задачи, см. job_queue.enqueue
+    dedup_key = db.Column(db.String(40), unique=True, index=True)
+    # Аргументы и результат задачи в JSON, в MySQL - MEDIUMTEXT для пакетов книг
+    payload = db.Column(db.Text(length=2 ** 24 - 1), nullable=False)
+    result = db.Column(db.Text(length=2 ** 24 - 1))
+    error = db.Column(db.Text())
+    # queued, running, done или failed
+    status = db.Column(db.String(16), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=1, nullable=False)
+    # Воркер, выполняющий задачу
+    locked_by = db.Column(db.String(80))
+    # Время, раньше которого задачу не брать: при повторе после ошибки сдвигается
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
@@ -0,0 +1,141 @@
+import base64
+import json
+import math
+
+from app import db
+from config import PAGE_SIZE_DEFAULTS, PAGE_SIZE_LIMITS, PAGE_SIZE_MAX, PAGINATE_VALUE
+from instrumentation import metrics
+
+
+class CursorError(ValueError):
+    """Некорректный курсор пагинации."""
+
+
+def encode_cursor(data):
+    """Упаковать значения ключа последней записи в непрозрачный курсор."""
+    raw = json.dumps(data, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковать курсор, полученный от клиента."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode())
+    except (ValueError, TypeError):
+        raise CursorError(f'Invalid cursor: {cursor}')
+    if not isinstance(data, dict) or not isinstance(data.get('id'), int):
+        raise CursorError(f'Invalid cursor: {cursor}')
+    return data
+
+
+class PageSizeError(ValueError):
+    """Размер страницы не число или больше максимального."""
+
+
+def page_size_policy(endpoint):
+    """Размер страницы по умолчанию и максимальный размер для списка endpoint."""
+    maximum = PAGE_SIZE_LIMITS.get(endpoint, PAGE_SIZE_MAX)
+    return min(PAGE_SIZE_DEFAULTS.get(endpoint, PAGINATE_VALUE), maximum), maximum
+
+
+def page_size(value, endpoint):
+    """Размер страницы из параметра pagin или limit списка endpoint.
+
+    Без параметра возвращается размер по умолчанию. Не число, 0 и размер
+    больше максимального отклоняются PageSizeError, отказ учитывается
+    в метрике app_page_size_rejected_total.
+    """
+    default, maximum = page_size_policy(endpoint)
+    if not value:
+        return default
+    if not value.isdigit() or int(value) == 0:
+        reason = 'invalid'
+    elif int(value) > maximum:
+        reason = 'too_large'
+    else:
+        return int(value)
+    metrics.inc('app_page_size_rejected_total', endpoint=endpoint, reason=reason)
+    raise PageSizeError(f'Invalid page size: {value}, expected 1..{maximum}.')
+
+
+def limit_arg(args, endpoint):
+    """Размер страницы курсорной пагинации из параметра limit."""
+    return page_size(args.get('limit'), endpoint)
+
+
+def top_books_arg(args):
+    """Количество лучших книг каждого автора в списке авторов из параметра top_books."""
+    return page_size(args.get('top_books'), 'top_books')
+
+
+def page_args(args, endpoint):
+    """Номер и размер страницы из параметров page и pagin."""
+    page = args.get('page')
+    if page and page.isdigit():
+        page = int(page)
+    else:
+        page = 1
+    return page, page_size(args.get('pagin'), endpoint)
+
+
+def page_pagination(page, per_page, total):
+    """Блок пагинации страницы page из total записей, как у Query.paginate во Flask-SQLAlchemy."""
+    pages = int(math.ceil(total / float(per_page))) if per_page else 0
+    has_next = page < pages
+    has_prev = page > 1
+    return {
+        'has_next': has_next,
+        'has_prev': has_prev,
+        'next_num': page + 1 if has_next else None,
+        'prev_num': page - 1 if has_prev else None,
+        'pages': pages
+    }
+
+
+def keyset_page(query, id_column, limit, after=None, rating_column=None):
+    """Страница записей без OFFSET и COUNT(*).
+
+    Записи упорядочены по первичному ключу, либо по рейтингу (по убыванию)
+    и первичному ключу, если передан rating_column. Выбирается limit + 1
+    запись, чтобы узнать, есть ли следующая страница.
+    """
+    query = keyset_query(query, id_column, limit, after, rating_column)
+    return keyset_result(query.all(), id_column, limit, rating_column)
+
+
+def keyset_query(query, id_column, limit, after=None, rating_column=None):
+    """Запрос limit + 1 записей после курсора after для keyset_page."""
+    if after is not None:
+        cursor = decode_cursor(after)
+        if rating_column is None:
+            query = query.filter(id_column > cursor['id'])
+        else:
+            if not isinstance(cursor.get('rating'), (int, float)):
+                raise CursorError(f'Invalid cursor: {after}')
+            query = query.filter(db.or_(
+                rating_column < cursor['rating'],
+                db.and_(rating_column == cursor['rating'], id_column > cursor['id'])
+            ))
+
+    if rating_column is None:
+        query = query.order_by(id_column)
+    else:
+        query = query.order_by(rating_column.desc(), id_column)
+    return query.limit(limit + 1)
+
+
+def keyset_result(items, id_column, limit, rating_column=None):
+    """Страница и блок пагинации из записей, выбранных keyset_query."""
+    has_next = len(items) > limit
+    items = items[:limit]
+
+    next_cursor = None
+    if has_next:
+        last = items[-1]
+        key = {'id': getattr(last, id_column.key)}
+        if rating_column is not None:
+            key['rating'] = getattr(last, rating_column.key)
+        next_cursor = encode_cursor(key)
+
+    return items, {'has_next': has_next, 'next_cursor': next_cursor}
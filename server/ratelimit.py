@@ -0,0 +1,220 @@
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from flask import current_app, g, jsonify, request
+
+from config import RATE_LIMIT_MAX_CLIENTS, RATE_LIMIT_STORE, RATE_LIMIT_STORE_PATH
+from instrumentation import metrics
+
+
+@lru_cache(maxsize=None)
+def parse_limit(value):
+    """Лимит вида 'N/S' - N запросов за S секунд - в скорость и емкость корзины."""
+    count, _, seconds = value.partition('/')
+    try:
+        count, seconds = int(count), float(seconds or 1)
+    except ValueError:
+        count = seconds = 0
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f'Invalid rate limit: {value}, expected N/S.')
+    return count / seconds, count
+
+
+def find_limit(limits, scope, method):
+    """Правило для запроса: scope.METHOD, scope или default. Вернуть ключ правила и лимит."""
+    for key in (f'{scope}.{method}', scope, 'default'):
+        if key in limits:
+            return key, parse_limit(limits[key])
+    return None, None
+
+
+def take_token(tokens, updated, rate, capacity, now):
+    """Пополнить корзину за время с updated и взять из нее токен.
+
+    Вернуть оставшиеся токены и время в секундах до появления токена,
+    0 - если токен взят.
+    """
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryStore(object):
+    """Корзины клиентов в памяти процесса.
+
+    При нескольких процессах сервера у каждого свои корзины, поэтому
+    фактический лимит умножается на количество процессов.
+    """
+
+    blocking = False
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens, retry_after = take_token(tokens, updated, rate, capacity, now)
+            self._buckets[key] = (tokens, now)
+            # Вытесняются клиенты, дольше всех не делавшие запросов
+            if len(self._buckets) > self.max_items:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteStore(object):
+    """Корзины клиентов в файле SQLite, общие для всех процессов сервера на машине.
+
+    Корзина читается и обновляется в одной транзакции BEGIN IMMEDIATE, поэтому
+    процессы не теряют взятые токены. Полные корзины периодически удаляются.
+    """
+
+    blocking = True
+    prune_every = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS bucket '
+            '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+        )
+        conn.close()
+
+    def connection(self):
+        # Соединение SQLite нельзя использовать из разных потоков
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return conn
+
+    def take(self, key, rate, capacity, now):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row or (capacity, now)
+            tokens, retry_after = take_token(tokens, updated, rate, capacity, now)
+            conn.execute(
+                'INSERT OR REPLACE INTO bucket VALUES (?, ?, ?, ?)',
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+            self._takes += 1
+            if self._takes % self.prune_every == 0:
+                conn.execute('DELETE FROM bucket WHERE full_at < ?', (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def clear(self):
+        self.connection().execute('DELETE FROM bucket')
+
+
+class InFlight(object):
+    """Количество выполняемых запросов каждого клиента в процессе."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client, limit):
+        with self._lock:
+            count = self._counts.get(client, 0)
+            if count >= limit:
+                return False
+            self._counts[client] = count + 1
+            return True
+
+    def release(self, client):
+        with self._lock:
+            count = self._counts.pop(client) - 1
+            if count:
+                self._counts[client] = count
+
+
+def make_store(backend):
+    if backend == 'memory':
+        return MemoryStore(RATE_LIMIT_MAX_CLIENTS)
+    if backend == 'sqlite':
+        return SqliteStore(RATE_LIMIT_STORE_PATH)
+    raise ValueError(f'Unknown rate limit store: {backend}')
+
+
+store = make_store(RATE_LIMIT_STORE)
+in_flight = InFlight()
+
+
+def admit(limits, concurrency, client, scope, method):
+    """Проверить запрос клиента к scope (блюпринт или эндпоинт).
+
+    Вернуть None, если запрос принят, иначе время в секундах для
+    Retry-After. Принятый запрос при concurrency больше 0 занимает слот
+    клиента, который освобождает in_flight.release. Отказы учитываются
+    в метрике app_rate_limited_total.
+    """
+    rule, limit = find_limit(limits, scope, method)
+    if rule is not None:
+        retry_after = store.take(f'{rule}:{client}', limit[0], limit[1], time.time())
+        if retry_after:
+            metrics.inc('app_rate_limited_total', scope=scope, method=method, reason='rate')
+            return retry_after
+    if concurrency and not in_flight.acquire(client, concurrency):
+        metrics.inc('app_rate_limited_total', scope=scope, method=method, reason='concurrency')
+        return 1
+    return None
+
+
+def retry_after_header(retry_after):
+    return str(max(1, math.ceil(retry_after)))
+
+
+def before_request():
+    concurrency = current_app.config['RATE_LIMIT_CONCURRENCY']
+    client = request.remote_addr
+    retry_after = admit(
+        current_app.config['RATE_LIMITS'],
+        concurrency,
+        client,
+        request.blueprint or request.endpoint or 'unknown',
+        request.method
+    )
+    if retry_after is not None:
+        response = jsonify({'success': False, 'message': 'Too many requests.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = retry_after_header(retry_after)
+        return response
+    if concurrency:
+        g._rate_limit_client = client
+
+
+def teardown_request(exc):
+    # У потокового ответа вызывается после выдачи всего тела
+    client = g.pop('_rate_limit_client', None)
+    if client is not None:
+        in_flight.release(client)
+
+
+def init_app(app):
+    """Подключить ограничение частоты запросов к приложению.
+
+    Лимиты задаются RATE_LIMITS в настройках приложения, без правил
+    и с RATE_LIMIT_CONCURRENCY = 0 запросы не ограничиваются.
+    """
+    app.before_request(before_request)
+    app.teardown_request(teardown_request)
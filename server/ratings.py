@@ -0,0 +1,112 @@
+import atexit
+import logging
+import threading
+import time
+
+from flask import current_app
+
+import author_stats
+from app import db
+from cache import invalidate
+from config import RATING_BUFFER_MS
+from models import Author, Book
+
+
+logger = logging.getLogger(__name__)
+
+
+class RatingBuffer(object):
+    """Накопление оценок книг в памяти процесса.
+
+    Оценки складываются в словарь book_id -> (сумма, количество) и раз в
+    interval_ms записываются в базу пачкой: по одному атомарному UPDATE на
+    книгу, независимо от количества пришедших за это время оценок.
+    """
+
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000
+        self._marks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+
+    def add(self, book_id, rating):
+        """Добавить оценку, вернуть сумму и количество незаписанных оценок книги."""
+        with self._lock:
+            marks_sum, marks_count = self._marks.get(book_id, (0, 0))
+            self._marks[book_id] = (marks_sum + rating, marks_count + 1)
+            if self._thread is None:
+                self._start(current_app._get_current_object())
+            return self._marks[book_id]
+
+    def pending(self, book_id):
+        """Сумма и количество оценок книги, еще не записанных в базу."""
+        with self._lock:
+            return self._marks.get(book_id, (0, 0))
+
+    def flush(self):
+        """Записать накопленные оценки в базу."""
+        with self._lock:
+            marks, self._marks = self._marks, {}
+        if not marks:
+            return
+
+        try:
+            for book_id, (marks_sum, marks_count) in marks.items():
+                Book.add_marks(book_id, marks_sum, marks_count)
+            # Рейтинг книги входит в ответы ее авторов
+            authors_id = Book.get_authors_id(list(marks))
+            Author.touch(authors_id)
+            author_stats.apply_marks(marks)
+            db.session.commit()
+            invalidate(books_id=marks, authors_id=authors_id)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Failed to flush %d book ratings', len(marks))
+            # Вернуть оценки в буфер, чтобы записать их при следующей попытке
+            with self._lock:
+                for book_id, (marks_sum, marks_count) in marks.items():
+                    old_sum, old_count = self._marks.get(book_id, (0, 0))
+                    self._marks[book_id] = (old_sum + marks_sum, old_count + marks_count)
+
+    def _start(self, app):
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name='rating-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self._flush_in_context)
+
+    def _flush_in_context(self):
+        with self._app.app_context():
+            self.flush()
+            db.session.remove()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._flush_in_context()
+
+
+rating_buffer = RatingBuffer(RATING_BUFFER_MS)
+
+
+def add_mark(book, rating):
+    """Добавить оценку книге, вернуть текущие рейтинг и количество оценок.
+
+    При RATING_BUFFER_MS > 0 оценка только кладется в буфер и возвращается
+    None: рейтинг, посчитанный по загруженной до этого книге, мог бы не
+    учесть оценки, записанные буфером в это время.
+    """
+    if RATING_BUFFER_MS > 0:
+        rating_buffer.add(book.book_id, rating)
+        return None
+
+    Book.add_marks(book.book_id, rating, 1)
+    authors_id = Book.get_authors_id([book.book_id])
+    Author.touch(authors_id)
+    author_stats.apply_marks({book.book_id: (rating, 1)})
+    rating, count_marks = db.session.query(Book.rating, Book.count_marks) \
+        .filter(Book.book_id == book.book_id) \
+        .one()
+    db.session.commit()
+    invalidate(books_id=[book.book_id], authors_id=authors_id)
+    return rating, count_marks
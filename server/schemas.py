@@ -1,9 +1,12 @@
+import json
+
 from marshmallow import fields, Schema, post_load, validate
 
+from instrumentation import TimedSchema
 from models import Author, Book
 
 
-class BookSchema(Schema):
+class BookSchema(TimedSchema):
     """Основаня схема книги"""
     book_id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
@@ -12,7 +15,7 @@ class BookSchema(Schema):
     count_marks = fields.Int()
 
 
-class AuthorSchema(Schema):
+class AuthorSchema(TimedSchema):
     """Основаня схема автора"""
     author_id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
@@ -25,6 +28,8 @@ class BookSchemaExt(BookSchema):
 
     @post_load
     def make_author(self, data, **kwargs):
+        # Сумма оценок для начальных rating и count_marks, как при загрузке из NDJSON
+        data['rating_sum'] = round(data.get('rating', .0) * data.get('count_marks', 0))
         return Book(**data)
 
 
@@ -93,3 +98,21 @@ class BookRatingSchema(Schema):
     def make_author(self, data, **kwargs):
         b = Book.get_one_item(data['book_id'])
         return b, data['rating']
+
+
+class JobSchema(Schema):
+    """Схема фоновой задачи."""
+    job_id = fields.Int()
+    kind = fields.Str()
+    status = fields.Str()
+    attempts = fields.Int()
+    max_attempts = fields.Int()
+    result = fields.Method('get_result')
+    error = fields.Str()
+    run_at = fields.DateTime()
+    created_at = fields.DateTime()
+    started_at = fields.DateTime()
+    finished_at = fields.DateTime()
+
+    def get_result(self, obj):
+        return json.loads(obj.result) if obj.result is not None else None
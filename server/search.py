@@ -0,0 +1,179 @@
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql.expression import ColumnElement
+
+from app import db
+from models import Book
+from pagination import CursorError, decode_cursor, encode_cursor
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Курсор поиска хранит релевантность, умноженную на SCORE_SCALE и округленную
+# до целого: целые точно сравниваются после JSON, а дробная релевантность,
+# пересчитанная базой, может не совпасть с значением из курсора
+SCORE_SCALE = 10 ** 6
+
+
+class Match(ColumnElement):
+    """Релевантность MATCH ... AGAINST по MySQL FULLTEXT индексу."""
+
+    type = db.Float()
+
+    def __init__(self, columns, against):
+        self.columns = columns
+        self.against = db.literal(against)
+
+
+@compiles(Match)
+def compile_match(element, compiler, **kw):
+    columns = ', '.join(compiler.process(x, **kw) for x in element.columns)
+    return f'MATCH ({columns}) AGAINST ({compiler.process(element.against, **kw)} IN BOOLEAN MODE)'
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex(object):
+    """Инвертированный индекс книг в памяти процесса.
+
+    Используется вместо FULLTEXT индекса, когда база не MySQL (SQLite в
+    тестах). Строится из базы при первом поиске и дополняется при создании
+    книг в этом процессе. Слова из названия весят вдвое больше слов описания.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._tokens = []
+        self._books_count = 0
+        self._built = False
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._postings = {}
+            self._tokens = []
+            self._books_count = 0
+            self._built = False
+
+    def add(self, books):
+        """Добавить книги, если индекс уже построен."""
+        with self._lock:
+            if self._built:
+                self._add(books)
+
+    def _add(self, books):
+        for book_id, name, description in books:
+            weights = Counter(tokenize(description))
+            for token in tokenize(name):
+                weights[token] += 2
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    self._postings[token] = {}
+                self._postings[token][book_id] = weight
+            self._books_count += 1
+        self._tokens = sorted(self._postings)
+
+    def _build(self):
+        rows = db.session.query(Book.book_id, Book.name, Book.description).yield_per(1000)
+        self._add(rows)
+        self._built = True
+
+    def search(self, terms):
+        """Книги, содержащие слова с каждым из префиксов terms, и их релевантность."""
+        with self._lock:
+            if not self._built:
+                self._build()
+
+            scores = None
+            for term in terms:
+                term_scores = {}
+                i = bisect_left(self._tokens, term)
+                while i < len(self._tokens) and self._tokens[i].startswith(term):
+                    postings = self._postings[self._tokens[i]]
+                    idf = math.log(1 + self._books_count / len(postings))
+                    for book_id, weight in postings.items():
+                        term_scores[book_id] = max(term_scores.get(book_id, 0), weight * idf)
+                    i += 1
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {x: scores[x] + term_scores[x] for x in scores if x in term_scores}
+            return scores or {}
+
+
+search_index = InvertedIndex()
+
+
+def search_books(q, limit, after=None):
+    """Поиск книг по названию и описанию с префиксным совпадением слов.
+
+    Возвращает пары (Book, релевантность) по убыванию релевантности и блок
+    курсорной пагинации. Книги упорядочены по релевантности, округленной
+    до SCORE_SCALE, и ID, курсор хранит эти значения последней книги.
+    """
+    terms = tokenize(q)
+    cursor = None
+    if after is not None:
+        cursor = decode_cursor(after)
+        if not isinstance(cursor.get('score'), int):
+            raise CursorError(f'Invalid cursor: {after}')
+
+    if db.engine.dialect.name == 'mysql':
+        items = _search_fulltext(terms, limit, cursor)
+    else:
+        items = _search_index(terms, limit, cursor)
+
+    has_next = len(items) > limit
+    items = items[:limit]
+    next_cursor = None
+    if has_next:
+        book, _, key = items[-1]
+        next_cursor = encode_cursor({'id': book.book_id, 'score': key})
+    return [(book, score) for book, score, _ in items], {'has_next': has_next, 'next_cursor': next_cursor}
+
+
+def _search_fulltext(terms, limit, cursor):
+    if not terms:
+        return []
+    # Все слова обязательны и ищутся по префиксу
+    score = Match([Book.name, Book.description], ' '.join(f'+{x}*' for x in terms))
+    key = db.func.round(score * SCORE_SCALE)
+    query = db.session.query(Book, score.label('score'), key.label('score_key')) \
+        .options(selectinload(Book.authors)) \
+        .filter(score > 0)
+    if cursor is not None:
+        query = query.filter(db.or_(
+            key < cursor['score'],
+            db.and_(key == cursor['score'], Book.book_id > cursor['id'])
+        ))
+    query = query.order_by(key.desc(), Book.book_id).limit(limit + 1)
+    return [(book, book_score, int(book_key)) for book, book_score, book_key in query]
+
+
+def _search_index(terms, limit, cursor):
+    if not terms:
+        return []
+    ranked = sorted(
+        ((book_id, score, round(score * SCORE_SCALE)) for book_id, score in search_index.search(terms).items()),
+        key=lambda x: (-x[2], x[0])
+    )
+    if cursor is not None:
+        ranked = [
+            (book_id, score, key) for book_id, score, key in ranked
+            if key < cursor['score'] or (key == cursor['score'] and book_id > cursor['id'])
+        ]
+    ranked = ranked[:limit + 1]
+
+    found = {
+        b.book_id: b
+        for b in Book.query.options(selectinload(Book.authors)).filter(Book.book_id.in_([x for x, _, _ in ranked]))
+    }
+    return [(found[book_id], score, key) for book_id, score, key in ranked if book_id in found]
@@ -0,0 +1,100 @@
+from flask import current_app
+from marshmallow import fields
+
+from instrumentation import timed_serialization
+
+
+# Преобразование значения поля так же, как его делает marshmallow при dump
+FIELD_CONVERTERS = {
+    fields.Integer: 'int',
+    fields.Float: 'float',
+    fields.String: 'str',
+}
+
+
+class UnsupportedSchema(Exception):
+    """Схему нельзя скомпилировать, она сериализуется через marshmallow."""
+
+
+_dumpers = {}
+
+
+def schema_key(schema):
+    return (
+        type(schema),
+        None if schema.only is None else frozenset(schema.only),
+        frozenset(schema.exclude),
+    )
+
+
+def compile_dumper(schema):
+    """Собрать функцию сериализации одного объекта схемой schema.
+
+    Для каждого поля генерируется прямое чтение атрибута и преобразование
+    типа, вложенные схемы компилируются так же. Поддерживаются поля Int,
+    Float, Str и Nested без pre_dump/post_dump обработчиков - для остальных
+    схем выбрасывается UnsupportedSchema.
+    """
+    if schema._has_processors('pre_dump') or schema._has_processors('post_dump'):
+        raise UnsupportedSchema(f'{type(schema).__name__} has dump processors')
+
+    namespace = {}
+    lines = ['def dump(obj):', '    data = {}']
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        if not attribute.isidentifier():
+            raise UnsupportedSchema(f'Field {name} has dotted attribute')
+        key = field.data_key or name
+
+        lines.append(f'    value = obj.{attribute}')
+        if isinstance(field, fields.Nested):
+            nested_dumper = get_dumper(field.schema)
+            if nested_dumper is None:
+                raise UnsupportedSchema(f'Field {name} has unsupported nested schema')
+            namespace[f'dump_{name}'] = nested_dumper
+            if field.many:
+                converted = f'[dump_{name}(x) for x in value]'
+            else:
+                converted = f'dump_{name}(value)'
+        elif type(field) in FIELD_CONVERTERS:
+            converted = f'{FIELD_CONVERTERS[type(field)]}(value)'
+        else:
+            raise UnsupportedSchema(f'Field {name} of type {type(field).__name__}')
+        lines.append(f'    data[{key!r}] = None if value is None else {converted}')
+    lines.append('    return data')
+
+    exec('\n'.join(lines), namespace)
+    return namespace['dump']
+
+
+def get_dumper(schema):
+    """Скомпилированная функция сериализации схемы или None, если схему нельзя скомпилировать."""
+    key = schema_key(schema)
+    if key not in _dumpers:
+        try:
+            _dumpers[key] = compile_dumper(schema)
+        except UnsupportedSchema:
+            _dumpers[key] = None
+    return _dumpers[key]
+
+
+def dump(schema, obj, many=None, serializer=None):
+    """Сериализовать obj схемой schema.
+
+    При SERIALIZER=compiled используется скомпилированная функция схемы,
+    результат совпадает с schema.dump(). Схемы, которые нельзя
+    скомпилировать, и SERIALIZER=marshmallow используют schema.dump().
+    serializer передается вместо SERIALIZER текущего приложения вне
+    контекста Flask, например в асинхронном сервере.
+    """
+    many = schema.many if many is None else many
+    serializer = current_app.config['SERIALIZER'] if serializer is None else serializer
+    dumper = get_dumper(schema) if serializer == 'compiled' else None
+    if dumper is None:
+        return schema.dump(obj, many=many)
+
+    with timed_serialization():
+        if many:
+            return [dumper(x) for x in obj]
+        return dumper(obj)
+
@@ -0,0 +1,143 @@
+import json
+
+from flask import abort, current_app, stream_with_context
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from pagination import keyset_page, keyset_query, page_pagination
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def stream_mode(args, accept):
+    """Режим потоковой выдачи списка: ndjson, json или None для обычного ответа.
+
+    NDJSON выбирается заголовком Accept: application/x-ndjson, потоковый
+    JSON - параметром stream=1.
+    """
+    accept = parse_accept_header(accept, MIMEAccept)
+    if accept.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        return 'ndjson'
+    if args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+
+def encode(data):
+    """JSON как у jsonify: ключи по алфавиту, без пробелов."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+class ListEncoder(object):
+    """Тело ответа со списком записей по частям.
+
+    В режиме json тело совпадает с jsonify({key: [...], 'pagination': {...}}):
+    ключ списка меньше 'pagination', поэтому пагинация идет последней и
+    считается после выдачи всех записей. В режиме ndjson каждая запись
+    идет отдельной строкой, последняя строка - {"pagination": {...}}.
+    """
+
+    def __init__(self, mode, key):
+        self.mode = mode
+        self.key = key
+        self.mimetype = NDJSON_MIMETYPE if mode == 'ndjson' else 'application/json'
+        self._separator = ''
+
+    def head(self):
+        return '' if self.mode == 'ndjson' else '{' + encode(self.key) + ':['
+
+    def items(self, items):
+        if not items:
+            return ''
+        if self.mode == 'ndjson':
+            return ''.join(encode(x) + '\n' for x in items)
+        chunk = self._separator + ','.join(encode(x) for x in items)
+        self._separator = ','
+        return chunk
+
+    def tail(self, pagination):
+        if self.mode == 'ndjson':
+            return encode({'pagination': pagination}) + '\n'
+        return '],"pagination":' + encode(pagination) + '}\n'
+
+
+def stream_response(mode, key, chunks, pagination):
+    """Потоковый ответ из итератора порций сериализованных записей.
+
+    pagination - функция, которая вызывается после выдачи всех записей.
+    Заголовков ETag и Last-Modified у потокового ответа нет.
+    """
+    encoder = ListEncoder(mode, key)
+
+    def generate():
+        yield encoder.head()
+        for chunk in chunks:
+            yield encoder.items(chunk)
+        yield encoder.tail(pagination())
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=encoder.mimetype)
+
+
+def offset_chunks(query, id_column, page, per_page, chunk_size):
+    """Записи страницы page порциями по chunk_size, каждая порция - отдельный запрос."""
+    start = (page - 1) * per_page
+    end = start + per_page
+    query = query.order_by(id_column)
+    for offset in range(start, end, chunk_size):
+        size = min(chunk_size, end - offset)
+        items = query.limit(size).offset(offset).all()
+        yield items
+        if len(items) < size:
+            return
+
+
+class KeysetChunks(object):
+    """Страница курсорной пагинации порциями по chunk_size записей.
+
+    Каждая порция выбирается keyset_page с курсором последней записи
+    предыдущей порции. После обхода pagination содержит тот же блок, что
+    keyset_page вернул бы для всей страницы. Некорректный курсор
+    выбрасывает CursorError сразу, до начала ответа.
+    """
+
+    def __init__(self, query, id_column, limit, chunk_size, after=None, rating_column=None):
+        keyset_query(query, id_column, limit, after, rating_column)
+        self.query = query
+        self.id_column = id_column
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.after = after
+        self.rating_column = rating_column
+        self.pagination = None
+
+    def __iter__(self):
+        remaining, after = self.limit, self.after
+        while True:
+            items, self.pagination = keyset_page(
+                self.query, self.id_column, min(self.chunk_size, remaining), after, self.rating_column
+            )
+            yield items
+            remaining -= len(items)
+            if remaining <= 0 or not self.pagination['has_next']:
+                return
+            after = self.pagination['next_cursor']
+
+
+def stream_page(mode, key, query, id_column, page, per_page, dump_chunk):
+    """Потоковый ответ со страницей page, как при Query.paginate.
+
+    dump_chunk сериализует порцию записей в список словарей.
+    """
+    total = query.order_by(None).count()
+    if page > 1 and (page - 1) * per_page >= total:
+        abort(404)
+    pagination = page_pagination(page, per_page, total)
+    chunks = offset_chunks(query, id_column, page, per_page, current_app.config['STREAM_CHUNK_SIZE'])
+    return stream_response(mode, key, (dump_chunk(x) for x in chunks), lambda: pagination)
+
+
+def stream_keyset(mode, key, query, id_column, limit, dump_chunk, after=None, rating_column=None):
+    """Потоковый ответ со страницей курсорной пагинации, как при keyset_page."""
+    chunks = KeysetChunks(query, id_column, limit, current_app.config['STREAM_CHUNK_SIZE'], after, rating_column)
+    return stream_response(mode, key, (dump_chunk(x) for x in chunks), lambda: chunks.pagination)
@@ -1,12 +1,19 @@
 import sys
 sys.path.append("..")
 
+import json
 import unittest
 
+import author_stats
 from app import app, db
 from authors.blueprint import authors
 from books.blueprint import books
-from models import Author, Book
+from cache import cache
+from config import AUTHOR_STATS_TOP
+import job_queue
+import ratelimit
+from models import Author, AuthorStats, Book, Job
+from search import search_index
 
 
 class TestCase(unittest.TestCase):
@@ -18,6 +25,9 @@ class TestCase(unittest.TestCase):
         app.register_blueprint(books)
         self.app = app.test_client()
 
+        cache.clear()
+        ratelimit.store.clear()
+        search_index.reset()
         db.create_all()
         self.fill_db()
 
@@ -25,6 +35,23 @@ class TestCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
 
+    def count_queries(self, func, prefix=''):
+        """Количество SQL-запросов, начинающихся с prefix, выполненных за время вызова func."""
+        from sqlalchemy import event
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if statement.startswith(prefix):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements)
+
     def fill_db(self):
         for i in range(10):
             db.session.add(Author(**{'name': 'Default', 'sername': 'Author'}))
@@ -48,6 +75,92 @@ class TestCase(unittest.TestCase):
         rv = self.app.get('/ping', follow_redirects=True)
         assert rv.status == '200 OK'
 
+    def test_health(self):
+        """Тест состояния базы и пула соединений."""
+        rv = self.app.get('/health')
+        json_resp = rv.get_json()
+        assert rv.status == '200 OK'
+        assert json_resp['status'] == 'ok'
+        assert json_resp['db']['latency_ms'] >= 0
+        assert 'wait' in json_resp['pool']
+
+    def test_pool_wait_stats(self):
+        """Тест учета ожидания соединений из пула."""
+        from sqlalchemy import create_engine
+        from database import TimedQueuePool, pool_status, pool_wait
+
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=1, max_overflow=0)
+        count = pool_wait.count
+        with engine.connect():
+            status = pool_status(engine.pool)
+            assert status['checked_out'] == 1
+        assert pool_wait.count == count + 1
+        engine.dispose()
+
+    def test_instrumentation(self):
+        """Тест заголовка Server-Timing, метрик и лога медленных запросов."""
+        rv = self.app.get('/books?page=1')
+        assert 'Server-Timing' not in rv.headers
+        assert self.app.get('/metrics').status_code == 404
+
+        app.config['INSTRUMENTATION'] = True
+        app.config['SLOW_QUERY_MS'] = 0.000001
+        try:
+            with self.assertLogs('instrumentation', 'WARNING'):
+                rv = self.app.get('/books?page=1')
+            timing = rv.headers['Server-Timing']
+            assert 'queries"' in timing
+            assert 'ser;dur=' in timing
+            assert f'size;desc="{len(rv.get_data())} bytes"' in timing
+
+            rv = self.app.get('/metrics')
+            text = rv.get_data(as_text=True)
+            assert rv.status == '200 OK'
+            assert 'app_requests_total{endpoint="books.books_get",method="GET",status="200"}' in text
+            assert 'app_request_duration_seconds_bucket{endpoint="books.books_get",le="+Inf"}' in text
+            assert 'app_db_pool_wait_total' in text
+        finally:
+            app.config['INSTRUMENTATION'] = False
+            app.config['SLOW_QUERY_MS'] = 100
+
+    def test_compiled_serializer(self):
+        """Тест совпадения ответов скомпилированного сериализатора и marshmallow."""
+        import serializers
+        from schemas import AuthorSchemaExt
+        from serializers import get_dumper
+
+        db.session.commit()
+        paths = ('/books?id=1', '/books?page=1', '/books?limit=5', '/books/search?q=def',
+                 '/authors?id=2', '/authors?page=1', '/authors?limit=5&top_books=3')
+        bodies = {}
+        calls = {}
+        dumped = []
+        compile_dumper = serializers.compile_dumper
+
+        def counted_dumper(schema):
+            dumper = compile_dumper(schema)
+            return lambda obj: dumped.append(obj) or dumper(obj)
+
+        serializers._dumpers.clear()
+        serializers.compile_dumper = counted_dumper
+        try:
+            for serializer in ('marshmallow', 'compiled'):
+                app.config['SERIALIZER'] = serializer
+                cache.clear()
+                bodies[serializer] = [self.app.get(x).get_data() for x in paths]
+                calls[serializer] = len(dumped)
+                dumped.clear()
+        finally:
+            app.config['SERIALIZER'] = 'compiled'
+            serializers.compile_dumper = compile_dumper
+            serializers._dumpers.clear()
+        assert bodies['marshmallow'] == bodies['compiled']
+        # Скомпилированные функции используются только при SERIALIZER=compiled
+        assert calls['marshmallow'] == 0 and calls['compiled'] > 0
+
+        a = Author(author_id=1, name='Имя', sername=None)
+        assert get_dumper(AuthorSchemaExt())(a) == AuthorSchemaExt().dump(a)
+
     def test_create_author(self):
         """Тест создания автора книг."""
 
@@ -101,6 +214,108 @@ class TestCase(unittest.TestCase):
         a2 = Author.get_one_item(2)
         assert a2 in b.authors
 
+    def test_create_book_without_authors(self):
+        """Тест: книга без найденных авторов не создается."""
+        db.session.commit()
+        data = {'book': {'name': 'Kolobok', 'description': 'The story about bread.'}, 'author_id': [42]}
+        json_resp = self.app.post('/books', json=data).get_json()
+        assert not json_resp['success']
+        assert len(Book.query.all()) == 10
+
+    def test_bulk_create_authors(self):
+        """Тест пакетного создания авторов."""
+        data = [
+            {'name': 'Lev', 'sername': 'Tolstoy'},
+            {'name': 1},
+            {'name': 'Anton', 'sername': 'Chekhov'},
+        ]
+        responses = []
+        inserts = self.count_queries(lambda: responses.append(self.app.post('/authors/bulk', json=data)), 'INSERT INTO author ')
+        rv = responses[0]
+        json_resp = rv.get_json()
+        # Авторы вставляются одним executemany
+        assert inserts == 1
+        assert json_resp['success']
+        assert rv.status == '200 OK'
+        assert [x['index'] for x in json_resp['created']] == [0, 2]
+        assert list(json_resp['errors']) == ['1']
+
+        a = Author.get_one_item(json_resp['created'][1]['author_id'])
+        assert a.sername == 'Chekhov'
+        assert len(Author.query.all()) == 12
+
+    def test_bulk_create_books(self):
+        """Тест пакетного создания книг."""
+        data = [
+            {'book': {'name': 'Kolobok', 'description': 'The story about bread.'}, 'author_id': [1, 2]},
+            {'book': {'name': 'Repka'}, 'author_id': [1]},
+            {'book': {'name': 'Teremok', 'description': 'The story about house.'}, 'author_id': [33]},
+            {'book': {'name': 'Ryaba', 'description': 'The story about hen.'}, 'author_id': [3, 44]},
+            'Bad item',
+        ]
+        responses = []
+        inserts = self.count_queries(lambda: responses.append(self.app.post('/books/bulk', json=data)), 'INSERT INTO book ')
+        rv = responses[0]
+        json_resp = rv.get_json()
+        # Книги вставляются одним executemany
+        assert inserts == 1
+        assert json_resp['success']
+        assert rv.status == '200 OK'
+        assert [(x['index'], x['author_id']) for x in json_resp['created']] == [(0, [1, 2]), (3, [3])]
+        assert sorted(json_resp['errors']) == ['1', '2', '4']
+
+        b = Book.get_one_item(json_resp['created'][0]['book_id'])
+        assert b.name == 'Kolobok'
+        assert b.count_marks == 0
+        assert sorted(a.author_id for a in b.authors) == [1, 2]
+        assert len(Book.query.all()) == 12
+
+        rv = self.app.post('/books/bulk', json={'book': {}})
+        assert not rv.get_json()['success']
+
+    def test_create_book_with_marks(self):
+        """Тест создания книг с начальными оценками."""
+        db.session.commit()
+        rv = self.app.post('/books', json={'book': {'name': 'Kolobok', 'description': 'Bread.', 'rating': 4.0, 'count_marks': 2}, 'author_id': [1]})
+        assert rv.get_json()['success']
+        book_id = Book.query.filter_by(name='Kolobok').one().book_id
+        rv = self.app.patch('/books', json={'book_id': book_id, 'rating': 4})
+        assert rv.get_json()['rating'] == 4
+        assert rv.get_json()['votes'] == 3
+
+        data = [{'book': {'name': 'Repka', 'description': 'Turnip.', 'rating': 5.0, 'count_marks': 100}, 'author_id': [1]}]
+        book_id = self.app.post('/books/bulk', json=data).get_json()['created'][0]['book_id']
+        db.session.remove()
+        assert round(Book.get_one_item(book_id).weighted_rating, 2) == 4.82
+        assert self.app.get('/books/top?limit=1').get_json()['books'][0]['book_id'] == book_id
+
+    def test_export_import_ndjson(self):
+        """Тест выгрузки и загрузки авторов и книг в NDJSON."""
+        import io
+        from transfer import export_ndjson, import_ndjson
+
+        db.session.commit()
+        self.app.patch('/books', json={"book_id": 3, "rating": 4})
+        before = self.app.get('/books?id=3').get_json()
+
+        stream = io.StringIO()
+        export_ndjson(stream, 3)
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 20
+        assert json.loads(lines[0]) == {'author': {'author_id': 1, 'name': 'Default', 'sername': 'Author'}}
+        assert json.loads(lines[12])['book'] == before
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        stream.seek(0)
+        import_ndjson(stream, 3)
+
+        assert len(Author.query.all()) == 10
+        assert len(Book.query.all()) == 10
+        assert self.app.get('/books?id=3').get_json() == before
+        assert Book.get_one_item(3).rating_sum == 4
+
     def test_negative_book_create(self):
         """Негативный тест создания книги."""
         assert len(Book.query.all()) == 10
@@ -132,6 +347,30 @@ class TestCase(unittest.TestCase):
         a = Author.get_one_item(3)
         assert len(a.books) == 1
 
+    def test_link_books_idempotent(self):
+        """Тест повторного связывания книг и авторов."""
+        from models import books as books_table
+
+        data = {"author_id": 3, "book_id": [1, 1, 2, 99]}
+        json_resp = self.app.put('/authors', json=data).get_json()
+        assert json_resp['success']
+        assert json_resp['linked'] == [1, 2]
+        assert json_resp['already_linked'] == []
+        assert json_resp['missing'] == [99]
+
+        json_resp = self.app.put('/authors', json=data).get_json()
+        assert json_resp['linked'] == []
+        assert json_resp['already_linked'] == [1, 2]
+
+        json_resp = self.app.put('/books', json={"book_id": 2, "author_id": [3, 4, 55]}).get_json()
+        assert json_resp['success']
+        assert json_resp['linked'] == [4]
+        assert json_resp['already_linked'] == [3]
+        assert json_resp['missing'] == [55]
+
+        rows = db.session.query(books_table).filter(books_table.c.book_id == 2).all()
+        assert sorted(x.author_id for x in rows) == [2, 3, 4]
+
     def test_delete_book_from_author(self):
         """Тест на разрыв связи книги и автора."""
 
@@ -256,6 +495,66 @@ class TestCase(unittest.TestCase):
         assert b.rating == 3.5
         assert b.count_marks == 4
 
+    def test_buffered_book_rating(self):
+        """Тест на накопление оценок книги в буфере."""
+        from ratings import RatingBuffer
+
+        buffer = RatingBuffer(60 * 1000)
+        with app.app_context():
+            assert buffer.add(1, 5) == (5, 1)
+            assert buffer.add(1, 2) == (7, 2)
+            assert buffer.add(2, 4) == (4, 1)
+            buffer.flush()
+        assert buffer.pending(1) == (0, 0)
+
+        b = Book.get_one_item(1)
+        assert b.rating == 3.5
+        assert b.count_marks == 2
+        assert b.rating_sum == 7
+        b = Book.get_one_item(2)
+        assert b.rating == 4
+        assert b.count_marks == 1
+
+    def test_buffered_book_rating_response(self):
+        """Тест ответа на оценку книги при буферизации оценок."""
+        import ratings
+
+        db.session.commit()
+        buffer, ratings.rating_buffer = ratings.rating_buffer, ratings.RatingBuffer(60 * 1000)
+        ratings.RATING_BUFFER_MS = 60 * 1000
+        try:
+            rv = self.app.patch('/books', json={'book_id': 1, 'rating': 4})
+            assert rv.status_code == 202
+            assert rv.get_json() == {'success': True, 'message': 'Mark for book 1 accepted.'}
+            assert ratings.rating_buffer.pending(1) == (4, 1)
+            with app.app_context():
+                ratings.rating_buffer.flush()
+        finally:
+            ratings.RATING_BUFFER_MS = 0
+            ratings.rating_buffer = buffer
+        db.session.expire_all()
+        assert (Book.get_one_item(1).rating, Book.get_one_item(1).count_marks) == (4, 1)
+
+    def test_top_books(self):
+        """Тест рейтинга лучших книг по байесовской оценке."""
+        db.session.commit()
+        marks = {3: [5], 4: [5, 5, 5, 5], 5: [1]}
+        for book_id, ratings in marks.items():
+            for rating in ratings:
+                self.app.patch('/books', json={'book_id': book_id, 'rating': rating})
+
+        rv = self.app.get('/books/top?limit=2')
+        json_resp = rv.get_json()
+        assert rv.status == '200 OK'
+        assert [x['book_id'] for x in json_resp['books']] == [4, 3]
+        assert json_resp['books'][0]['weighted_rating'] == round((20 + 10 * 3.0) / (4 + 10), 4)
+
+        rv = self.app.get('/books/top?limit=10&min_votes=1')
+        assert [x['book_id'] for x in rv.get_json()['books']] == [4, 3, 5]
+
+        # Авторы всех книг загружаются одним запросом
+        assert self.count_queries(lambda: self.app.get('/books/top?limit=10')) == 2
+
     def test_change_book_rating_negative(self):
         """Тест на изменение рейтинга книги."""
 
@@ -300,6 +599,395 @@ class TestCase(unittest.TestCase):
         assert json_resp['authors'] == GET_LIST_AUTHORS
         assert rv.status == '200 OK'
 
+    def test_get_many_by_ids(self):
+        """Тест получения нескольких книг и авторов по списку ID."""
+        db.session.commit()
+        rv = self.app.get('/books?ids=3,42,1,3')
+        json_resp = rv.get_json()
+        assert rv.status == '200 OK'
+        assert [x['book_id'] for x in json_resp['books']] == [3, 1]
+        assert [x['author_id'] for x in json_resp['books'][1]['authors']] == [1, 2]
+        assert json_resp['missing'] == [42]
+
+        rv = self.app.get('/authors?ids=2,1')
+        json_resp = rv.get_json()
+        assert [x['author_id'] for x in json_resp['authors']] == [2, 1]
+        assert sorted(x['book_id'] for x in json_resp['authors'][0]['books']) == list(range(1, 11))
+        assert json_resp['missing'] == []
+
+        assert not self.app.get('/books?ids=1,a').get_json()['success']
+        ids = ','.join(str(x) for x in range(1, 102))
+        assert not self.app.get(f'/authors?ids={ids}').get_json()['success']
+
+    def test_sparse_fieldsets(self):
+        """Тест выбора полей и вложенных связей в списках книг и авторов."""
+        from fieldsets import BOOK_KEYS, query_options
+
+        db.session.commit()
+        rv = self.app.get('/books?limit=2&fields=book_id,name')
+        assert rv.get_json()['books'] == [{'book_id': 1, 'name': 'Default'}, {'book_id': 2, 'name': 'Default'}]
+
+        rv = self.app.get('/books?ids=1&fields=name&include=authors')
+        book = rv.get_json()['books'][0]
+        assert sorted(book) == ['authors', 'name']
+        assert len(book['authors']) == 2
+
+        rv = self.app.get('/authors?page=1&fields=name')
+        assert rv.get_json()['authors'][0] == {'name': 'Default'}
+        rv = self.app.get('/authors?limit=1&include=books&top_books=1')
+        author = rv.get_json()['authors'][0]
+        assert sorted(author) == ['author_id', 'books', 'name', 'sername']
+        # Сводка по книгам вкладывается только по include=stats
+        for path in ('/authors?limit=1', '/authors?page=1&pagin=1', '/authors?ids=1'):
+            assert sorted(self.app.get(path).get_json()['authors'][0]) == ['author_id', 'books', 'name', 'sername']
+        rv = self.app.get('/authors?limit=1&include=books,stats&top_books=1')
+        author = rv.get_json()['authors'][0]
+        assert sorted(author) == ['author_id', 'avg_rating', 'books', 'books_count', 'name', 'sername']
+        assert len(author['books']) == 1
+        rv = self.app.get('/authors?limit=1&fields=name&include=stats')
+        assert sorted(rv.get_json()['authors'][0]) == ['avg_rating', 'books_count', 'name']
+        rv = self.app.get('/authors?ids=1&fields=name&include=stats')
+        assert sorted(rv.get_json()['authors'][0]) == ['avg_rating', 'books_count', 'name']
+
+        assert not self.app.get('/books?fields=isbn').get_json()['success']
+        assert not self.app.get('/authors?include=reviews').get_json()['success']
+
+        # Описание книги не выбирается из базы, если его нет в fields
+        query = Book.query.options(*query_options(Book, ('name',), set(), BOOK_KEYS))
+        assert 'book.description' not in str(query)
+
+    def test_streaming_lists(self):
+        """Тест потоковой выдачи списков книг и авторов порциями."""
+        db.session.commit()
+        paths = ('/books?page=2', '/books?limit=5&order=rating', '/books?limit=5&fields=name&include=authors',
+                 '/authors?page=1&top_books=2', '/authors?limit=4')
+        app.config['STREAM_CHUNK_SIZE'] = 2
+        try:
+            for path in paths:
+                expected = self.app.get(path).get_json()
+                rv = self.app.get(path + '&stream=1')
+                assert rv.get_json() == expected
+                assert 'ETag' not in rv.headers
+
+                rv = self.app.get(path, headers={'Accept': 'application/x-ndjson'})
+                assert rv.mimetype == 'application/x-ndjson'
+                lines = [json.loads(x) for x in rv.get_data(as_text=True).splitlines()]
+                key = path.split('?')[0].strip('/')
+                assert lines[:-1] == expected[key]
+                assert lines[-1] == {'pagination': expected['pagination']}
+        finally:
+            app.config['STREAM_CHUNK_SIZE'] = 500
+
+        assert not self.app.get('/books?limit=2&after=bad&stream=1').get_json()['success']
+        assert self.app.get('/books?page=9&stream=1').status_code == 404
+
+    def test_author_stats(self):
+        """Тест сводки по книгам авторов в списке авторов."""
+        db.session.commit()
+        rv = self.app.post('/authors/stats/rebuild')
+        assert rv.get_json()['success']
+        assert job_queue.run_pending() == 1
+        assert AuthorStats.query.count() == Author.query.count()
+        rv = self.app.get(f'/jobs?id={rv.get_json()["job_id"]}')
+        assert rv.get_json()['status'] == 'done'
+        assert rv.get_json()['result'] == Author.query.count()
+
+        rv = self.app.patch('/books', json={'book_id': 1, 'rating': 4})
+        assert rv.get_json()['success']
+
+        rv = self.app.get('/authors?limit=10&top_books=1&include=books,stats')
+        listing = {x['author_id']: x for x in rv.get_json()['authors']}
+        for a in Book.get_one_item(1).authors:
+            rated = [x.rating for x in a.books if x.count_marks]
+            assert listing[a.author_id]['books_count'] == len(a.books)
+            assert listing[a.author_id]['avg_rating'] == round(sum(rated) / len(rated), 2)
+            assert listing[a.author_id]['books'][0]['book_id'] == 1
+
+        # Оценки обновляют сводку без пересчета, кроме выпадения книги из короткого списка лучших
+        author_stats.AUTHOR_STATS_TOP = 2
+        try:
+            author_stats.rebuild()
+            db.session.commit()
+            for book_id, rating in [(2, 5), (3, 1), (1, 1), (1, 1), (4, 5), (2, 1), (5, 3)]:
+                assert self.app.patch('/books', json={'book_id': book_id, 'rating': rating}).get_json()['success']
+            authors_id = [x.author_id for x in Author.query]
+            stored = author_stats.stored_stats(AuthorStats.query, 2)
+            computed = author_stats.compute(authors_id, 2)
+            for author_id in authors_id:
+                assert stored[author_id]['books_count'] == computed[author_id]['books_count']
+                assert stored[author_id]['avg_rating'] == computed[author_id]['avg_rating']
+                assert stored[author_id]['top_books'] == computed[author_id]['top_books']
+        finally:
+            author_stats.AUTHOR_STATS_TOP = AUTHOR_STATS_TOP
+
+    def test_job_queue(self):
+        """Тест очереди фоновых задач: повторы, ошибки и ограничение по типу."""
+        from datetime import datetime, timedelta
+
+        calls = []
+
+        @job_queue.task('test.flaky')
+        def flaky(fail):
+            calls.append(fail)
+            if len(calls) <= fail:
+                raise RuntimeError('Flaky')
+            return {'calls': len(calls)}
+
+        job_id = job_queue.enqueue('test.flaky', {'fail': 1}, max_attempts=2).job_id
+        failed_id = job_queue.enqueue('test.flaky', {'fail': 5}, max_attempts=1).job_id
+        unknown_id = job_queue.enqueue('test.unknown').job_id
+        db.session.commit()
+
+        assert job_queue.run_pending() == 3
+        job = Job.query.get(job_id)
+        assert (job.status, job.attempts, job.error) == ('queued', 1, 'RuntimeError: Flaky')
+        assert job.run_at > datetime.utcnow()
+        assert Job.query.get(failed_id).status == 'failed'
+        assert Job.query.get(unknown_id).error == 'Unknown job kind: test.unknown.'
+
+        # Повтор выполняется только после задержки
+        assert job_queue.run_pending() == 0
+        Job.query.filter(Job.job_id == job_id).update({'run_at': datetime.utcnow()})
+        db.session.commit()
+        assert job_queue.run_pending() == 1
+        rv = self.app.get(f'/jobs?id={job_id}')
+        assert rv.get_json()['status'] == 'done'
+        assert rv.get_json()['result'] == {'calls': 3}
+        assert rv.get_json()['attempts'] == 2
+
+        rv = self.app.get('/jobs?status=failed')
+        assert [x['job_id'] for x in rv.get_json()['jobs']] == [unknown_id, failed_id]
+        assert not self.app.get('/jobs?status=lost').get_json()['success']
+        assert 'No job found' in self.app.get('/jobs?id=100').get_json()['message']
+
+        # Ограничение выполняемых задач одного типа
+        job_id = job_queue.enqueue('test.flaky', {'fail': 0}).job_id
+        db.session.commit()
+        job_queue.JOB_KIND_CONCURRENCY['test.flaky'] = 1
+        try:
+            running = job_queue.claim('test')
+            assert running.job_id == job_id
+            job_queue.enqueue('test.flaky', {'fail': 0})
+            db.session.commit()
+            assert job_queue.claim('test') is None
+
+            # Задача упавшего воркера возвращается в очередь по таймауту
+            Job.query.filter(Job.job_id == job_id).update({'started_at': datetime.utcnow() - timedelta(days=1)})
+            db.session.commit()
+            assert job_queue.requeue_stale() == 1
+            assert Job.query.get(job_id).status == 'queued'
+
+            # Воркер, у которого задачу забрали по таймауту, откатывает ее изменения
+            taken = job_queue.claim('other')
+            db.session.expunge(taken)
+            Job.query.filter(Job.job_id == taken.job_id).update({'locked_by': 'third'})
+            db.session.commit()
+            assert not job_queue.run(taken)
+            assert Job.query.get(taken.job_id).status == 'running'
+        finally:
+            del job_queue.JOB_KIND_CONCURRENCY['test.flaky']
+            del job_queue.tasks['test.flaky']
+
+    def test_bulk_create_books_background(self):
+        """Тест пакетного создания книг фоновой задачей."""
+        db.session.commit()
+        data = [
+            {'book': {'name': 'Kolobok', 'description': 'The story about bread.'}, 'author_id': [1, 2]},
+            {'book': {'name': 'Repka'}, 'author_id': [1]},
+        ]
+        rv = self.app.post('/books/bulk?background=1', json=data)
+        json_resp = rv.get_json()
+        assert json_resp['success']
+        assert len(Book.query.all()) == 10
+        # Без Idempotency-Key каждый запрос ставит новую задачу
+        rv = self.app.post('/books/bulk?background=1', json=data)
+        second_id = rv.get_json()['job_id']
+        assert second_id != json_resp['job_id']
+        Job.query.filter(Job.job_id == second_id).delete()
+        db.session.commit()
+
+        assert job_queue.run_pending() == 1
+        result = self.app.get(f'/jobs?id={json_resp["job_id"]}').get_json()['result']
+        assert result['message'] == 'Created 1 of 2 books.'
+        assert sorted(result['errors']) == ['1']
+        assert Book.get_one_item(result['created'][0]['book_id']).name == 'Kolobok'
+
+        rv = self.app.post('/books/bulk?background=1', json={'book': {}})
+        assert not rv.get_json()['success']
+
+    def test_bulk_create_books_idempotency_key(self):
+        """Тест повторной постановки пакетного создания книг с Idempotency-Key."""
+        from datetime import datetime, timedelta
+
+        db.session.commit()
+        data = [{'book': {'name': 'Kolobok', 'description': 'The story about bread.'}, 'author_id': [1]}]
+        headers = {'Idempotency-Key': 'kolobok'}
+        job_id = self.app.post('/books/bulk?background=1', json=data, headers=headers).get_json()['job_id']
+        # Пока задача в очереди, тот же ключ возвращает ее
+        assert self.app.post('/books/bulk?background=1', json=data, headers=headers).get_json()['job_id'] == job_id
+        other = self.app.post('/books/bulk?background=1', json=data, headers={'Idempotency-Key': 'other'})
+        assert other.get_json()['job_id'] != job_id
+        Job.query.filter(Job.job_id == other.get_json()['job_id']).delete()
+        db.session.commit()
+
+        # После done ключ освобождается и тот же список создается снова
+        assert job_queue.run_pending() == 1
+        assert Job.query.get(job_id).dedup_key is None
+        again_id = self.app.post('/books/bulk?background=1', json=data, headers=headers).get_json()['job_id']
+        assert again_id != job_id
+        assert job_queue.run_pending() == 1
+        assert Book.query.filter(Book.name == 'Kolobok').count() == 2
+
+        # Задача старше JOB_DEDUP_TTL не возвращается
+        expired_id = self.app.post('/books/bulk?background=1', json=data, headers=headers).get_json()['job_id']
+        Job.query.filter(Job.job_id == expired_id).update({'created_at': datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+        rv = self.app.post('/books/bulk?background=1', json=data, headers=headers)
+        assert rv.get_json()['job_id'] != expired_id
+        assert Job.query.get(expired_id).dedup_key is None
+
+    def test_enqueue_after_failed_job(self):
+        """Тест повторной постановки задачи с ключом после ее неудачи."""
+        @job_queue.task('test.failing')
+        def failing():
+            raise RuntimeError('Failing')
+
+        try:
+            job_id = job_queue.enqueue('test.failing', max_attempts=1, key='once').job_id
+            db.session.commit()
+            assert job_queue.enqueue('test.failing', key='once').job_id == job_id
+            db.session.commit()
+            assert job_queue.run_pending() == 1
+            assert Job.query.get(job_id).status == 'failed'
+            assert job_queue.enqueue('test.failing', key='once').job_id != job_id
+            db.session.commit()
+        finally:
+            del job_queue.tasks['test.failing']
+
+    def test_rate_limit(self):
+        """Тест ограничения частоты запросов клиента."""
+        from instrumentation import metrics
+
+        db.session.commit()
+        rejected = metrics.get('app_rate_limited_total', scope='books', method='PATCH', reason='rate') or 0
+        app.config['RATE_LIMITS'] = {'books.PATCH': '2/60', 'authors': '1/60'}
+        try:
+            for _ in range(2):
+                assert self.app.patch('/books', json={'book_id': 1, 'rating': 4}).get_json()['success']
+            rv = self.app.patch('/books', json={'book_id': 1, 'rating': 4})
+            assert rv.status_code == 429
+            assert not rv.get_json()['success']
+            assert 1 <= int(rv.headers['Retry-After']) <= 30
+            assert Book.get_one_item(1).count_marks == 2
+            assert metrics.get('app_rate_limited_total', scope='books', method='PATCH', reason='rate') == rejected + 1
+
+            # Другие методы и блюпринты считаются отдельно
+            assert self.app.get('/books').status_code == 200
+            assert self.app.get('/authors').status_code == 200
+            assert self.app.get('/authors?id=1').status_code == 429
+        finally:
+            app.config['RATE_LIMITS'] = {}
+
+        # Слоты одновременных запросов освобождаются после ответа
+        app.config['RATE_LIMIT_CONCURRENCY'] = 1
+        try:
+            for _ in range(3):
+                assert self.app.get('/authors?limit=2').status_code == 200
+            assert ratelimit.in_flight.acquire('client', 1)
+            assert not ratelimit.in_flight.acquire('client', 1)
+            ratelimit.in_flight.release('client')
+        finally:
+            app.config['RATE_LIMIT_CONCURRENCY'] = 0
+
+    def test_rate_limit_sqlite_store(self):
+        """Тест хранилища корзин лимитов в файле SQLite."""
+        import os
+        import tempfile
+
+        path = os.path.join(tempfile.mkdtemp(), 'rate_limit.sqlite')
+        store = ratelimit.SqliteStore(path)
+        assert store.take('books:client', 1, 2, 100) == 0
+        assert store.take('books:client', 1, 2, 100) == 0
+        assert store.take('books:client', 1, 2, 100) == 1
+        assert store.take('books:client', 1, 2, 100.5) == 0.5
+        assert store.take('books:client', 1, 2, 101) == 0
+        # Другой процесс видит те же корзины
+        assert ratelimit.SqliteStore(path).take('books:client', 1, 2, 101) == 1
+
+    def test_compression(self):
+        """Тест сжатия JSON-ответов по Accept-Encoding."""
+        import gzip
+        import zlib
+
+        db.session.commit()
+        app.config['COMPRESS_MIN_SIZE'] = 100
+        try:
+            plain = self.app.get('/authors?limit=10&top_books=3')
+            assert 'Content-Encoding' not in plain.headers
+            assert 'Accept-Encoding' in plain.headers['Vary']
+
+            rv = self.app.get('/authors?limit=10&top_books=3', headers={'Accept-Encoding': 'gzip, deflate'})
+            assert rv.headers['Content-Encoding'] == 'gzip'
+            assert 'Accept-Encoding' in rv.headers['Vary']
+            assert len(rv.data) < len(plain.data)
+            assert gzip.decompress(rv.data) == plain.data
+
+            rv = self.app.get('/authors?limit=10&top_books=3', headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+            assert rv.headers['Content-Encoding'] == 'deflate'
+            assert zlib.decompress(rv.data) == plain.data
+
+            # Маленькие и потоковые ответы не сжимаются
+            rv = self.app.get('/ping', headers={'Accept-Encoding': 'gzip'})
+            assert 'Content-Encoding' not in rv.headers
+            rv = self.app.get('/authors?limit=10&stream=1', headers={'Accept-Encoding': 'gzip'})
+            assert 'Content-Encoding' not in rv.headers
+            assert rv.get_json()['authors']
+
+            app.config['COMPRESSION'] = False
+            rv = self.app.get('/authors?limit=10&top_books=3', headers={'Accept-Encoding': 'gzip'})
+            assert rv.data == plain.data
+        finally:
+            app.config['COMPRESS_MIN_SIZE'] = 1024
+            app.config['COMPRESSION'] = True
+
+    def test_compressed_cache_entries(self):
+        """Тест хранения сжатых ответов в кеше отдельных записей."""
+        import gzip
+        import cache as cache_module
+        from instrumentation import metrics
+
+        db.session.commit()
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            plain = self.app.get('/books?id=1')
+            rv = self.app.get('/books?id=1', headers={'Accept-Encoding': 'gzip'})
+            assert gzip.decompress(rv.data) == plain.data
+            compressed = metrics.get('app_compression_bytes_total', direction='in')
+
+            # Повторный запрос берет сжатое тело из кеша
+            again = self.app.get('/books?id=1', headers={'Accept-Encoding': 'gzip'})
+            assert again.data == rv.data
+            assert again.headers['Content-Encoding'] == 'gzip'
+            assert again.headers['ETag'] == plain.headers['ETag']
+            assert metrics.get('app_compression_bytes_total', direction='in') == compressed
+
+            # Сжатие после invalidate() не возвращает в кеш удаленную запись
+            def compress_after_invalidate(*args):
+                cache_module.invalidate(books_id=[1])
+                return compress(*args)
+
+            compress = cache_module.compress
+            cache_module.compress = compress_after_invalidate
+            try:
+                rv = self.app.get('/books?id=1', headers={'Accept-Encoding': 'deflate'})
+            finally:
+                cache_module.compress = compress
+            assert rv.headers['Content-Encoding'] == 'deflate'
+            assert cache.get(cache_module.book_key(1)) is None
+            assert cache.get(cache_module.encoded_key(cache_module.book_key(1), 'gzip')) is None
+        finally:
+            app.config['COMPRESS_MIN_SIZE'] = 1024
+
     def test_pagination_authors(self):
         """Тестирование работы пагинации при запросе авторов."""
         from data_test import DATA_TEST_AUTHORS_PAGINATION
@@ -318,6 +1006,105 @@ class TestCase(unittest.TestCase):
         assert json_resp['pagination'] == DATA_TEST_BOOKS_PAGINATION
         assert rv.status == '200 OK'
 
+    def test_page_size_policy(self):
+        """Тест ограничения размера страницы списков."""
+        from instrumentation import metrics
+        from pagination import PAGE_SIZE_LIMITS
+
+        db.session.commit()
+        rv = self.app.get('/books?pagin=2&page=1')
+        assert len(rv.get_json()['books']) == 2
+
+        rejected = metrics.get('app_page_size_rejected_total', endpoint='books', reason='too_large') or 0
+        assert not self.app.get('/books?pagin=101').get_json()['success']
+        assert not self.app.get('/books?limit=1000&stream=1').get_json()['success']
+        assert metrics.get('app_page_size_rejected_total', endpoint='books', reason='too_large') == rejected + 2
+        assert not self.app.get('/authors?limit=0').get_json()['success']
+        assert not self.app.get('/authors?pagin=abc').get_json()['success']
+
+        PAGE_SIZE_LIMITS['books_top'] = 2
+        try:
+            assert not self.app.get('/books/top?limit=3').get_json()['success']
+            assert len(self.app.get('/books/top').get_json()['books']) == 2
+        finally:
+            del PAGE_SIZE_LIMITS['books_top']
+
+        # top_books ограничен хранимым в author_stats количеством лучших книг
+        rv = self.app.get(f'/authors?limit=2&top_books={AUTHOR_STATS_TOP}')
+        assert rv.get_json()['authors']
+        for top in (AUTHOR_STATS_TOP + 1, 1000000, 0, 'abc'):
+            rv = self.app.get(f'/authors?limit=2&top_books={top}')
+            assert not rv.get_json()['success']
+            assert rv.get_json()['message'] == f'Invalid page size: {top}, expected 1..{AUTHOR_STATS_TOP}.'
+        assert not self.app.get('/authors?page=1&top_books=1000000').get_json()['success']
+        assert self.app.get('/authors?id=1&top_books=1000000').get_json()['author_id'] == 1
+
+    def test_cursor_pagination_books(self):
+        """Тестирование курсорной пагинации при запросе книг."""
+        db.session.commit()
+
+        rv = self.app.get('/books?limit=4')
+        json_resp = rv.get_json()
+        assert rv.status == '200 OK'
+        assert [x['book_id'] for x in json_resp['books']] == [1, 2, 3, 4]
+        assert json_resp['pagination']['has_next']
+
+        rv = self.app.get(f'/books?limit=4&after={json_resp["pagination"]["next_cursor"]}')
+        json_resp = rv.get_json()
+        assert [x['book_id'] for x in json_resp['books']] == [5, 6, 7, 8]
+
+        rv = self.app.get(f'/books?limit=4&after={json_resp["pagination"]["next_cursor"]}')
+        json_resp = rv.get_json()
+        assert [x['book_id'] for x in json_resp['books']] == [9, 10]
+        assert not json_resp['pagination']['has_next']
+        assert json_resp['pagination']['next_cursor'] is None
+
+        rv = self.app.get('/books?after=broken')
+        json_resp = rv.get_json()
+        assert not json_resp['success']
+
+    def test_cursor_pagination_books_by_rating(self):
+        """Тестирование курсорной пагинации книг по рейтингу."""
+        self.app.patch('/books', json={"book_id": 4, "rating": 1})
+        self.app.patch('/books', json={"book_id": 5, "rating": 5})
+        self.app.patch('/books', json={"book_id": 6, "rating": 3})
+
+        rv = self.app.get('/books?limit=2&order=rating')
+        json_resp = rv.get_json()
+        assert [x['book_id'] for x in json_resp['books']] == [5, 6]
+
+        rv = self.app.get(f'/books?limit=2&order=rating&after={json_resp["pagination"]["next_cursor"]}')
+        json_resp = rv.get_json()
+        assert [x['book_id'] for x in json_resp['books']] == [4, 1]
+
+    def test_cursor_pagination_authors(self):
+        """Тестирование курсорной пагинации при запросе авторов."""
+        db.session.commit()
+
+        rv = self.app.get('/authors?limit=6')
+        json_resp = rv.get_json()
+        assert [x['author_id'] for x in json_resp['authors']] == [1, 2, 3, 4, 5, 6]
+        assert json_resp['pagination']['has_next']
+
+        rv = self.app.get(f'/authors?after={json_resp["pagination"]["next_cursor"]}&limit=6')
+        json_resp = rv.get_json()
+        assert [x['author_id'] for x in json_resp['authors']] == [7, 8, 9, 10]
+        assert not json_resp['pagination']['has_next']
+
+    def test_error_responses_not_shared(self):
+        """Тест, что сообщения об ошибках не сохраняются в общих шаблонах ответов."""
+        from authors.blueprint import error_resp as authors_error_resp
+        from books.blueprint import error_resp as books_error_resp
+
+        # Старые обработчики изменяют общий шаблон, проверяются только обработчики курсоров и поиска
+        books_error_resp['message'] = authors_error_resp['message'] = ''
+        assert self.app.get('/books?limit=2&after=bad').get_json()['message']
+        assert self.app.get('/authors?limit=2&after=bad').get_json()['message']
+        assert self.app.get('/books/search?q=').get_json()['message'] == 'Empty search query.'
+        assert self.app.get('/books/search?q=def&after=bad').get_json()['message']
+        assert books_error_resp['message'] == ''
+        assert authors_error_resp['message'] == ''
+
     def test_get_book(self):
         """Тест на получение книги."""
         from data_test import DATA_GET_BOOK_BY_ID
@@ -328,6 +1115,140 @@ class TestCase(unittest.TestCase):
         assert json_resp == DATA_GET_BOOK_BY_ID
         assert rv.status == '200 OK'
 
+    def test_cache_invalidation(self):
+        """Тест сброса кеша книги и ее авторов при изменениях."""
+        from cache import author_key, book_key
+
+        db.session.commit()
+        assert self.app.get('/books?id=1').get_json()['rating'] == 0
+        assert self.app.get('/authors?id=2').get_json()['books'][0]['rating'] == 0
+        assert cache.get(book_key(1)) is not None
+        assert cache.get(author_key(2)) is not None
+
+        self.app.patch('/books', json={"book_id": 1, "rating": 4})
+        assert cache.get(book_key(1)) is None
+        assert cache.get(author_key(1)) is None
+        assert cache.get(author_key(2)) is None
+        assert self.app.get('/books?id=1').get_json()['rating'] == 4
+        assert self.app.get('/authors?id=2').get_json()['books'][0]['rating'] == 4
+
+        self.app.put('/authors', json={"author_id": 3, "book_id": [1]})
+        assert cache.get(book_key(1)) is None
+        authors_id = sorted(x['author_id'] for x in self.app.get('/books?id=1').get_json()['authors'])
+        assert authors_id == [1, 2, 3]
+
+        self.app.patch('/authors', json={"author_id": 3, "book_id": 1})
+        authors_id = sorted(x['author_id'] for x in self.app.get('/books?id=1').get_json()['authors'])
+        assert authors_id == [1, 2]
+
+        # Изменение в другом процессе не очищает кеш в памяти этого процесса
+        etag = self.app.get('/books?id=1').headers['ETag']
+        Book.query.filter_by(book_id=1).update({'name': 'Changed', 'version': Book.version + 1})
+        db.session.commit()
+        rv = self.app.get('/books?id=1')
+        assert rv.get_json()['name'] == 'Changed'
+        assert rv.headers['ETag'] != etag
+
+    def test_conditional_get(self):
+        """Тест ответа 304 на If-None-Match и If-Modified-Since."""
+        db.session.commit()
+
+        rv = self.app.get('/books?id=1')
+        etag = rv.headers['ETag']
+        last_modified = rv.headers['Last-Modified']
+        rv = self.app.get('/books?id=1', headers={'If-None-Match': etag})
+        assert rv.status == '304 NOT MODIFIED'
+        assert rv.get_data() == b''
+        rv = self.app.get('/books?id=1', headers={'If-Modified-Since': last_modified})
+        assert rv.status == '304 NOT MODIFIED'
+
+        rv = self.app.get('/authors?pagin=2&page=1')
+        authors_etag = rv.headers['ETag']
+        rv = self.app.get('/authors?pagin=2&page=1', headers={'If-None-Match': authors_etag})
+        assert rv.status == '304 NOT MODIFIED'
+        rv = self.app.get('/authors?limit=2')
+        cursor_etag = rv.headers['ETag']
+        assert cursor_etag != authors_etag
+
+        # Оценка книги меняет и книгу, и ее авторов
+        self.app.patch('/books', json={"book_id": 1, "rating": 3})
+        rv = self.app.get('/books?id=1', headers={'If-None-Match': etag})
+        assert rv.status == '200 OK'
+        assert rv.headers['ETag'] != etag
+        rv = self.app.get('/authors?pagin=2&page=1', headers={'If-None-Match': authors_etag})
+        assert rv.status == '200 OK'
+        rv = self.app.get('/authors?limit=2', headers={'If-None-Match': cursor_etag})
+        assert rv.status == '200 OK'
+
+        rv = self.app.get('/books?pagin=2&page=2')
+        books_etag = rv.headers['ETag']
+        self.app.put('/authors', json={"author_id": 3, "book_id": [3]})
+        rv = self.app.get('/books?pagin=2&page=2', headers={'If-None-Match': books_etag})
+        assert rv.status == '200 OK'
+
+    def test_search_books(self):
+        """Тест полнотекстового поиска книг."""
+        db.session.commit()
+        data = [
+            {'book': {'name': 'Kolobok', 'description': 'The story about bread.'}, 'author_id': [1]},
+            {'book': {'name': 'Bread', 'description': 'How to bake bread.'}, 'author_id': [1]},
+            {'book': {'name': 'Breakfast', 'description': 'Morning story.'}, 'author_id': [2]},
+        ]
+        self.app.post('/books/bulk', json=data)
+
+        rv = self.app.get('/books/search?q=bread')
+        json_resp = rv.get_json()
+        # Авторы найденных книг загружаются одним запросом
+        assert self.count_queries(lambda: self.app.get('/books/search?q=b&limit=3')) == 2
+        assert rv.status == '200 OK'
+        assert [x['name'] for x in json_resp['books']] == ['Bread', 'Kolobok']
+        assert json_resp['books'][0]['score'] > json_resp['books'][1]['score']
+
+        # Префиксный поиск по всем словам запроса
+        rv = self.app.get('/books/search?q=brea&limit=2')
+        json_resp = rv.get_json()
+        assert [x['name'] for x in json_resp['books']] == ['Bread', 'Breakfast']
+        assert json_resp['pagination']['has_next']
+        rv = self.app.get(f'/books/search?q=brea&limit=2&after={json_resp["pagination"]["next_cursor"]}')
+        json_resp = rv.get_json()
+        assert [x['name'] for x in json_resp['books']] == ['Kolobok']
+        assert not json_resp['pagination']['has_next']
+
+        rv = self.app.get('/books/search?q=story+morn')
+        assert [x['name'] for x in rv.get_json()['books']] == ['Breakfast']
+
+        self.app.post('/books', json={'book': {'name': 'Morning', 'description': 'Sun'}, 'author_id': [3]})
+        rv = self.app.get('/books/search?q=morn')
+        assert [x['name'] for x in rv.get_json()['books']] == ['Morning', 'Breakfast']
+
+        rv = self.app.get('/books/search?q=')
+        assert not rv.get_json()['success']
+
+    def test_search_books_pages(self):
+        """Тест постраничного поиска: страницы без пропусков и повторов при равной релевантности."""
+        from pagination import decode_cursor
+
+        db.session.commit()
+        data = [
+            {'book': {'name': f'Bread {i}', 'description': 'bread ' * (i % 3) + 'story'}, 'author_id': [1]}
+            for i in range(11)
+        ]
+        self.app.post('/books/bulk', json=data)
+        everything = self.app.get('/books/search?q=bread&limit=100').get_json()['books']
+        assert len(everything) == 11
+
+        for limit in (1, 2, 3, 4):
+            found = []
+            path = f'/books/search?q=bread&limit={limit}'
+            while path:
+                json_resp = self.app.get(path).get_json()
+                found += [x['book_id'] for x in json_resp['books']]
+                cursor = json_resp['pagination']['next_cursor']
+                path = cursor and f'/books/search?q=bread&limit={limit}&after={cursor}'
+                # Релевантность в курсоре целая и точно сравнивается после JSON
+                assert cursor is None or isinstance(decode_cursor(cursor)['score'], int)
+            assert found == [x['book_id'] for x in everything]
+
     def test_get_list_of_books(self):
         """Тест на получение списка книг."""
         from data_test import DATA_GET_BOOK_LIST
@@ -360,6 +1281,132 @@ class TestCase(unittest.TestCase):
         books = [(x['book_id'], x['rating']) for x in author['books']]
         assert books == result
 
+        rv = self.app.get('/authors?top_books=2')
+        json_resp = rv.get_json()
+        author = next((x for x in json_resp['authors'] if x['author_id'] == 2), None)
+        books = [(x['book_id'], x['rating']) for x in author['books']]
+        assert books == result[:2]
+
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncResponse(object):
+    """Ответ асинхронного сервера с интерфейсом ответа тестового клиента Flask."""
+
+    def __init__(self, status_code, headers, data):
+        from werkzeug.http import HTTP_STATUS_CODES
+
+        self.status_code = status_code
+        # Строка статуса в том же виде, что у Werkzeug
+        self.status = f'{status_code} {HTTP_STATUS_CODES[status_code].upper()}'
+        self.headers = headers
+        self.mimetype = headers.get('Content-Type', '').split(';')[0].strip()
+        self.data = data
+
+    def get_data(self, as_text=False):
+        return self.data.decode() if as_text else self.data
+
+    def get_json(self):
+        return json.loads(self.data)
+
+
+class AsyncClient(object):
+    """Клиент тестов, который отправляет запросы асинхронному серверу по HTTP."""
+
+    def __init__(self):
+        import asyncio
+        import threading
+        from aiohttp import web
+        from async_app import make_app
+
+        self.loop = asyncio.new_event_loop()
+        self.runner = web.AppRunner(make_app())
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        import asyncio
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def open(self, path, method='GET', json=None, headers=None, **kwargs):
+        import urllib.error
+        import urllib.request
+
+        data = None
+        headers = dict(headers or {})
+        if json is not None:
+            data = globals()['json'].dumps(json).encode()
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(f'http://127.0.0.1:{self.port}{path}', data, headers, method=method)
+        # Тестовый клиент Flask обрабатывает запрос в потоке теста и в конце
+        # закрывает его сессию, здесь сессия закрывается так же
+        db.session.remove()
+        try:
+            with urllib.request.urlopen(request) as response:
+                return AsyncResponse(response.status, response.headers, response.read())
+        except urllib.error.HTTPError as e:
+            return AsyncResponse(e.code, e.headers, e.read())
+        finally:
+            db.session.remove()
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, 'PUT', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, 'PATCH', **kwargs)
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncTestCase(TestCase):
+    """Те же тесты для асинхронного режима сервера (async_app.py)."""
+
+    def setUp(self):
+        super(AsyncTestCase, self).setUp()
+        # Асинхронный сервер читает базу своими соединениями
+        db.session.commit()
+        self.app = AsyncClient()
+
+    def tearDown(self):
+        self.app.close()
+        super(AsyncTestCase, self).tearDown()
+
+    @unittest.skip('GET /books?id= is served from the database, not from the cache of the Flask app')
+    def test_cache_invalidation(self):
+        pass
+
+    @unittest.skip('GET /books?id= is served from the database, not from the cache of the Flask app')
+    def test_compressed_cache_entries(self):
+        pass
+
+    @unittest.skip('Server-Timing is added only to responses of the Flask app')
+    def test_instrumentation(self):
+        pass
+
+    @unittest.skip('Relies on the Flask test client rolling back uncommitted fill_db data')
+    def test_change_book_rating_negative(self):
+        pass
+
+    @unittest.skip('Relies on the Flask test client rolling back uncommitted fill_db data')
+    def test_delete_book_from_author_negative(self):
+        pass
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,194 @@
+import json
+import sys
+import time
+from itertools import islice
+
+from flask_script import Command, Option
+from marshmallow import EXCLUDE
+from marshmallow.exceptions import ValidationError
+
+import author_stats
+from app import db
+from cache import cache
+from models import Author, Book, books
+from search import search_index
+from schemas import AuthorSchema, BookSchema, BookSchemaExt
+
+
+class Progress(object):
+    """Вывод прогресса и скорости обработки записей в stderr."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.count = 0
+        self.started = time.monotonic()
+
+    def add(self, count):
+        self.count += count
+        print(f'{self.kind}: {self.count} rows, {self.rate():.0f} rows/s', file=sys.stderr)
+
+    def rate(self):
+        return self.count / max(time.monotonic() - self.started, 1e-6)
+
+    def done(self):
+        elapsed = time.monotonic() - self.started
+        print(f'{self.kind}: done, {self.count} rows in {elapsed:.1f}s ({self.rate():.0f} rows/s)', file=sys.stderr)
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def export_ndjson(stream, chunk_size):
+    """Выгрузить авторов, а затем книги с авторами, по одной записи на строку.
+
+    Строки имеют вид {"author": {...}} и {"book": {...}} в формате дампов
+    AuthorSchema и BookSchemaExt. Записи читаются серверным курсором
+    порциями по chunk_size, поэтому память не зависит от размера базы.
+    """
+    author_schema = AuthorSchema()
+    book_schema = BookSchemaExt()
+
+    progress = Progress('authors')
+    rows = db.session.query(Author.author_id, Author.name, Author.sername) \
+        .order_by(Author.author_id) \
+        .execution_options(stream_results=True) \
+        .yield_per(chunk_size)
+    for chunk in chunks(rows, chunk_size):
+        for row in chunk:
+            stream.write(json.dumps({'author': author_schema.dump(row)}) + '\n')
+        progress.add(len(chunk))
+    progress.done()
+
+    progress = Progress('books')
+    rows = db.session.query(
+        Book.book_id, Book.name, Book.description, Book.rating, Book.count_marks
+    ).order_by(Book.book_id) \
+        .execution_options(stream_results=True) \
+        .yield_per(chunk_size)
+    # Пока открыт серверный курсор, авторов книг читаем через отдельное соединение
+    with db.engine.connect() as conn:
+        for chunk in chunks(rows, chunk_size):
+            book_authors = {x.book_id: [] for x in chunk}
+            links = db.select([books.c.book_id, Author.author_id, Author.name, Author.sername]) \
+                .select_from(books.join(Author, Author.author_id == books.c.author_id)) \
+                .where(books.c.book_id.in_(list(book_authors))) \
+                .order_by(books.c.book_id, Author.author_id)
+            for link in conn.execute(links):
+                book_authors[link.book_id].append(link)
+
+            for row in chunk:
+                item = dict(row._asdict(), authors=book_authors[row.book_id])
+                stream.write(json.dumps({'book': book_schema.dump(item)}) + '\n')
+            progress.add(len(chunk))
+    progress.done()
+
+
+def import_ndjson(stream, chunk_size):
+    """Загрузить авторов и книги из NDJSON, выгруженного export_ndjson.
+
+    ID записей сохраняются. Записи вставляются через executemany порциями
+    по chunk_size, каждая порция в своей транзакции. Невалидные строки
+    пропускаются, их номера выводятся в stderr.
+    """
+    author_schema = AuthorSchema(unknown=EXCLUDE)
+    book_schema = BookSchema(unknown=EXCLUDE)
+    authors_rows = []
+    books_rows = []
+    links_rows = []
+    authors_progress = Progress('authors')
+    books_progress = Progress('books')
+
+    def flush_authors():
+        if authors_rows:
+            db.session.execute(Author.__table__.insert(), authors_rows)
+            db.session.commit()
+            authors_progress.add(len(authors_rows))
+            authors_rows.clear()
+
+    def flush_books():
+        # Авторы книг должны быть вставлены раньше связей с ними
+        flush_authors()
+        if books_rows:
+            db.session.execute(Book.__table__.insert(), books_rows)
+            if links_rows:
+                db.session.execute(books.insert(), links_rows)
+            db.session.commit()
+            books_progress.add(len(books_rows))
+            books_rows.clear()
+            links_rows.clear()
+
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if 'author' in item:
+                data = author_schema.load(item['author'])
+                data['author_id'] = int(item['author']['author_id'])
+                authors_rows.append(data)
+            else:
+                data = book_schema.load(item['book'])
+                data.setdefault('rating', .0)
+                data.setdefault('count_marks', 0)
+                data['book_id'] = int(item['book']['book_id'])
+                data['rating_sum'] = round(data['rating'] * data['count_marks'])
+                links = [
+                    {'book_id': data['book_id'], 'author_id': int(a['author_id'])}
+                    for a in item['book'].get('authors', [])
+                ]
+                books_rows.append(data)
+                links_rows.extend(links)
+        except (ValueError, TypeError, KeyError, ValidationError) as e:
+            print(f'line {line_num}: skipped, {e}', file=sys.stderr)
+            continue
+
+        if len(authors_rows) >= chunk_size:
+            flush_authors()
+        if len(books_rows) >= chunk_size:
+            flush_books()
+
+    flush_books()
+    author_stats.rebuild()
+    db.session.commit()
+    # Загруженные связи могли изменить уже закешированных авторов
+    cache.clear()
+    search_index.reset()
+    authors_progress.done()
+    books_progress.done()
+
+
+class ExportCommand(Command):
+    """Выгрузить авторов и книги в NDJSON."""
+
+    option_list = (
+        Option('-o', '--output', dest='path', default='-', help='File path, "-" for stdout'),
+        Option('-c', '--chunk', dest='chunk_size', type=int, default=1000, help='Rows per chunk'),
+    )
+
+    def run(self, path, chunk_size):
+        if path == '-':
+            export_ndjson(sys.stdout, chunk_size)
+        else:
+            with open(path, 'w') as f:
+                export_ndjson(f, chunk_size)
+
+
+class ImportCommand(Command):
+    """Загрузить авторов и книги из NDJSON."""
+
+    option_list = (
+        Option('-i', '--input', dest='path', default='-', help='File path, "-" for stdin'),
+        Option('-c', '--chunk', dest='chunk_size', type=int, default=1000, help='Rows per chunk'),
+    )
+
+    def run(self, path, chunk_size):
+        if path == '-':
+            import_ndjson(sys.stdin, chunk_size)
+        else:
+            with open(path) as f:
+                import_ndjson(f, chunk_size)
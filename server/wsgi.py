@@ -0,0 +1,13 @@
+"""Точка входа сервера.
+
+Production: gunicorn -c gunicorn.conf.py wsgi:app
+Разработка: python wsgi.py
+"""
+from app import app, init_db
+
+
+init_db(app)
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=8080, host='0.0.0.0')